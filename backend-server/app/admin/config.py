@@ -4,6 +4,8 @@ Admin panel configuration using SQLAdmin
 
 from sqladmin import ModelView
 from ..models.models import User, Wallet, Offer, Trade, TradeMessage, Transaction
+from ..core.order_book import order_book
+from ..core.security import clear_principals
 
 class UserAdmin(ModelView, model=User):
     """Admin interface for User model."""
@@ -17,9 +19,18 @@ class UserAdmin(ModelView, model=User):
     name_plural = "Users"
     icon = "fa-solid fa-users"
 
+    async def after_model_change(self, data, model, is_created, request):
+        # Admin edits can block users or change their email
+        clear_principals()
+
+    async def after_model_delete(self, model, request):
+        clear_principals()
+
 class WalletAdmin(ModelView, model=Wallet):
     """Admin interface for Wallet model."""
-    column_list = [Wallet.id, Wallet.user_id, Wallet.currency, Wallet.balance, Wallet.is_escrow]
+    column_list = [Wallet.id, Wallet.user_id, Wallet.currency, Wallet.balance_minor, Wallet.is_escrow]
+    # Balances only change through ledger postings, so the panel shows them read-only
+    form_excluded_columns = [Wallet.balance, Wallet.balance_minor, Wallet.posting_sequence, Wallet.postings]
     can_create = True
     can_edit = True
     can_delete = True
@@ -31,6 +42,8 @@ class WalletAdmin(ModelView, model=Wallet):
 class OfferAdmin(ModelView, model=Offer):
     """Admin interface for Offer model."""
     column_list = [Offer.id, Offer.seller_id, Offer.currency, Offer.min_amount, Offer.max_amount, Offer.price_per_unit, Offer.is_active]
+    # Set by trades and cleared by any write of is_active; see app.core.matching
+    form_excluded_columns = [Offer.is_exhausted]
     can_create = True
     can_edit = True
     can_delete = True
@@ -39,6 +52,13 @@ class OfferAdmin(ModelView, model=Offer):
     name_plural = "Offers"
     icon = "fa-solid fa-tag"
 
+    async def after_model_change(self, data, model, is_created, request):
+        # The book serves offer lists, depth and the feed, and tells the other workers
+        order_book.upsert(model)
+
+    async def after_model_delete(self, model, request):
+        order_book.remove(model.id)
+
 class TradeAdmin(ModelView, model=Trade):
     """Admin interface for Trade model."""
     column_list = [Trade.id, Trade.trade_id, Trade.buyer_id, Trade.seller_id, Trade.amount, Trade.price_per_unit, Trade.total_price, Trade.status]
@@ -0,0 +1,31 @@
+"""
+Shared cache and pub/sub backend, so state stays consistent across uvicorn workers
+"""
+
+import os
+from dotenv import load_dotenv
+from .base import Backend, Handler
+from .memory import MemoryBackend, MemoryBroker
+
+load_dotenv()
+
+# Shared backend configuration; memory:// keeps everything in this process
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "memory://")
+CACHE_BACKEND_PREFIX = os.getenv("CACHE_BACKEND_PREFIX", "nexusswap:")
+CACHE_BACKEND_MAX_KEYS = int(os.getenv("CACHE_BACKEND_MAX_KEYS", "100000"))
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "10000"))
+
+
+def create_backend(url: str) -> Backend:
+    """Build the backend a URL names: memory://, or redis:// / rediss:// / unix:// for Redis."""
+    scheme = url.partition("://")[0]
+    if scheme == "memory":
+        return MemoryBackend(MemoryBroker(CACHE_BACKEND_MAX_KEYS))
+    if scheme in ("redis", "rediss", "unix"):
+        # Imported here so the Redis client is only needed when configured
+        from .redis import RedisBackend
+        return RedisBackend(url, CACHE_BACKEND_PREFIX, PUBSUB_QUEUE_SIZE)
+    raise ValueError(f"Unsupported CACHE_BACKEND_URL scheme: {scheme}")
+
+
+backend = create_backend(CACHE_BACKEND_URL)
@@ -0,0 +1,102 @@
+"""
+Interface of the key-value and pub/sub backend shared by every worker
+"""
+
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+import ujson
+from .. import metrics
+
+# Called with the decoded message
+Handler = Callable[[Any], None]
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = metrics.registry.register(metrics.Counter(
+    "backend_messages_total",
+    "Pub/sub messages published to and received from other workers, and those dropped.",
+    ("direction",),
+))
+RESETS = metrics.registry.register(metrics.Counter(
+    "backend_resets_total", "Times the backend may have missed messages and caches were reset."
+))
+
+
+class Backend(ABC):
+    """Key-value store with TTLs, atomic counters and pub/sub, shared by every worker.
+
+    Values are bytes. Messages are anything JSON can encode, and reach the
+    handlers subscribed in every other worker but not the publisher's own:
+    a worker applies its own change directly and publishes it for its
+    peers. publish() never blocks and may be called from any thread, e.g.
+    from a book listener or an ORM hook. When a backend may have missed
+    messages, e.g. after reconnecting, it runs the reset callbacks so
+    callers can drop whatever those messages would have invalidated.
+    """
+
+    def __init__(self) -> None:
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._resets: List[Callable[[], None]] = []
+
+    async def start(self) -> None:
+        """Connect and start receiving messages; call from the running event loop."""
+
+    async def close(self) -> None:
+        """Stop receiving messages and release connections."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return the value stored under key, or None if absent or expired."""
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None, only_if_absent: bool = False) -> bool:
+        """Store a value for ttl seconds, or forever; returns False if only_if_absent and key exists."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Atomically add amount to a counter and return the result.
+
+        A missing counter starts at 0 and, with ttl, expires ttl seconds
+        after it was created, which suits fixed-window rate counters.
+        """
+
+    @abstractmethod
+    def publish(self, channel: str, message: Any) -> None:
+        """Send a message to the channel's handlers in every other worker."""
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel].append(handler)
+
+    def on_reset(self, callback: Callable[[], None]) -> None:
+        self._resets.append(callback)
+
+    def encode(self, message: Any) -> bytes:
+        return ujson.dumps({"origin": self.origin, "message": message}).encode()
+
+    def dispatch(self, channel: str, payload: bytes) -> None:
+        """Hand a received message to the channel's handlers, unless this worker sent it."""
+        envelope = ujson.loads(payload)
+        if envelope["origin"] == self.origin:
+            return
+        MESSAGES.inc("received")
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(envelope["message"])
+            except Exception:
+                logger.exception("handler for channel %s failed", channel)
+
+    def reset(self) -> None:
+        RESETS.inc()
+        for callback in self._resets:
+            try:
+                callback()
+            except Exception:
+                logger.exception("backend reset callback failed")
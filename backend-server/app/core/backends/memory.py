@@ -0,0 +1,113 @@
+"""
+In-process backend for a single worker, or several simulated on one broker
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+from .base import MESSAGES, Backend
+
+_FOREVER = float("inf")
+
+
+class MemoryBroker:
+    """The keys and channels shared by the MemoryBackends attached to it.
+
+    Backends on one broker behave like workers sharing a Redis server, so
+    cross-worker behaviour can be exercised in a single process. Keys are
+    evicted least recently used beyond maxsize.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.backends: List["MemoryBackend"] = []
+        self._values: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[Tuple[float, bytes]]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        if item[0] <= time.monotonic():
+            del self._values[key]
+            return None
+        self._values.move_to_end(key)
+        return item
+
+    def _store(self, key: str, expires_at: float, value: bytes) -> None:
+        self._values[key] = (expires_at, value)
+        self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._live(key)
+            return item[1] if item is not None else None
+
+    def set(self, key: str, value: bytes, ttl: Optional[float], only_if_absent: bool) -> bool:
+        with self._lock:
+            if only_if_absent and self._live(key) is not None:
+                return False
+            self._store(key, _FOREVER if ttl is None else time.monotonic() + ttl, value)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def incr(self, key: str, amount: int, ttl: Optional[float]) -> int:
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                expires_at, value = (_FOREVER if ttl is None else time.monotonic() + ttl), 0
+            else:
+                expires_at, value = item[0], int(item[1])
+            value += amount
+            # Stored as digits, as Redis does, so get() reads the same on either backend
+            self._store(key, expires_at, str(value).encode())
+            return value
+
+
+class MemoryBackend(Backend):
+    """Backend held in process memory.
+
+    Alone on its broker, as it is by default, a backend has no peers, so
+    nothing published is encoded or sent anywhere. Handlers of peers on a
+    shared broker run synchronously in the publishing thread.
+    """
+
+    def __init__(self, broker: MemoryBroker) -> None:
+        super().__init__()
+        self.broker = broker
+        broker.backends.append(self)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.broker.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None, only_if_absent: bool = False) -> bool:
+        return self.broker.set(key, value, ttl, only_if_absent)
+
+    async def delete(self, key: str) -> None:
+        self.broker.delete(key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return self.broker.incr(key, amount, ttl)
+
+    def publish(self, channel: str, message: Any) -> None:
+        peers = [backend for backend in self.broker.backends if backend is not self]
+        if not peers:
+            return
+        payload = self.encode(message)
+        MESSAGES.inc("published")
+        for peer in peers:
+            peer.dispatch(channel, payload)
+
+    async def start(self) -> None:
+        if self not in self.broker.backends:
+            self.broker.backends.append(self)
+
+    async def close(self) -> None:
+        if self in self.broker.backends:
+            self.broker.backends.remove(self)
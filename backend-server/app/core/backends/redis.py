@@ -0,0 +1,149 @@
+"""
+Redis backend, shared by every worker pointed at the same server
+"""
+
+import asyncio
+import logging
+from typing import Any, List, Optional, Tuple
+from redis.asyncio import Redis
+from .base import MESSAGES, Backend
+
+logger = logging.getLogger(__name__)
+
+# Backoff between attempts to reconnect the subscriber
+RECONNECT_MIN_SECONDS = 0.5
+RECONNECT_MAX_SECONDS = 30.0
+
+
+class RedisBackend(Backend):
+    """Backend on a Redis server; keys and channels are namespaced by prefix.
+
+    publish() only queues the message, up to queue_size of them, and a
+    task sends the queue in order, so callers on any thread never wait on
+    the network. One pattern subscription over the prefix receives every
+    channel. If that connection drops, it is re-established with backoff
+    and the reset callbacks run, since messages may have been missed.
+    A client may be passed in instead of a URL, e.g. a fakeredis one.
+    """
+
+    def __init__(self, url: Optional[str], prefix: str, queue_size: int, client: Optional[Redis] = None) -> None:
+        super().__init__()
+        self.client = client if client is not None else Redis.from_url(url)
+        self.prefix = prefix
+        self.queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._outbox: Optional["asyncio.Queue[Tuple[str, bytes]]"] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    @staticmethod
+    def _milliseconds(ttl: Optional[float]) -> Optional[int]:
+        return None if ttl is None else max(1, int(ttl * 1000))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self._key(key))
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None, only_if_absent: bool = False) -> bool:
+        return bool(await self.client.set(
+            self._key(key), value, px=self._milliseconds(ttl), nx=only_if_absent
+        ))
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(self._key(key))
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        key = self._key(key)
+        if ttl is None:
+            return await self.client.incrby(key, amount)
+        # Creating the counter with its expiry in the same transaction keeps it from living forever
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(key, 0, px=self._milliseconds(ttl), nx=True)
+            pipe.incrby(key, amount)
+            _, value = await pipe.execute()
+        return value
+
+    def publish(self, channel: str, message: Any) -> None:
+        if self._loop is None:
+            # Not started, so no peer can be listening through this worker either
+            MESSAGES.inc("dropped")
+            return
+        item = (self.prefix + channel, self.encode(message))
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._enqueue(item)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, item)
+
+    def _enqueue(self, item: Tuple[str, bytes]) -> None:
+        try:
+            self._outbox.put_nowait(item)
+        except asyncio.QueueFull:
+            MESSAGES.inc("dropped")
+
+    async def _send(self) -> None:
+        while True:
+            channel, payload = await self._outbox.get()
+            try:
+                await self.client.publish(channel, payload)
+                MESSAGES.inc("published")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                MESSAGES.inc("dropped")
+                logger.warning("failed to publish to %s", channel, exc_info=True)
+
+    async def _subscribe(self) -> Any:
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.psubscribe(self.prefix + "*")
+        except BaseException:
+            await pubsub.reset()
+            raise
+        return pubsub
+
+    async def _receive(self, pubsub: Any) -> None:
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = await self._subscribe()
+                    self.reset()
+                delay = RECONNECT_MIN_SECONDS
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self.dispatch(message["channel"].decode()[len(self.prefix):], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("lost the Redis subscription, retrying in %.1fs", delay, exc_info=True)
+            if pubsub is not None:
+                await pubsub.reset()
+                pubsub = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+    async def start(self) -> None:
+        """Subscribe before returning, so nothing published after startup is missed."""
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue(maxsize=self.queue_size)
+        try:
+            pubsub = await self._subscribe()
+        except Exception:
+            logger.warning("could not subscribe to Redis, retrying in the background", exc_info=True)
+            pubsub = None
+        self._tasks = [self._loop.create_task(self._send()), self._loop.create_task(self._receive(pubsub))]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        await self.client.aclose()
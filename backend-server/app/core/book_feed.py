@@ -0,0 +1,106 @@
+"""
+Streaming order book deltas, coalesced per tick
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from ..schemas import offer_schemas
+from .order_book import BookEntry, OrderBook, order_book
+from .realtime import ChannelHub
+
+load_dotenv()
+
+# Book feed configuration
+BOOK_FEED_TICK_MS = int(os.getenv("BOOK_FEED_TICK_MS", "100"))
+
+
+def channel(currency: str) -> str:
+    return f"book:{currency}"
+
+
+def serialize(entry: BookEntry) -> Dict[str, Any]:
+    return offer_schemas.Offer.model_validate(entry).model_dump(mode="json")
+
+
+class BookFeed:
+    """Publishes order book changes per currency as sequenced delta frames.
+
+    Changes are collected per offer as the book reports them and flushed
+    once per tick, so a burst that touches an offer many times sends only
+    its final state. Each currency's deltas carry an increasing seq, and a
+    snapshot carries the seq of the last delta it already includes.
+    Deltas hold full offer states, so applying one twice is harmless.
+    """
+
+    def __init__(self, book: OrderBook, tick: float) -> None:
+        self.book = book
+        self.tick = tick
+        self.hub = ChannelHub()
+        self._pending: Dict[str, Dict[int, Tuple[str, Optional[BookEntry]]]] = defaultdict(dict)
+        self._seq: Dict[str, int] = defaultdict(int)
+        self._task: Optional["asyncio.Task[None]"] = None
+        book.add_listener(self.record)
+
+    def record(self, currency: str, op: str, offer_id: int, entry: Optional[BookEntry]) -> None:
+        """Merge a change into the pending tick; runs under the book lock."""
+        pending = self._pending[currency]
+        previous = pending.get(offer_id)
+        if previous is not None and previous[0] == "add":
+            # Subscribers never saw the offer, so only its latest state matters
+            if op == "remove":
+                del pending[offer_id]
+            else:
+                pending[offer_id] = ("add", entry)
+        elif previous is not None and previous[0] == "remove" and op == "add":
+            pending[offer_id] = ("update", entry)
+        else:
+            pending[offer_id] = (op, entry)
+
+    def flush(self) -> None:
+        """Publish one delta frame per currency with pending changes."""
+        with self.book.lock:
+            pending, self._pending = self._pending, defaultdict(dict)
+        for currency, changes in pending.items():
+            if not changes or not self.hub.subscriber_count(channel(currency)):
+                continue
+            self._seq[currency] += 1
+            self.hub.publish(channel(currency), {
+                "type": "delta",
+                "currency": currency,
+                "seq": self._seq[currency],
+                "changes": [
+                    {"op": op, "id": offer_id} if entry is None
+                    else {"op": op, "id": offer_id, "offer": serialize(entry)}
+                    for offer_id, (op, entry) in changes.items()
+                ],
+            })
+
+    def snapshot(self, currency: str) -> Dict[str, Any]:
+        """Return the full book for a currency, cheapest first."""
+        return {
+            "type": "snapshot",
+            "currency": currency,
+            "seq": self._seq[currency],
+            "offers": [serialize(entry) for entry in self.book.entries(currency)],
+        }
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+book_feed = BookFeed(order_book, BOOK_FEED_TICK_MS / 1000)
@@ -0,0 +1,138 @@
+"""
+Keeps each worker's in-memory order book in step with offers changed by the others
+"""
+
+import asyncio
+import logging
+from typing import Any, Iterable, Optional, Sequence, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+from ..database import async_engine
+from ..models.models import Offer
+from .backends import Backend, backend
+from .order_book import ENTRY_COLUMNS, BookEntry, OrderBook, order_book
+
+# Carries the ids of offers changed by a worker to the others
+CHANNEL = "offers"
+# Ids reloaded per SELECT, well under every database's bound parameter limit
+RELOAD_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class BookSync:
+    """Publishes the ids of offers this worker changes and reloads those changed elsewhere.
+
+    Messages carry ids, not offer states: a peer reloads the offers from
+    the database, which is at least as new as the change, so messages that
+    arrive late or out of order can never roll the book back. Ids received
+    while a reload runs are batched into the next one. Reloaded offers go
+    through upsert(), so the book's other listeners (book feed, depth and
+    response cache) see remote changes just like local ones. An offer
+    this worker changes while a reload is reading is left as the local
+    change set it, since what the reload read may predate it. If the
+    backend may have missed messages, every offer is reloaded.
+    """
+
+    def __init__(self, book: OrderBook, backend: Backend, engine: AsyncEngine) -> None:
+        self.book = book
+        self.backend = backend
+        self.engine = engine
+        self._pending: Set[int] = set()
+        self._resync = False
+        self._applying = False
+        self._touched: Optional[Set[int]] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        book.add_listener(self.record)
+        backend.subscribe(CHANNEL, self.receive)
+        backend.on_reset(self.resync)
+
+    def record(self, currency: str, op: str, offer_id: int, entry: Optional[BookEntry]) -> None:
+        """Book listener: tell the other workers about changes made here."""
+        if not self._applying:
+            if self._touched is not None:
+                self._touched.add(offer_id)
+            self.backend.publish(CHANNEL, offer_id)
+
+    def receive(self, offer_id: int) -> None:
+        self._pending.add(offer_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def resync(self) -> None:
+        self._resync = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _read(self, query: Any) -> Sequence[Any]:
+        """Run query, noting which offers this worker changes meanwhile."""
+        self._touched = set()
+        async with self.engine.connect() as connection:
+            return (await connection.execute(query)).all()
+
+    def _apply(self, rows: Iterable[Any], removed: Iterable[int]) -> None:
+        # Held across the batch so no local change can slip in while publishing is off
+        with self.book.lock:
+            touched, self._touched = self._touched or set(), None
+            self._applying = True
+            try:
+                for row in rows:
+                    if row.id not in touched:
+                        self.book.upsert(row)
+                for offer_id in removed:
+                    if offer_id not in touched:
+                        self.book.remove(offer_id)
+            finally:
+                self._applying = False
+
+    async def reload(self, offer_ids: Set[int]) -> None:
+        """Bring the given offers up to date from the database."""
+        ids = sorted(offer_ids)
+        for start in range(0, len(ids), RELOAD_BATCH_SIZE):
+            batch = ids[start:start + RELOAD_BATCH_SIZE]
+            rows = await self._read(select(*ENTRY_COLUMNS).where(Offer.id.in_(batch)))
+            found = {row.id for row in rows}
+            self._apply(rows, [offer_id for offer_id in batch if offer_id not in found])
+
+    async def reload_all(self) -> None:
+        """Bring the whole book up to date from the database."""
+        rows = await self._read(select(*ENTRY_COLUMNS).where(Offer.is_active == True))
+        active = {row.id for row in rows}
+        self._apply(rows, [offer_id for offer_id in self.book.offer_ids() if offer_id not in active])
+
+    async def run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            resync, self._resync = self._resync, False
+            offer_ids, self._pending = self._pending, set()
+            try:
+                if resync:
+                    await self.reload_all()
+                else:
+                    await self.reload(offer_ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The book stays stale until the next attempt, so retry everything rather than lose ids
+                logger.exception("order book sync failed")
+                self.resync()
+                await asyncio.sleep(1)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            if self._pending or self._resync:
+                self._wakeup.set()
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._wakeup = None
+
+
+book_sync = BookSync(order_book, backend, async_engine)
@@ -0,0 +1,63 @@
+"""
+In-process caching primitives
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a time-to-live.
+
+    Every invalidation bumps an epoch counter. A caller that loads a value
+    from the database can read the epoch first and pass it to set(), so a
+    value loaded before a concurrent invalidation is never cached.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.epoch = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a live entry and mark it most recently used, or None."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, epoch: Optional[int] = None) -> None:
+        """Store an entry, evicting the least recently used one when full."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self.epoch += 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.epoch += 1
+            self._data.clear()
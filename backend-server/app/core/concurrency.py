@@ -0,0 +1,51 @@
+"""
+Optimistic concurrency for versioned rows: ETags, If-Match and conflicting commits
+"""
+
+from typing import Optional
+from fastapi import HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+
+
+def etag(version: int) -> str:
+    """The ETag of a row version."""
+    return f'"{version}"'
+
+
+def set_etag(response: Response, version: int) -> None:
+    response.headers["ETag"] = etag(version)
+
+
+def check_if_match(if_match: Optional[str], version: int, what: str) -> None:
+    """Reject the request unless If-Match is absent, "*", or names the row's current version.
+
+    Only strong tags can match, so a weak W/"..." tag never does.
+    """
+    if if_match is None:
+        return
+    tags = [tag.strip() for tag in if_match.split(",")]
+    if "*" in tags or etag(version) in tags:
+        return
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"{what} has changed since it was read, reload and retry",
+        headers={"ETag": etag(version)},
+    )
+
+
+async def commit_or_conflict(db: AsyncSession, what: str) -> None:
+    """Commit, turning a lost compare-and-swap on a row version into a 409.
+
+    Versioned rows are written with UPDATE ... WHERE version = <version
+    read>, so a concurrent write makes the statement match nothing rather
+    than being overwritten.
+    """
+    try:
+        await db.commit()
+    except StaleDataError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"{what} was changed by another request, reload and retry",
+        )
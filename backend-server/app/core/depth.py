@@ -0,0 +1,193 @@
+"""
+Market depth: offer liquidity aggregated into price levels
+"""
+
+import math
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import numpy as np
+import ujson
+from dotenv import load_dotenv
+from .cache import TTLCache
+from .market_data import LastPrices, last_prices
+from .order_book import BookEntry, CurrencyBook, OrderBook, order_book
+
+load_dotenv()
+
+# Depth configuration
+DEPTH_DEFAULT_LEVELS = int(os.getenv("DEPTH_DEFAULT_LEVELS", "50"))
+DEPTH_MAX_LEVELS = int(os.getenv("DEPTH_MAX_LEVELS", "500"))
+DEPTH_CACHE_SIZE = int(os.getenv("DEPTH_CACHE_SIZE", "1024"))
+DEPTH_CACHE_TTL_SECONDS = float(os.getenv("DEPTH_CACHE_TTL_SECONDS", "300"))
+
+# Automatic level width, as a fraction of the best price, rounded down to a power of ten
+AUTO_STEP_FRACTION = 0.001
+
+
+@dataclass(frozen=True)
+class BookArrays:
+    """A currency's active offers as arrays sorted by price."""
+    book: CurrencyBook  # The book these were read from; a reload replaces it
+    version: int
+    ids: np.ndarray
+    prices: np.ndarray
+    amounts: np.ndarray  # max_amount of each offer, i.e. the most it will sell
+
+    @classmethod
+    def from_entries(cls, book: CurrencyBook, version: int, entries: List[BookEntry]) -> "BookArrays":
+        return cls(
+            book=book,
+            version=version,
+            ids=np.fromiter((entry.id for entry in entries), np.int64, len(entries)),
+            prices=np.fromiter((entry.price_per_unit for entry in entries), np.float64, len(entries)),
+            amounts=np.fromiter((entry.max_amount for entry in entries), np.float64, len(entries)),
+        )
+
+    def patched(self, changes: Dict[int, Optional[BookEntry]], version: int) -> "BookArrays":
+        """Apply offer changes (offer id -> new entry, or None if removed) in a few array passes."""
+        changed = np.fromiter(changes, np.int64, len(changes))
+        keep = ~np.isin(self.ids, changed)
+        ids, prices, amounts = self.ids[keep], self.prices[keep], self.amounts[keep]
+        # Inserted in book order, (price, id), so positions come out non-decreasing
+        added = sorted(
+            (entry for entry in changes.values() if entry is not None),
+            key=lambda entry: (entry.price_per_unit, entry.id),
+        )
+        if added:
+            added_prices = np.fromiter((entry.price_per_unit for entry in added), np.float64, len(added))
+            added_ids = np.fromiter((entry.id for entry in added), np.int64, len(added))
+            at = np.searchsorted(prices, added_prices, side="left")
+            ties_end = np.searchsorted(prices, added_prices, side="right")
+            # Offers at an existing price go among its run of ids, which is sorted
+            for i in np.flatnonzero(ties_end > at):
+                at[i] += np.searchsorted(ids[at[i]:ties_end[i]], added_ids[i])
+            ids = np.insert(ids, at, added_ids)
+            prices = np.insert(prices, at, added_prices)
+            amounts = np.insert(amounts, at, [entry.max_amount for entry in added])
+        return BookArrays(self.book, version, ids, prices, amounts)
+
+
+def auto_step(best_price: float) -> float:
+    return 10.0 ** math.floor(math.log10(best_price * AUTO_STEP_FRACTION)) if best_price > 0 else 1.0
+
+
+class MarketDepth:
+    """Depth per currency, computed over array snapshots of the order book and cached.
+
+    Once a currency's arrays exist, the book's change notifications are
+    collected per offer and applied to them in one vectorised pass on the
+    next request, so a busy book is never re-read in full. Cached responses
+    are keyed by the arrays' version and the last trade price, so neither
+    is ever served stale.
+    """
+
+    def __init__(self, book: OrderBook, prices: LastPrices) -> None:
+        self.book = book
+        self.prices = prices
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._pending: Dict[str, Dict[int, Optional[BookEntry]]] = {}
+        self._arrays: Dict[str, BookArrays] = {}
+        self._lock = threading.Lock()
+        self.cache = TTLCache(DEPTH_CACHE_SIZE, DEPTH_CACHE_TTL_SECONDS)
+        book.add_listener(self.record)
+
+    def record(self, currency: str, op: str, offer_id: int, entry: Optional[BookEntry]) -> None:
+        """Note an offer change; runs under the book lock."""
+        self._versions[currency] += 1
+        pending = self._pending.get(currency)
+        if pending is not None:
+            pending[offer_id] = None if op == "remove" else entry
+
+    def arrays(self, currency: str) -> Optional[BookArrays]:
+        """Return current arrays for the currency's offers, bringing them up to date first."""
+        with self._lock:
+            with self.book.lock:
+                live = self.book.book(currency)
+                if live is None:
+                    return None
+                version = self._versions[currency]
+                current = self._arrays.get(currency)
+                if current is not None and current.book is live and current.version == version:
+                    return current
+                # Start collecting changes made from here on, for the next update
+                changes, self._pending[currency] = self._pending.get(currency, {}), {}
+                entries = list(live.asks()) if current is None or current.book is not live else None
+            if entries is not None:
+                current = BookArrays.from_entries(live, version, entries)
+            else:
+                current = current.patched(changes, version)
+            self._arrays[currency] = current
+            return current
+
+    def levels(self, arrays: Optional[BookArrays], step: float, count: int) -> List[Dict[str, Any]]:
+        """Bucket offers into up to count price levels step wide, cheapest first.
+
+        Each ask is rounded up to its level, so a level's price is the most
+        any of its offers costs, and the cumulative columns give the amount
+        and cost of sweeping every level up to and including it.
+        """
+        if arrays is None or len(arrays.prices) == 0:
+            return []
+        # Prices are sorted, so only a prefix of the book can reach the first count levels.
+        # Empty levels are skipped, so widen the prefix until it holds enough of them.
+        first = np.ceil(arrays.prices[0] / step - 1e-9)
+        span = count
+        while True:
+            reach = np.searchsorted(arrays.prices, (first + span) * step, side="right")
+            # The small offset keeps prices already on a level boundary from rounding up past it
+            ticks = np.ceil(arrays.prices[:reach] / step - 1e-9).astype(np.int64)
+            boundaries = np.flatnonzero(np.r_[True, ticks[1:] != ticks[:-1]])
+            if len(boundaries) > count or reach == len(arrays.prices):
+                break
+            span *= 4
+        starts = boundaries[:count]
+        stop = boundaries[count] if len(boundaries) > count else len(ticks)
+        prices, amounts = arrays.prices[:stop], arrays.amounts[:stop]
+        level_amounts = np.add.reduceat(amounts, starts)
+        columns = zip(
+            (ticks[starts] * step).round(12).tolist(),
+            level_amounts.tolist(),
+            np.diff(np.r_[starts, stop]).tolist(),
+            np.cumsum(level_amounts).tolist(),
+            np.cumsum(np.add.reduceat(prices * amounts, starts)).tolist(),
+        )
+        return [
+            {"price": price, "amount": amount, "offers": offers,
+             "cumulative_amount": cumulative_amount, "cumulative_cost": cumulative_cost}
+            for price, amount, offers, cumulative_amount, cumulative_cost in columns
+        ]
+
+    def depth(self, currency: str, step: Optional[float] = None, count: int = DEPTH_DEFAULT_LEVELS) -> bytes:
+        """Return the JSON-encoded depth of a currency, from cache when nothing changed."""
+        arrays = self.arrays(currency)
+        last = self.prices.get(currency)
+        if arrays is None:
+            key = (currency, None, None, last, step, count)
+        else:
+            key = (currency, id(arrays.book), arrays.version, last, step, count)
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+
+        has_offers = arrays is not None and len(arrays.prices) > 0
+        best = float(arrays.prices[0]) if has_offers else None
+        width = step or auto_step(best or last or 0.0)
+        body = ujson.dumps({
+            "currency": currency,
+            "best_ask": best,
+            "last_price": last,
+            "spread": best - last if best is not None and last is not None else None,
+            "spread_percent": (best - last) / last * 100 if best is not None and last else None,
+            "step": width,
+            "total_offers": len(arrays.prices) if has_offers else 0,
+            "total_amount": float(arrays.amounts.sum()) if has_offers else 0.0,
+            "levels": self.levels(arrays, width, count),
+        }).encode()
+        self.cache.set(key, body)
+        return body
+
+
+market_depth = MarketDepth(order_book, last_prices)
@@ -0,0 +1,171 @@
+"""
+Background expiry of stale trades and offers in bounded set-based batches
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+from dotenv import load_dotenv
+from ..database import async_engine
+from ..models.models import Offer, Trade, TradeStatus
+from . import metrics
+from .matching import release
+from .order_book import ENTRY_COLUMNS, OrderBook, order_book
+
+load_dotenv()
+
+# Expiry configuration; a TTL of 0 never expires that kind of row
+EXPIRY_ENABLED = os.getenv("EXPIRY_ENABLED", "true").lower() == "true"
+EXPIRY_INTERVAL_SECONDS = float(os.getenv("EXPIRY_INTERVAL_SECONDS", "60"))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "1000"))
+TRADE_PENDING_TTL_SECONDS = int(os.getenv("TRADE_PENDING_TTL_SECONDS", "86400"))
+TRADE_IN_PROGRESS_TTL_SECONDS = int(os.getenv("TRADE_IN_PROGRESS_TTL_SECONDS", "259200"))
+OFFER_TTL_SECONDS = int(os.getenv("OFFER_TTL_SECONDS", "2592000"))
+
+# Trade status -> seconds without an update before the trade is cancelled
+TRADE_TTLS = {
+    TradeStatus.PENDING: TRADE_PENDING_TTL_SECONDS,
+    TradeStatus.IN_PROGRESS: TRADE_IN_PROGRESS_TTL_SECONDS,
+}
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_ROWS = metrics.registry.register(metrics.Counter(
+    "expiry_rows_total", "Rows expired by the background sweeper.", ("kind",)
+))
+SWEEP_SECONDS = metrics.registry.register(metrics.Histogram(
+    "expiry_sweep_duration_seconds", "Time taken by each expiry sweep."
+))
+SWEEP_ROWS = metrics.registry.register(metrics.Histogram(
+    "expiry_sweep_rows", "Rows expired per sweep.", buckets=(0, 1, 10, 100, 1000, 10000, 100000)
+))
+SWEEP_FAILURES = metrics.registry.register(metrics.Counter(
+    "expiry_sweep_failures_total", "Expiry sweeps that raised an error."
+))
+
+
+class ExpirySweeper:
+    """Cancels trades and deactivates offers that have not been updated within their TTL.
+
+    Each batch is one UPDATE over the ids of up to batch_size stale rows,
+    found through the (status, updated_at) and (is_active, updated_at)
+    indexes, and commits on its own so locks are held only briefly. The
+    outer UPDATE repeats the staleness test, so a row touched in the
+    meantime, or already expired by another worker, is left alone.
+    Cancelled trades give their amounts back to their offers, and offers
+    changed either way reach the order book as they commit.
+    """
+
+    def __init__(self, engine: AsyncEngine, book: OrderBook, interval: float,
+                 batch_size: int = EXPIRY_BATCH_SIZE) -> None:
+        self.engine = engine
+        self.book = book
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def _stale_trades(self, status: TradeStatus, cutoff: datetime) -> Any:
+        return (Trade.status == status) & (Trade.updated_at < cutoff)
+
+    def _stale_offers(self, cutoff: datetime) -> Any:
+        return (Offer.is_active == True) & (Offer.updated_at < cutoff)
+
+    async def expire_trades(self, status: TradeStatus, cutoff: datetime) -> int:
+        """Cancel trades in status last updated before cutoff, returning how many."""
+        expired = 0
+        while True:
+            stale = self._stale_trades(status, cutoff)
+            batch = (
+                select(Trade.id).where(stale).order_by(Trade.updated_at).limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            async with self.engine.begin() as connection:
+                cancelled = (await connection.execute(
+                    update(Trade)
+                    .where(Trade.id.in_(batch.scalar_subquery()), stale)
+                    .values(status=TradeStatus.CANCELLED, updated_at=datetime.utcnow(), version=Trade.version + 1)
+                    .returning(Trade.offer_id, Trade.amount)
+                    .execution_options(synchronize_session=False)
+                )).all()
+                # Cancelled trades give their reserved amounts back in the same transaction
+                released = await release(connection, cancelled)
+            for row in released:
+                self.book.upsert(row)
+            expired += len(cancelled)
+            if len(cancelled) < self.batch_size:
+                return expired
+
+    async def expire_offers(self, cutoff: datetime) -> int:
+        """Deactivate active offers last updated before cutoff, returning how many."""
+        expired = 0
+        while True:
+            stale = self._stale_offers(cutoff)
+            batch = (
+                select(Offer.id).where(stale).order_by(Offer.updated_at).limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            async with self.engine.begin() as connection:
+                rows = (await connection.execute(
+                    update(Offer)
+                    .where(Offer.id.in_(batch.scalar_subquery()), stale)
+                    .values(is_active=False, updated_at=datetime.utcnow(), version=Offer.version + 1)
+                    .returning(*ENTRY_COLUMNS)
+                    .execution_options(synchronize_session=False)
+                )).all()
+            # Committed, so the book may drop them
+            for row in rows:
+                self.book.upsert(row)
+            expired += len(rows)
+            if len(rows) < self.batch_size:
+                return expired
+
+    async def sweep(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Run one pass over every kind of stale row, returning the count expired per kind."""
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        counts = {}
+        for status, ttl in TRADE_TTLS.items():
+            if ttl > 0:
+                cutoff = now - timedelta(seconds=ttl)
+                counts[f"trade_{status.name.lower()}"] = await self.expire_trades(status, cutoff)
+        if OFFER_TTL_SECONDS > 0:
+            counts["offer"] = await self.expire_offers(now - timedelta(seconds=OFFER_TTL_SECONDS))
+
+        for kind, count in counts.items():
+            EXPIRED_ROWS.inc(kind, amount=count)
+        total = sum(counts.values())
+        SWEEP_ROWS.observe(total)
+        SWEEP_SECONDS.observe(time.perf_counter() - started)
+        if total:
+            logger.info("expired %s", ", ".join(f"{count} {kind}" for kind, count in counts.items() if count))
+        return counts
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # A failed sweep is retried on the next interval; rows are still stale then
+                SWEEP_FAILURES.inc()
+                logger.exception("expiry sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+expiry_sweeper = ExpirySweeper(async_engine, order_book, EXPIRY_INTERVAL_SECONDS)
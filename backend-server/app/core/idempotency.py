@@ -0,0 +1,206 @@
+"""
+Idempotency-Key support: replay completed responses and coalesce in-flight duplicates
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import ujson
+from fastapi import HTTPException, Response, status
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from . import metrics
+from .backends import Backend, backend
+
+load_dotenv()
+
+# Idempotency configuration
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# How long a key stays claimed by a request that never finishes, e.g. its worker died
+IDEMPOTENCY_CLAIM_SECONDS = float(os.getenv("IDEMPOTENCY_CLAIM_SECONDS", "60"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Status of a stored entry that only claims its key for a request still running
+_CLAIMED = 0
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Recomputed when a stored response is replayed
+_SKIPPED_HEADERS = {b"content-length"}
+
+REQUESTS = metrics.registry.register(metrics.Counter(
+    "idempotency_requests_total",
+    "Requests carrying an Idempotency-Key, by whether they ran, were replayed, waited on or were refused.",
+    ("outcome",),
+))
+
+
+def fingerprint(*parts: Any) -> bytes:
+    """A digest of the request, so a key reused for a different request can be told apart."""
+    values = [part.model_dump(mode="json") if isinstance(part, BaseModel) else part for part in parts]
+    return hashlib.sha256(ujson.dumps(values, sort_keys=True).encode()).digest()[:16]
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    """A completed response, kept as the bytes that were sent, or the claim of a running request."""
+    fingerprint: bytes
+    status_code: int
+    body: bytes = b""
+    headers: Tuple[Tuple[str, str], ...] = ()
+
+    @property
+    def claimed(self) -> bool:
+        return self.status_code == _CLAIMED
+
+    def encode(self) -> bytes:
+        return ujson.dumps({
+            "fingerprint": self.fingerprint.hex(),
+            "status_code": self.status_code,
+            "body": base64.b64encode(self.body).decode(),
+            "headers": self.headers,
+        }).encode()
+
+    @classmethod
+    def decode(cls, raw: bytes) -> "StoredResponse":
+        data = ujson.loads(raw)
+        return cls(
+            fingerprint=bytes.fromhex(data["fingerprint"]),
+            status_code=data["status_code"],
+            body=base64.b64decode(data["body"]),
+            headers=tuple((name, value) for name, value in data["headers"]),
+        )
+
+    @classmethod
+    def from_response(cls, digest: bytes, response: Response) -> "StoredResponse":
+        return cls(
+            fingerprint=digest,
+            status_code=response.status_code,
+            body=bytes(response.body),
+            headers=tuple(
+                (name.decode("latin-1"), value.decode("latin-1"))
+                for name, value in response.raw_headers if name not in _SKIPPED_HEADERS
+            ),
+        )
+
+    def replay(self) -> Response:
+        return Response(
+            content=self.body,
+            status_code=self.status_code,
+            headers={**dict(self.headers), REPLAYED_HEADER: "true"},
+        )
+
+
+def _mismatch() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Idempotency-Key was already used for a different request",
+    )
+
+
+def _in_progress() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A request with this Idempotency-Key is still in progress, retry",
+        headers={"Retry-After": "1"},
+    )
+
+
+class IdempotencyStore:
+    """Completed responses per (scope, Idempotency-Key), kept in the shared backend for the TTL.
+
+    The first request with a key runs; its response is stored and replayed
+    byte for byte to any retry within the TTL, whichever worker it reaches.
+    Duplicates arriving at the same worker while it is still running wait
+    for it instead of running again. The key is claimed in the backend
+    while the request runs, so a duplicate on another worker is refused
+    with a 409 to retry rather than running twice. Only responses the
+    handler returns are stored: if it raises, e.g. a 400, waiting
+    duplicates get the same error, the claim is released and the next
+    retry runs afresh.
+    """
+
+    def __init__(self, backend: Backend, ttl: float, claim_ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self._in_flight: Dict[str, Tuple[bytes, "asyncio.Future[StoredResponse]"]] = {}
+
+    @staticmethod
+    def _key(scope: Tuple[Any, ...], key: str) -> str:
+        return ":".join(["idempotency", *map(str, scope), key])
+
+    async def _claim(self, cache_key: str, digest: bytes) -> Optional[StoredResponse]:
+        """Claim the key for this request, or return the response already stored under it."""
+        claim = StoredResponse(digest, _CLAIMED)
+        if await self.backend.set(cache_key, claim.encode(), ttl=self.claim_ttl, only_if_absent=True):
+            return None
+        raw = await self.backend.get(cache_key)
+        stored = StoredResponse.decode(raw) if raw is not None else None
+        if stored is not None and stored.fingerprint != digest:
+            REQUESTS.inc("mismatch")
+            raise _mismatch()
+        if stored is None or stored.claimed:
+            # Running on another worker, or finished and released just now; either way a retry settles it
+            REQUESTS.inc("in_progress")
+            raise _in_progress()
+        REQUESTS.inc("replayed")
+        return stored
+
+    async def run(self, scope: Tuple[Any, ...], key: Optional[str], digest: bytes,
+                  handler: Callable[[], Awaitable[Response]]) -> Response:
+        """Run handler once per key within scope, e.g. (user id, route), returning its response."""
+        if key is None:
+            return await handler()
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+            )
+        cache_key = self._key(scope, key)
+
+        pending = self._in_flight.get(cache_key)
+        if pending is not None:
+            if pending[0] != digest:
+                REQUESTS.inc("mismatch")
+                raise _mismatch()
+            REQUESTS.inc("coalesced")
+            # Shielded so a waiter that disconnects does not cancel the shared result
+            return (await asyncio.shield(pending[1])).replay()
+
+        future: "asyncio.Future[StoredResponse]" = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = (digest, future)
+        claimed = False
+        try:
+            stored = await self._claim(cache_key, digest)
+            if stored is None:
+                claimed = True
+                REQUESTS.inc("executed")
+                response = await handler()
+                stored = StoredResponse.from_response(digest, response)
+                if response.status_code < 500:
+                    await self.backend.set(cache_key, stored.encode(), ttl=self.ttl)
+                    claimed = False
+            else:
+                response = stored.replay()
+            future.set_result(stored)
+            return response
+        except BaseException as exc:
+            error = exc if isinstance(exc, HTTPException) else HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="The original request with this Idempotency-Key did not finish, retry"
+            )
+            future.set_exception(error)
+            # Mark the exception retrieved, as there may be no waiter to do so
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[cache_key]
+            if claimed:
+                # Release the key so a retry runs afresh
+                await self.backend.delete(cache_key)
+
+
+idempotency_store = IdempotencyStore(backend, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_CLAIM_SECONDS)
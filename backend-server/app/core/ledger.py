@@ -0,0 +1,309 @@
+"""
+Wallet ledger: integer minor-unit balances backed by append-only postings
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from ..models.models import Wallet, LedgerPosting, BalanceSnapshot, Transaction
+
+load_dotenv()
+
+# Ledger configuration
+LEDGER_SNAPSHOT_INTERVAL = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "100"))
+LEDGER_BATCH_CHUNK_SIZE = int(os.getenv("LEDGER_BATCH_CHUNK_SIZE", "1000"))
+LEDGER_BATCH_MAX_ITEMS = int(os.getenv("LEDGER_BATCH_MAX_ITEMS", "10000"))
+
+# Decimal places held per currency; amounts are stored as integers of 10^-places
+CURRENCY_DECIMALS = {
+    "BTC": 8,
+    "ETH": 8,
+    "USDT": 6,
+    "USDC": 6,
+}
+DEFAULT_DECIMALS = 8
+
+# Balance direction of each transaction type; other types leave the balance alone
+TRANSACTION_SIGNS = {
+    "deposit": 1,
+    "withdrawal": -1,
+}
+
+
+class LedgerError(Exception):
+    """Raised when a posting cannot be applied."""
+
+
+class InsufficientFunds(LedgerError):
+    """Raised when a posting would take a wallet balance below zero."""
+
+
+class DuplicateReference(LedgerError):
+    """Raised when a batch inserts a reference_id another transaction committed after the batch checked.
+
+    committed is how many leading items of the batch were already committed.
+    """
+
+    def __init__(self, committed: int) -> None:
+        super().__init__(f"reference_id inserted concurrently after item {committed}")
+        self.committed = committed
+
+
+def minor_units(currency: Optional[str]) -> int:
+    """Return how many minor units make up one unit of the currency."""
+    return 10 ** CURRENCY_DECIMALS.get((currency or "").upper(), DEFAULT_DECIMALS)
+
+
+def to_minor(amount: float, currency: Optional[str]) -> int:
+    """Convert a decimal amount to integer minor units, rounding half to even."""
+    scaled = Decimal(str(amount)) * minor_units(currency)
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+
+
+def to_major(amount_minor: int, currency: Optional[str]) -> float:
+    """Convert integer minor units back to a decimal amount."""
+    return float(Decimal(amount_minor) / minor_units(currency))
+
+
+def signed_amount(transaction_type: str, amount_minor: int) -> int:
+    """Return the balance delta a transaction applies, or 0 if it does not move funds."""
+    return TRANSACTION_SIGNS.get(transaction_type, 0) * amount_minor
+
+
+async def post(
+    db: AsyncSession,
+    wallet: Wallet,
+    amount_minor: int,
+    transaction_id: Optional[int] = None,
+) -> Tuple[int, int]:
+    """Apply a signed delta to a wallet and append the matching posting.
+
+    The balance check and the update are one conditional UPDATE, so
+    concurrent postings to the same wallet can neither lose updates nor
+    overdraw it, and no lock is held beyond the caller's transaction.
+    Returns the new (balance_minor, sequence). Raises InsufficientFunds
+    if the balance would go negative. The caller owns the commit.
+    """
+    scale = float(minor_units(wallet.currency))
+    new_balance = Wallet.balance_minor + amount_minor
+    result = await db.execute(
+        update(Wallet)
+        .where(Wallet.id == wallet.id, new_balance >= 0)
+        .values(
+            balance_minor=new_balance,
+            balance=new_balance / scale,
+            posting_sequence=Wallet.posting_sequence + 1,
+        )
+        .returning(Wallet.balance_minor, Wallet.posting_sequence)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+    if row is None:
+        raise InsufficientFunds("Insufficient balance")
+    balance_minor, sequence = row
+
+    await db.execute(insert(LedgerPosting).values(
+        wallet_id=wallet.id,
+        transaction_id=transaction_id,
+        sequence=sequence,
+        amount_minor=amount_minor,
+    ))
+    if LEDGER_SNAPSHOT_INTERVAL > 0 and sequence % LEDGER_SNAPSHOT_INTERVAL == 0:
+        await db.execute(insert(BalanceSnapshot).values(
+            wallet_id=wallet.id,
+            sequence=sequence,
+            balance_minor=balance_minor,
+        ))
+    return balance_minor, sequence
+
+
+async def balance_at(db: AsyncSession, wallet_id: int, at: datetime) -> int:
+    """Return a wallet's balance in minor units as of a point in time.
+
+    Starts from the latest snapshot taken by then and sums only the
+    postings between it and the next snapshot. That reads at most
+    LEDGER_SNAPSHOT_INTERVAL postings instead of the full history.
+    """
+    snapshot = (await db.execute(
+        select(BalanceSnapshot.sequence, BalanceSnapshot.balance_minor)
+        .where(BalanceSnapshot.wallet_id == wallet_id, BalanceSnapshot.created_at <= at)
+        .order_by(BalanceSnapshot.sequence.desc())
+        .limit(1)
+    )).first()
+    base_sequence, base_balance = snapshot if snapshot is not None else (0, 0)
+
+    next_sequence = (await db.execute(
+        select(BalanceSnapshot.sequence)
+        .where(BalanceSnapshot.wallet_id == wallet_id, BalanceSnapshot.sequence > base_sequence)
+        .order_by(BalanceSnapshot.sequence)
+        .limit(1)
+    )).scalar_one_or_none()
+
+    query = select(func.coalesce(func.sum(LedgerPosting.amount_minor), 0)).where(
+        LedgerPosting.wallet_id == wallet_id,
+        LedgerPosting.sequence > base_sequence,
+        LedgerPosting.created_at <= at,
+    )
+    if next_sequence is not None:
+        query = query.where(LedgerPosting.sequence <= next_sequence)
+    return base_balance + (await db.execute(query)).scalar_one()
+
+
+async def post_batch(db: AsyncSession, items: Sequence[Any]) -> List[Dict[str, Any]]:
+    """Ingest many transactions across many wallets.
+
+    Items need wallet_id, amount, transaction_type and reference_id. They
+    are processed in chunks of LEDGER_BATCH_CHUNK_SIZE, each committed as
+    one database transaction. Returns one result per item, in input order.
+    Raises DuplicateReference if a reference_id is inserted concurrently
+    between a chunk's duplicate check and its insert; that chunk is rolled
+    back and earlier chunks stay committed.
+    """
+    results: List[Dict[str, Any]] = []
+    for start in range(0, len(items), LEDGER_BATCH_CHUNK_SIZE):
+        chunk = items[start:start + LEDGER_BATCH_CHUNK_SIZE]
+        try:
+            results.extend(await _post_chunk(db, chunk, offset=start))
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise DuplicateReference(start)
+    return results
+
+
+async def _post_chunk(db: AsyncSession, items: Sequence[Any], offset: int) -> List[Dict[str, Any]]:
+    results = [
+        {"index": offset + i, "reference_id": item.reference_id, "status": "created",
+         "transaction_id": None, "error": None}
+        for i, item in enumerate(items)
+    ]
+
+    def reject(i: int, error: str) -> None:
+        results[i]["status"] = "rejected"
+        results[i]["error"] = error
+
+    # Validate the whole chunk with two set-based lookups instead of per-item queries
+    wallet_ids = {item.wallet_id for item in items}
+    references = {item.reference_id for item in items}
+    wallets = {
+        row.id: row for row in (await db.execute(
+            select(Wallet.id, Wallet.currency, Wallet.balance_minor).where(Wallet.id.in_(wallet_ids))
+        )).all()
+    }
+    seen_references = set((await db.execute(
+        select(Transaction.reference_id).where(Transaction.reference_id.in_(references))
+    )).scalars().all())
+
+    # Replay the chunk in order against the balances just read
+    running: Dict[int, int] = {wallet_id: row.balance_minor for wallet_id, row in wallets.items()}
+    accepted: Dict[int, List[Tuple[int, int]]] = defaultdict(list)  # wallet_id -> [(index, delta)]
+    for i, item in enumerate(items):
+        wallet = wallets.get(item.wallet_id)
+        if wallet is None:
+            reject(i, "Wallet not found")
+            continue
+        if item.reference_id in seen_references:
+            reject(i, "Duplicate reference_id")
+            continue
+        amount_minor = to_minor(item.amount, wallet.currency)
+        if amount_minor <= 0:
+            reject(i, "Amount must be positive")
+            continue
+        delta = signed_amount(item.transaction_type, amount_minor)
+        if running[item.wallet_id] + delta < 0:
+            reject(i, "Insufficient balance")
+            continue
+        seen_references.add(item.reference_id)
+        running[item.wallet_id] += delta
+        accepted[item.wallet_id].append((i, delta))
+
+    # One conditional UPDATE per wallet applies its aggregated delta. The guard
+    # uses the lowest running balance so no intermediate posting goes negative
+    # even if the balance moved since it was read.
+    sequences: Dict[int, int] = {}
+    balances: Dict[int, int] = {}
+    for wallet_id, entries in accepted.items():
+        moving = [delta for _, delta in entries if delta]
+        if not moving:
+            continue
+        total, low = 0, 0
+        for delta in moving:
+            total += delta
+            low = min(low, total)
+        scale = float(minor_units(wallets[wallet_id].currency))
+        row = (await db.execute(
+            update(Wallet)
+            .where(Wallet.id == wallet_id, Wallet.balance_minor + low >= 0)
+            .values(
+                balance_minor=Wallet.balance_minor + total,
+                balance=(Wallet.balance_minor + total) / scale,
+                posting_sequence=Wallet.posting_sequence + len(moving),
+            )
+            .returning(Wallet.balance_minor, Wallet.posting_sequence)
+            .execution_options(synchronize_session=False)
+        )).first()
+        if row is None:
+            for i, _ in entries:
+                reject(i, "Insufficient balance")
+            continue
+        balances[wallet_id], sequences[wallet_id] = row
+
+    kept = [
+        (i, wallet_id, delta)
+        for wallet_id, entries in accepted.items()
+        for i, delta in entries
+        if results[i]["status"] == "created"
+    ]
+    kept.sort()
+    if not kept:
+        return results
+
+    # executemany insert of the transactions, returning ids in parameter order
+    transaction_ids = (await db.execute(
+        insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+        [
+            {
+                "wallet_id": wallet_id,
+                "amount": items[i].amount,
+                "transaction_type": items[i].transaction_type,
+                "reference_id": items[i].reference_id,
+                "status": "pending",
+            }
+            for i, wallet_id, _ in kept
+        ],
+    )).scalars().all()
+    for (i, _, _), transaction_id in zip(kept, transaction_ids):
+        results[i]["transaction_id"] = transaction_id
+
+    # Number each wallet's postings back from the sequence the UPDATE returned
+    moving_by_wallet: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for i, wallet_id, delta in kept:
+        if delta:
+            moving_by_wallet[wallet_id].append((i, delta))
+    postings: List[Dict[str, Any]] = []
+    snapshots: List[Dict[str, Any]] = []
+    for wallet_id, moving in moving_by_wallet.items():
+        sequence = sequences[wallet_id] - len(moving)
+        balance = balances[wallet_id] - sum(delta for _, delta in moving)
+        for i, delta in moving:
+            sequence += 1
+            balance += delta
+            postings.append({
+                "wallet_id": wallet_id,
+                "transaction_id": results[i]["transaction_id"],
+                "sequence": sequence,
+                "amount_minor": delta,
+            })
+            if LEDGER_SNAPSHOT_INTERVAL > 0 and sequence % LEDGER_SNAPSHOT_INTERVAL == 0:
+                snapshots.append({"wallet_id": wallet_id, "sequence": sequence, "balance_minor": balance})
+    if postings:
+        await db.execute(insert(LedgerPosting), postings)
+    if snapshots:
+        await db.execute(insert(BalanceSnapshot), snapshots)
+    return results
@@ -0,0 +1,333 @@
+"""
+OHLCV candles per currency, kept current from completed trades and rebuildable from history
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import case, delete, event, func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, attributes
+from dotenv import load_dotenv
+from ..models.models import MarketCandle, Offer, Trade, TradeStatus
+from .backends import backend
+
+load_dotenv()
+
+# Market data configuration
+MARKET_REBUILD_BATCH_SIZE = int(os.getenv("MARKET_REBUILD_BATCH_SIZE", "100000"))
+
+# Candle interval -> bucket width in seconds
+INTERVALS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+_US = 1_000_000
+_PENDING = "market_data_completed_trades"
+_PRICES = "market_data_last_prices"
+# Carries committed last prices to the other workers as [currency, ISO timestamp, price] lists
+PRICES_CHANNEL = "last_prices"
+
+
+def _to_us(values: Sequence[datetime]) -> np.ndarray:
+    return np.array(values, dtype="datetime64[us]").astype(np.int64)
+
+
+def _to_datetimes(values: np.ndarray) -> List[datetime]:
+    return values.astype("datetime64[us]").tolist()
+
+
+def aggregate(currencies: Sequence[str], completed_at: Sequence[datetime], prices: Sequence[float],
+              amounts: Sequence[float], totals: Sequence[float]) -> List[Dict[str, Any]]:
+    """Fold trades into one candle row per currency, interval and bucket.
+
+    Trades that complete at the same moment keep their input order, so
+    pass them ordered by (completed_at, id) for a deterministic open and
+    close.
+    """
+    if len(currencies) == 0:
+        return []
+    names, codes = np.unique(np.asarray(currencies, dtype=object), return_inverse=True)
+    times = _to_us(completed_at)
+    order = np.lexsort((times, codes))
+    codes, times = codes[order], times[order]
+    prices = np.asarray(prices, dtype=np.float64)[order]
+    amounts = np.asarray(amounts, dtype=np.float64)[order]
+    totals = np.asarray(totals, dtype=np.float64)[order]
+
+    rows = []
+    for interval, seconds in INTERVALS.items():
+        width = seconds * _US
+        buckets = times // width * width
+        boundary = np.r_[True, (codes[1:] != codes[:-1]) | (buckets[1:] != buckets[:-1])]
+        starts = np.flatnonzero(boundary)
+        ends = np.r_[starts[1:], len(times)] - 1
+        columns = zip(
+            names[codes[starts]].tolist(),
+            _to_datetimes(buckets[starts]),
+            prices[starts].tolist(),
+            np.maximum.reduceat(prices, starts).tolist(),
+            np.minimum.reduceat(prices, starts).tolist(),
+            prices[ends].tolist(),
+            np.add.reduceat(amounts, starts).tolist(),
+            np.add.reduceat(totals, starts).tolist(),
+            (ends - starts + 1).tolist(),
+            _to_datetimes(times[starts]),
+            _to_datetimes(times[ends]),
+        )
+        rows.extend(
+            {
+                "currency": currency, "interval": interval, "bucket_start": bucket_start,
+                "open": open_, "high": high, "low": low, "close": close,
+                "volume": volume, "quote_volume": quote_volume, "trade_count": count,
+                "first_trade_at": first_at, "last_trade_at": last_at,
+            }
+            for currency, bucket_start, open_, high, low, close, volume, quote_volume, count, first_at, last_at
+            in columns
+        )
+    return rows
+
+
+def _merged_values(current: Any, incoming: Any) -> Dict[str, Any]:
+    """Combine a stored candle with new trades in the same bucket.
+
+    Works on columns or on plain values: open comes from whichever side
+    traded first, close from whichever traded last. Merging is associative,
+    so trades can be folded in any grouping.
+    """
+    later = incoming.last_trade_at >= current.last_trade_at
+    earlier = incoming.first_trade_at < current.first_trade_at
+    if isinstance(later, bool):
+        return {
+            "open": incoming.open if earlier else current.open,
+            "high": max(current.high, incoming.high),
+            "low": min(current.low, incoming.low),
+            "close": incoming.close if later else current.close,
+            "volume": current.volume + incoming.volume,
+            "quote_volume": current.quote_volume + incoming.quote_volume,
+            "trade_count": current.trade_count + incoming.trade_count,
+            "first_trade_at": incoming.first_trade_at if earlier else current.first_trade_at,
+            "last_trade_at": incoming.last_trade_at if later else current.last_trade_at,
+        }
+    return {
+        "open": case((earlier, incoming.open), else_=current.open),
+        "high": case((incoming.high > current.high, incoming.high), else_=current.high),
+        "low": case((incoming.low < current.low, incoming.low), else_=current.low),
+        "close": case((later, incoming.close), else_=current.close),
+        "volume": current.volume + incoming.volume,
+        "quote_volume": current.quote_volume + incoming.quote_volume,
+        "trade_count": current.trade_count + incoming.trade_count,
+        "first_trade_at": case((earlier, incoming.first_trade_at), else_=current.first_trade_at),
+        "last_trade_at": case((later, incoming.last_trade_at), else_=current.last_trade_at),
+    }
+
+
+class _Values:
+    def __init__(self, values: Dict[str, Any]) -> None:
+        self.__dict__.update(values)
+
+
+def merge_candles(connection: Connection, rows: List[Dict[str, Any]]) -> None:
+    """Insert candle rows, merging each into any stored candle for the same bucket."""
+    if not rows:
+        return
+    table = MarketCandle.__table__
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert(table) if dialect == "sqlite" else postgresql_insert(table)
+        connection.execute(
+            insert.on_conflict_do_update(
+                index_elements=["currency", "interval", "bucket_start"],
+                set_=_merged_values(table.c, insert.excluded),
+            ),
+            rows,
+        )
+        return
+    # No portable upsert: read, merge and write back one bucket at a time
+    key = (table.c.currency, table.c.interval, table.c.bucket_start)
+    for row in rows:
+        match = [column == row[column.name] for column in key]
+        stored = connection.execute(select(table).where(*match).with_for_update()).first()
+        if stored is None:
+            connection.execute(table.insert(), row)
+        else:
+            connection.execute(update(table).where(*match).values(**_merged_values(stored, _Values(row))))
+
+
+class LastPrices:
+    """The price of the most recently completed trade per currency, kept in memory.
+
+    Prices from a flush only take effect once its transaction commits, and
+    are dropped if it rolls back.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._prices: Dict[str, Tuple[datetime, float]] = {}
+
+    def get(self, currency: str) -> Optional[float]:
+        latest = self._prices.get(currency)
+        return latest[1] if latest is not None else None
+
+    def load(self, db: Session) -> None:
+        """Seed every currency's last price from its most recent minute candle."""
+        newest = (
+            select(MarketCandle.currency, func.max(MarketCandle.bucket_start).label("bucket_start"))
+            .where(MarketCandle.interval == "1m")
+            .group_by(MarketCandle.currency)
+            .subquery()
+        )
+        rows = db.execute(
+            select(MarketCandle.currency, MarketCandle.last_trade_at, MarketCandle.close).join(
+                newest,
+                (MarketCandle.currency == newest.c.currency) & (MarketCandle.bucket_start == newest.c.bucket_start),
+            ).where(MarketCandle.interval == "1m")
+        ).all()
+        with self._lock:
+            self._prices = {currency: (at, close) for currency, at, close in rows}
+
+    def update(self, currency: str, at: datetime, price: float) -> None:
+        with self._lock:
+            latest = self._prices.get(currency)
+            if latest is not None and latest[0] > at:
+                return
+            self._prices[currency] = (at, price)
+
+
+last_prices = LastPrices()
+
+
+def _became_completed(trade: Trade) -> bool:
+    history = attributes.get_history(trade, "status")
+    return TradeStatus.COMPLETED in history.added and TradeStatus.COMPLETED not in history.deleted
+
+
+def _stamp_completions(session: Session, flush_context: Any, instances: Any) -> None:
+    completed = [
+        obj for obj in (*session.new, *session.dirty)
+        if isinstance(obj, Trade) and obj.status == TradeStatus.COMPLETED and _became_completed(obj)
+    ]
+    for trade in completed:
+        if trade.completed_at is None:
+            trade.completed_at = datetime.utcnow()
+    if completed:
+        session.info.setdefault(_PENDING, []).extend(completed)
+
+
+def _record_completions(session: Session, flush_context: Any) -> None:
+    completed = session.info.pop(_PENDING, None)
+    if not completed:
+        return
+    connection = session.connection()
+    offer_ids = {trade.offer_id for trade in completed}
+    currencies = dict(connection.execute(select(Offer.id, Offer.currency).where(Offer.id.in_(offer_ids))).all())
+    completed = sorted(
+        (trade for trade in completed if trade.offer_id in currencies),
+        key=lambda trade: (trade.completed_at, trade.id),
+    )
+    rows = aggregate(
+        [currencies[trade.offer_id] for trade in completed],
+        [trade.completed_at for trade in completed],
+        [trade.price_per_unit for trade in completed],
+        [trade.amount for trade in completed],
+        [trade.total_price for trade in completed],
+    )
+    merge_candles(connection, rows)
+    # Daily candles span the whole flush per currency; publish their close once committed
+    prices = session.info.setdefault(_PRICES, {})
+    for row in rows:
+        if row["interval"] != "1d":
+            continue
+        known = prices.get(row["currency"])
+        if known is None or row["last_trade_at"] >= known[0]:
+            prices[row["currency"]] = (row["last_trade_at"], row["close"])
+
+
+def _publish_prices(session: Session) -> None:
+    prices = session.info.pop(_PRICES, None)
+    if not prices:
+        return
+    for currency, (at, price) in prices.items():
+        last_prices.update(currency, at, price)
+    backend.publish(PRICES_CHANNEL, [[currency, at.isoformat(), price] for currency, (at, price) in prices.items()])
+
+
+def _receive_prices(prices: List[List[Any]]) -> None:
+    for currency, at, price in prices:
+        last_prices.update(currency, datetime.fromisoformat(at), price)
+
+
+backend.subscribe(PRICES_CHANNEL, _receive_prices)
+
+
+def _discard_prices(session: Session, *args: Any) -> None:
+    session.info.pop(_PRICES, None)
+
+
+def track_trade_completions() -> None:
+    """Fold trades into the candles in the same transaction that completes them.
+
+    Hooks ORM flushes, so completions through the API and the admin panel
+    are both seen. A trade moving out of COMPLETED is not unwound; rebuild
+    the affected range for that.
+    """
+    if event.contains(Session, "before_flush", _stamp_completions):
+        return
+    event.listen(Session, "before_flush", _stamp_completions)
+    event.listen(Session, "after_flush", _record_completions)
+    event.listen(Session, "after_commit", _publish_prices)
+    event.listen(Session, "after_rollback", _discard_prices)
+
+
+def _completed_trades(currency: str, since: Optional[datetime]) -> Any:
+    query = (
+        select(Trade.id, Trade.completed_at, Trade.price_per_unit, Trade.amount, Trade.total_price)
+        .join(Offer, Offer.id == Trade.offer_id)
+        .where(
+            Trade.status == TradeStatus.COMPLETED,
+            Trade.completed_at.is_not(None),
+            Offer.currency == currency,
+        )
+    )
+    if since is not None:
+        query = query.where(Trade.completed_at >= since)
+    return query
+
+
+def rebuild(connection: Connection, currencies: Optional[Iterable[str]] = None,
+            since: Optional[datetime] = None, batch_size: int = MARKET_REBUILD_BATCH_SIZE) -> int:
+    """Recompute candles from completed trades, returning how many trades were folded in.
+
+    since is rounded down to the start of its day so every affected daily
+    candle is rebuilt whole. Trades are read in keyset batches ordered by
+    completion time and folded in with the same merge the live path uses.
+    """
+    if since is not None:
+        since = datetime(since.year, since.month, since.day)
+    if currencies is None:
+        currencies = connection.execute(select(Offer.currency).distinct()).scalars().all()
+    folded = 0
+    for currency in currencies:
+        stale = delete(MarketCandle).where(MarketCandle.currency == currency)
+        if since is not None:
+            stale = stale.where(MarketCandle.bucket_start >= since)
+        connection.execute(stale)
+
+        query = _completed_trades(currency, since).order_by(Trade.completed_at, Trade.id)
+        last = None
+        while True:
+            page = query
+            if last is not None:
+                page = page.where(
+                    (Trade.completed_at > last[0]) | ((Trade.completed_at == last[0]) & (Trade.id > last[1]))
+                )
+            rows = connection.execute(page.limit(batch_size)).all()
+            if not rows:
+                break
+            ids, completed_at, prices, amounts, totals = zip(*rows)
+            merge_candles(connection, aggregate([currency] * len(rows), completed_at, prices, amounts, totals))
+            folded += len(rows)
+            last = (completed_at[-1], ids[-1])
+    return folded
@@ -0,0 +1,272 @@
+"""
+Price-time priority matching of market buy orders against the order book
+"""
+
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from ..models.models import Offer, Trade, TradeStatus
+from .ledger import minor_units, to_major, to_minor
+from .order_book import ENTRY_COLUMNS, CurrencyBook, OrderBook, order_book
+
+load_dotenv()
+
+# Matching configuration
+MATCHING_MAX_RETRIES = int(os.getenv("MATCHING_MAX_RETRIES", "3"))
+
+
+@dataclass(frozen=True)
+class Fill:
+    """Part of an order filled against one resting offer."""
+    offer_id: int
+    seller_id: int
+    amount: float
+    price_per_unit: float
+    version: int  # Offer version the fill was matched against
+    left: float  # Offer max_amount after the fill
+    exhausted: bool  # Whether the offer can no longer take a trade
+
+
+class StaleBook(Exception):
+    """Raised when the database no longer agrees with the book about an offer."""
+
+    def __init__(self, offer_ids: List[int]) -> None:
+        super().__init__(f"Offers changed during matching: {offer_ids}")
+        self.offer_ids = offer_ids
+
+
+def match_book(
+    book: CurrencyBook,
+    amount: float,
+    max_price: Optional[float] = None,
+    buyer_id: Optional[int] = None,
+) -> Tuple[List[Fill], float]:
+    """Walk a currency book cheapest first and fill up to amount.
+
+    Offers at the same price fill in id order, i.e. oldest first. An offer
+    is skipped if the remainder is below its min_amount, and a buyer never
+    fills against their own offers. Amounts are matched in integer minor
+    units, so repeated partial fills accumulate no rounding error. Returns
+    the fills and the unfilled remainder.
+    """
+    scale = minor_units(book.currency)
+    remaining = to_minor(amount, book.currency)
+    # Once the remainder is below every offer's minimum nothing else can fill
+    smallest_minimum = book.by_min_amount.first_key()
+    floor = round(smallest_minimum * scale) if smallest_minimum is not None else 0
+    fills = []
+    for entry in book.asks(max_price):
+        if remaining <= 0 or remaining < floor:
+            break
+        if entry.seller_id == buyer_id:
+            continue
+        min_amount = round(entry.min_amount * scale)
+        available = round(entry.max_amount * scale)
+        if remaining < min_amount:
+            continue
+        filled = min(remaining, available)
+        if filled <= 0:
+            continue
+        left = available - filled
+        fills.append(Fill(
+            offer_id=entry.id,
+            seller_id=entry.seller_id,
+            amount=to_major(filled, book.currency),
+            price_per_unit=entry.price_per_unit,
+            version=entry.version,
+            left=to_major(left, book.currency),
+            exhausted=left <= 0 or left < min_amount,
+        ))
+        remaining -= filled
+    return fills, to_major(remaining, book.currency)
+
+
+def take(offer_id: int, version: int, left: float, exhausted: bool) -> Any:
+    """UPDATE leaving an offer with left, if it is still active at version.
+
+    It returns the offer's book columns, and matches no row if another
+    writer changed the offer since version was read.
+    """
+    return (
+        update(Offer)
+        .where(Offer.id == offer_id, Offer.is_active == True, Offer.version == version)
+        .values(max_amount=left, is_active=not exhausted, is_exhausted=exhausted, version=Offer.version + 1)
+        .returning(*ENTRY_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reserve(db: Any, offer: Offer, amount: float) -> Optional[Any]:
+    """Take a trade's amount from the offer at the version it was read at.
+
+    The offer is deactivated once what is left is below its min_amount,
+    as a market fill would leave it. Returns the updated row, for the book
+    once committed, or None if the offer changed since it was read.
+    """
+    scale = minor_units(offer.currency)
+    left = to_minor(offer.max_amount, offer.currency) - to_minor(amount, offer.currency)
+    exhausted = left <= 0 or left < round(offer.min_amount * scale)
+    return (await db.execute(
+        take(offer.id, offer.version, to_major(left, offer.currency), exhausted)
+    )).first()
+
+
+async def release(db: Any, trades: Iterable[Tuple[int, float]]) -> List[Any]:
+    """Give the amounts of cancelled trades, as (offer_id, amount), back to their offers.
+
+    Amounts are added in integer minor units on the locked offer rows. An
+    offer that trades deactivated, i.e. is_exhausted, becomes active again
+    once it is back above its min_amount; one deactivated by the seller,
+    an admin or expiry stays inactive. Works on a session or a connection
+    and returns the updated rows, for the book once committed.
+    """
+    amounts: Dict[int, float] = defaultdict(float)
+    for offer_id, amount in trades:
+        if offer_id is not None and amount:
+            amounts[offer_id] += amount
+    if not amounts:
+        return []
+    offers = (await db.execute(
+        select(Offer.id, Offer.currency, Offer.min_amount, Offer.max_amount, Offer.is_active, Offer.is_exhausted)
+        .where(Offer.id.in_(sorted(amounts)))
+        .order_by(Offer.id)
+        .with_for_update()
+    )).all()
+    released = []
+    for offer in offers:
+        scale = minor_units(offer.currency)
+        available = to_minor(offer.max_amount, offer.currency) + to_minor(amounts[offer.id], offer.currency)
+        exhausted = offer.is_exhausted and (available <= 0 or available < round(offer.min_amount * scale))
+        released.append((await db.execute(
+            update(Offer)
+            .where(Offer.id == offer.id)
+            .values(
+                max_amount=to_major(available, offer.currency),
+                is_active=offer.is_active or (offer.is_exhausted and not exhausted),
+                is_exhausted=exhausted,
+                version=Offer.version + 1,
+            )
+            .returning(*ENTRY_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )).one())
+    return released
+
+
+def _clear_exhaustion(offer: Offer, value: Any, oldvalue: Any, initiator: Any) -> None:
+    # Setting is_active through the ORM, as the seller or an admin does, overrides deactivation by trades
+    offer.is_exhausted = False
+
+
+event.listen(Offer.is_active, "set", _clear_exhaustion)
+
+
+class MatchingEngine:
+    """Matches market buy orders against the in-memory order book.
+
+    Orders for one currency are serialised by a per-currency lock, so
+    fills are computed from memory without holding database locks. They
+    are then applied as one transaction. Each offer is decremented with a
+    conditional UPDATE on the version it was matched at. If another writer
+    changed an offer in the meantime, the book is refreshed and the match
+    retried. Cancelling a trade gives its amount back through release().
+    """
+
+    def __init__(self, book: OrderBook) -> None:
+        self.book = book
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def match(
+        self,
+        currency: str,
+        amount: float,
+        max_price: Optional[float] = None,
+        buyer_id: Optional[int] = None,
+    ) -> Tuple[List[Fill], float]:
+        with self.book.lock:
+            book = self.book.book(currency)
+            if book is None:
+                return [], amount
+            return match_book(book, amount, max_price, buyer_id)
+
+    async def execute(
+        self,
+        db: AsyncSession,
+        buyer_id: int,
+        currency: str,
+        amount: float,
+        max_price: Optional[float] = None,
+    ) -> Tuple[List[Trade], float, float]:
+        """Fill a market buy order, returning the created trades and the filled and unfilled amounts."""
+        async with self._locks[currency]:
+            for _ in range(MATCHING_MAX_RETRIES):
+                fills, remaining = self.match(currency, amount, max_price, buyer_id)
+                if not fills:
+                    return [], 0.0, amount
+                try:
+                    offers = await self._consume(db, fills)
+                except StaleBook as exc:
+                    await db.rollback()
+                    await self._reload(db, exc.offer_ids)
+                    continue
+
+                trades = [
+                    Trade(
+                        trade_id=str(uuid.uuid4()),
+                        offer_id=fill.offer_id,
+                        buyer_id=buyer_id,
+                        seller_id=fill.seller_id,
+                        amount=fill.amount,
+                        price_per_unit=fill.price_per_unit,
+                        total_price=fill.amount * fill.price_per_unit,
+                        status=TradeStatus.PENDING,
+                        messages=[],
+                    )
+                    for fill in fills
+                ]
+                db.add_all(trades)
+                await db.commit()
+                for offer in offers:
+                    self.book.upsert(offer)
+                filled = to_major(to_minor(amount, currency) - to_minor(remaining, currency), currency)
+                return trades, filled, remaining
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Order book changed while matching, please retry"
+        )
+
+    async def _consume(self, db: AsyncSession, fills: List[Fill]) -> List[Any]:
+        """Take each fill's amount from its offer, deactivating offers left below their minimum.
+
+        Each UPDATE is a compare-and-swap on the offer version the fill was
+        matched against.
+        """
+        consumed = []
+        stale = []
+        for fill in fills:
+            row = (await db.execute(take(fill.offer_id, fill.version, fill.left, fill.exhausted))).first()
+            if row is None:
+                stale.append(fill.offer_id)
+            else:
+                consumed.append(row)
+        if stale:
+            raise StaleBook(stale)
+        return consumed
+
+    async def _reload(self, db: AsyncSession, offer_ids: List[int]) -> None:
+        for offer_id in offer_ids:
+            offer = await db.get(Offer, offer_id, populate_existing=True)
+            if offer is None:
+                self.book.remove(offer_id)
+            else:
+                self.book.upsert(offer)
+
+
+matching_engine = MatchingEngine(order_book)
@@ -0,0 +1,311 @@
+"""
+Request, SQL and connection pool metrics in the Prometheus text format
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Metrics configuration
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_LATENCY_BUCKETS = tuple(
+    float(bound) for bound in os.getenv(
+        "METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+    ).split(",")
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+UNMATCHED_ROUTE = "unmatched"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing value per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    """A value per label combination that can go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """Observation counts in fixed buckets, with their sum, per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = METRICS_LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            slots = self._values.get(labels)
+            if slots is None:
+                slots = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            slots[index] += 1
+            slots[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, list(slots)) for key, slots in self._values.items())
+        lines = []
+        for key, slots in values:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, float("inf")), slots):
+                cumulative += count
+                le = _labels(self.label_names, key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {_number(cumulative)}")
+            labels = _labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_number(slots[-1])}")
+            lines.append(f"{self.name}_count{labels} {_number(cumulative)}")
+        return lines
+
+
+# A collector returns (name, kind, help, [(label names, label values, value)]) read at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Sequence[str], Sequence[Any], float]]]]]
+
+
+class Registry:
+    """The metrics exposed on /metrics."""
+
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_labels(names, values)} {_number(value)}" for names, values, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status code.", ("method", "route", "status")
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route")
+))
+IN_PROGRESS = registry.register(Gauge(
+    "http_requests_in_progress", "HTTP requests currently being handled.", ("method", "route")
+))
+REQUEST_STATEMENTS = registry.register(Histogram(
+    "http_request_db_statements", "SQL statements executed per HTTP request.", ("method", "route"),
+    buckets=STATEMENT_BUCKETS,
+))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per HTTP request.", ("method", "route")
+))
+STATEMENTS = registry.register(Counter(
+    "db_statements_total", "SQL statements executed, inside and outside requests.", ("context",)
+))
+STATEMENT_SECONDS = registry.register(Counter(
+    "db_statement_seconds_total", "Time spent executing SQL, inside and outside requests.", ("context",)
+))
+
+
+class SQLStats:
+    """Statement count and execution time of one request."""
+
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# The stats of the request being handled; threadpool and greenlet hops copy the context
+current_sql: ContextVar[Optional[SQLStats]] = ContextVar("current_sql", default=None)
+
+_QUERY_STARTS = "metrics_query_starts"
+
+
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                           context: Any, executemany: bool) -> None:
+    conn.info.setdefault(_QUERY_STARTS, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                          context: Any, executemany: bool) -> None:
+    starts = conn.info.get(_QUERY_STARTS)
+    if not starts:
+        return
+    _record(time.perf_counter() - starts.pop())
+
+
+def _handle_error(exception_context: Any) -> None:
+    connection = exception_context.connection
+    starts = connection.info.get(_QUERY_STARTS) if connection is not None else None
+    if starts:
+        _record(time.perf_counter() - starts.pop())
+
+
+def _record(elapsed: float) -> None:
+    stats = current_sql.get()
+    if stats is None:
+        STATEMENTS.inc("background")
+        STATEMENT_SECONDS.inc("background", amount=elapsed)
+        return
+    stats.statements += 1
+    stats.seconds += elapsed
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Count and time every statement the engine executes."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def pool_collector(stats: Callable[[], Dict[str, Dict[str, Any]]]) -> Collector:
+    """Expose engine pool usage and checkout waits, as reported by stats(), at scrape time."""
+    gauges = {
+        "size": ("db_pool_size", "gauge", "Connections the pool keeps open."),
+        "max_overflow": ("db_pool_max_overflow", "gauge", "Connections allowed beyond the pool size."),
+        "checked_out": ("db_pool_checked_out", "gauge", "Connections currently in use."),
+        "idle": ("db_pool_idle", "gauge", "Open connections waiting in the pool."),
+        "checkouts": ("db_pool_checkouts_total", "counter", "Connection checkouts."),
+        "saturated_checkouts": (
+            "db_pool_saturated_checkouts_total", "counter", "Checkouts that found every connection in use."
+        ),
+        "timeouts": ("db_pool_timeouts_total", "counter", "Checkouts that timed out."),
+        "wait_seconds_total": ("db_pool_wait_seconds_total", "counter", "Time spent waiting for a connection."),
+        "wait_seconds_max": ("db_pool_wait_seconds_max", "gauge", "Longest wait for a connection."),
+    }
+
+    def collect() -> Iterable[Tuple[str, str, str, List[Tuple[Sequence[str], Sequence[Any], float]]]]:
+        pools = stats()
+        for key, (name, kind, documentation) in gauges.items():
+            samples = [(("engine",), (engine,), entry[key]) for engine, entry in pools.items() if key in entry]
+            if samples:
+                yield name, kind, documentation, samples
+
+    return collect
+
+
+class MetricsMiddleware:
+    """Times each HTTP request and counts its SQL, labelled by the route template it matched.
+
+    Labelling by template (/api/offers/{offer_id}) rather than path keeps
+    the number of series bounded however many ids are requested.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    def route_template(self, scope: Scope) -> str:
+        partial = None
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or UNMATCHED_ROUTE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self.route_template(scope)
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = SQLStats()
+        token = current_sql.set(stats)
+        IN_PROGRESS.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_sql.reset(token)
+            IN_PROGRESS.dec(method, route)
+            REQUESTS.inc(method, route, str(status))
+            REQUEST_SECONDS.observe(elapsed, method, route)
+            REQUEST_STATEMENTS.observe(stats.statements, method, route)
+            REQUEST_DB_SECONDS.observe(stats.seconds, method, route)
+            STATEMENTS.inc("request", amount=stats.statements)
+            STATEMENT_SECONDS.inc("request", amount=stats.seconds)
@@ -0,0 +1,411 @@
+"""
+In-memory order book index for active offers
+"""
+
+import heapq
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from ..models.models import Offer
+from .pagination import sort_key
+
+_LOWEST = float("-inf")
+_HIGHEST = float("inf")
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Called as listener(currency, op, offer_id, entry) with op "add", "update" or "remove"
+BookListener = Callable[[str, str, int, Optional["BookEntry"]], None]
+
+# Offer columns a BookEntry is built from, for queries whose rows go to upsert()
+ENTRY_COLUMNS = (
+    Offer.id, Offer.seller_id, Offer.currency, Offer.min_amount, Offer.max_amount,
+    Offer.price_per_unit, Offer.is_active, Offer.created_at, Offer.version,
+)
+
+
+def created_key(created_at: Optional[datetime]) -> int:
+    """Exact integer key of a creation time, ordered like sort_key orders it."""
+    return ((created_at or datetime.min) - _EPOCH) // _MICROSECOND
+
+
+@dataclass(frozen=True)
+class BookEntry:
+    """Immutable snapshot of an offer as held in the book."""
+    id: int
+    seller_id: int
+    currency: str
+    min_amount: float
+    max_amount: float
+    price_per_unit: float
+    is_active: bool
+    created_at: Optional[datetime]
+    version: int  # Offer version the snapshot was taken at
+
+    @classmethod
+    def from_offer(cls, offer: Offer) -> "BookEntry":
+        """Snapshot an Offer row so the book never holds session-bound objects."""
+        return cls(
+            id=offer.id,
+            seller_id=offer.seller_id,
+            currency=offer.currency,
+            min_amount=offer.min_amount,
+            max_amount=offer.max_amount,
+            price_per_unit=offer.price_per_unit,
+            is_active=bool(offer.is_active),
+            created_at=offer.created_at,
+            version=offer.version,
+        )
+
+    @property
+    def indexable(self) -> bool:
+        """Whether the entry is active and has every key the book sorts on."""
+        return (
+            self.is_active
+            and self.currency is not None
+            and self.price_per_unit is not None
+            and self.min_amount is not None
+            and self.max_amount is not None
+        )
+
+
+class SortedIndex:
+    """Sorted (key, offer_id) pairs answering range queries by bisection.
+
+    Pairs live in consecutive sublists of bounded size, so an insert or
+    delete only shifts one short sublist. That keeps updates cheap at
+    millions of resting offers, where a single flat list would move
+    megabytes on every change.
+    """
+
+    _LOAD = 1000
+
+    def __init__(self) -> None:
+        self._lists: List[List[Tuple[float, int]]] = []
+        self._maxes: List[Tuple[float, int]] = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def rebuild(self, items: Iterable[Tuple[float, int]]) -> None:
+        """Replace the contents with a single sort instead of repeated inserts."""
+        ordered = sorted(items)
+        self._lists = [ordered[i:i + self._LOAD] for i in range(0, len(ordered), self._LOAD)]
+        self._maxes = [sublist[-1] for sublist in self._lists]
+        self._len = len(ordered)
+
+    def add(self, key: float, offer_id: int) -> None:
+        item = (key, offer_id)
+        if not self._lists:
+            self._lists.append([item])
+            self._maxes.append(item)
+        else:
+            i = bisect_left(self._maxes, item)
+            if i == len(self._maxes):
+                i -= 1
+                self._lists[i].append(item)
+                self._maxes[i] = item
+            else:
+                insort(self._lists[i], item)
+            sublist = self._lists[i]
+            if len(sublist) > 2 * self._LOAD:
+                self._lists[i:i + 1] = [sublist[:self._LOAD], sublist[self._LOAD:]]
+                self._maxes[i:i + 1] = [sublist[self._LOAD - 1], sublist[-1]]
+        self._len += 1
+
+    def discard(self, key: float, offer_id: int) -> None:
+        item = (key, offer_id)
+        i = bisect_left(self._maxes, item)
+        if i == len(self._maxes):
+            return
+        sublist = self._lists[i]
+        j = bisect_left(sublist, item)
+        if j == len(sublist) or sublist[j] != item:
+            return
+        del sublist[j]
+        self._len -= 1
+        if not sublist:
+            del self._lists[i]
+            del self._maxes[i]
+        elif j == len(sublist):
+            self._maxes[i] = sublist[-1]
+
+    def first_key(self) -> Optional[float]:
+        """Return the smallest key, or None if the index is empty."""
+        return self._lists[0][0][0] if self._lists else None
+
+    def _position(self, item: Tuple[float, float], right: bool) -> Tuple[int, int]:
+        """Locate item as (sublist, offset), like bisect_left/bisect_right on a flat list."""
+        find = bisect_right if right else bisect_left
+        i = find(self._maxes, item)
+        if i == len(self._maxes):
+            return i, 0
+        return i, find(self._lists[i], item)
+
+    def bounds(
+        self, low: Optional[float], high: Optional[float]
+    ) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """Return the start and end positions of the keys within [low, high]."""
+        start = (0, 0) if low is None else self._position((low, _LOWEST), right=False)
+        end = (len(self._lists), 0) if high is None else self._position((high, _HIGHEST), right=True)
+        return start, max(start, end)
+
+    def count(self, low: Optional[float], high: Optional[float]) -> int:
+        (i, j), (end_i, end_j) = self.bounds(low, high)
+        if i == end_i:
+            return end_j - j
+        total = len(self._lists[i]) - j + end_j
+        for k in range(i + 1, end_i):
+            total += len(self._lists[k])
+        return total
+
+    def ids(self, low: Optional[float], high: Optional[float]) -> Iterator[int]:
+        """Yield offer ids in key order for keys within [low, high]."""
+        start, end = self.bounds(low, high)
+        return self._walk(start, end)
+
+    def ids_after(self, key: float, offer_id: int) -> Iterator[int]:
+        """Yield offer ids in key order from just after the (key, offer_id) pair."""
+        return self._walk(self._position((key, offer_id), right=True), (len(self._lists), 0))
+
+    def _walk(self, start: Tuple[int, int], end: Tuple[int, int]) -> Iterator[int]:
+        (i, j), (end_i, end_j) = start, end
+        while i < end_i or (i == end_i and j < end_j):
+            sublist = self._lists[i]
+            stop = end_j if i == end_i else len(sublist)
+            for position in range(j, stop):
+                yield sublist[position][1]
+            i, j = i + 1, 0
+
+
+class CurrencyBook:
+    """Active offers for one currency, indexed by price, by amount bounds and by creation."""
+
+    def __init__(self, currency: str) -> None:
+        self.currency = currency
+        self.entries: Dict[int, BookEntry] = {}
+        self.by_price = SortedIndex()
+        self.by_min_amount = SortedIndex()
+        self.by_max_amount = SortedIndex()
+        self.by_created = SortedIndex()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def rebuild(self, entries: List[BookEntry]) -> None:
+        self.entries = {entry.id: entry for entry in entries}
+        self.by_price.rebuild((entry.price_per_unit, entry.id) for entry in entries)
+        self.by_min_amount.rebuild((entry.min_amount, entry.id) for entry in entries)
+        self.by_max_amount.rebuild((entry.max_amount, entry.id) for entry in entries)
+        self.by_created.rebuild((created_key(entry.created_at), entry.id) for entry in entries)
+
+    def add(self, entry: BookEntry) -> None:
+        self.entries[entry.id] = entry
+        self.by_price.add(entry.price_per_unit, entry.id)
+        self.by_min_amount.add(entry.min_amount, entry.id)
+        self.by_max_amount.add(entry.max_amount, entry.id)
+        self.by_created.add(created_key(entry.created_at), entry.id)
+
+    def replace(self, old: BookEntry, new: BookEntry) -> None:
+        """Swap an entry in place, re-sorting only the indexes whose key changed."""
+        self.entries[new.id] = new
+        for index, attribute in (
+            (self.by_price, "price_per_unit"),
+            (self.by_min_amount, "min_amount"),
+            (self.by_max_amount, "max_amount"),
+        ):
+            old_key, new_key = getattr(old, attribute), getattr(new, attribute)
+            if old_key != new_key:
+                index.discard(old_key, old.id)
+                index.add(new_key, new.id)
+        if old.created_at != new.created_at:
+            self.by_created.discard(created_key(old.created_at), old.id)
+            self.by_created.add(created_key(new.created_at), new.id)
+
+    def discard(self, offer_id: int) -> Optional[BookEntry]:
+        entry = self.entries.pop(offer_id, None)
+        if entry is not None:
+            self.by_price.discard(entry.price_per_unit, entry.id)
+            self.by_min_amount.discard(entry.min_amount, entry.id)
+            self.by_max_amount.discard(entry.max_amount, entry.id)
+            self.by_created.discard(created_key(entry.created_at), entry.id)
+        return entry
+
+    def asks(self, max_price: Optional[float] = None) -> Iterator[BookEntry]:
+        """Yield offers cheapest first, oldest first within a price, up to max_price."""
+        for offer_id in self.by_price.ids(None, max_price):
+            yield self.entries[offer_id]
+
+    def search(
+        self,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[BookEntry]:
+        """Yield offers matching every bound in (created_at, id) order, from just after after.
+
+        Either walks the creation index and skips non-matches, or collects
+        the narrowest bound's range and sorts only that, whichever should
+        touch fewer entries to produce limit of them. Walking expects to
+        check limit * len / narrowest entries; collecting sorts narrowest.
+        """
+        def within(entry: BookEntry) -> bool:
+            return not (
+                (min_price is not None and entry.price_per_unit < min_price)
+                or (max_price is not None and entry.price_per_unit > max_price)
+                or (min_amount is not None and entry.min_amount < min_amount)
+                or (max_amount is not None and entry.max_amount > max_amount)
+            )
+
+        ranges = [
+            (self.by_price, min_price, max_price),
+            (self.by_min_amount, min_amount, None),
+            (self.by_max_amount, None, max_amount),
+        ]
+        index, low, high = min(ranges, key=lambda candidate: candidate[0].count(candidate[1], candidate[2]))
+        narrowest = index.count(low, high)
+        if not narrowest:
+            return
+        wanted = len(self.entries) if limit is None else limit
+        if wanted * len(self.entries) / narrowest <= narrowest * math.log2(narrowest + 1):
+            ids = self.by_created.ids(None, None) if after is None else self.by_created.ids_after(
+                created_key(after[0]), after[1]
+            )
+            for offer_id in ids:
+                entry = self.entries[offer_id]
+                if within(entry):
+                    yield entry
+            return
+
+        matches = [self.entries[offer_id] for offer_id in index.ids(low, high)]
+        matches = [entry for entry in matches if within(entry)]
+        matches.sort(key=sort_key)
+        start = 0 if after is None else bisect_right(matches, after, key=sort_key)
+        yield from matches[start:]
+
+
+class OrderBook:
+    """Per-currency index of active offers, kept in step with the offers table.
+
+    Listeners are told about every entry added, updated or removed after
+    load. They run while the lock is held, so they must be quick.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self._books: Dict[str, CurrencyBook] = {}
+        self._currency_of: Dict[int, str] = {}
+        self._listeners: List[BookListener] = []
+
+    def add_listener(self, listener: BookListener) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, currency: str, op: str, offer_id: int, entry: Optional[BookEntry]) -> None:
+        for listener in self._listeners:
+            listener(currency, op, offer_id, entry)
+
+    def book(self, currency: str) -> Optional[CurrencyBook]:
+        """Return the live book for a currency; hold lock while reading it."""
+        return self._books.get(currency)
+
+    def load(self, db: Session) -> None:
+        """Rebuild every currency book from the active rows in the offers table."""
+        grouped: Dict[str, List[BookEntry]] = defaultdict(list)
+        for offer in db.query(Offer).filter(Offer.is_active == True).all():
+            entry = BookEntry.from_offer(offer)
+            if entry.indexable:
+                grouped[entry.currency].append(entry)
+
+        books = {}
+        for currency, entries in grouped.items():
+            book = CurrencyBook(currency)
+            book.rebuild(entries)
+            books[currency] = book
+
+        with self.lock:
+            self._books = books
+            self._currency_of = {
+                entry.id: currency for currency, entries in grouped.items() for entry in entries
+            }
+
+    def upsert(self, offer: Offer) -> None:
+        """Index an offer after it was created or changed, dropping it if no longer active."""
+        entry = BookEntry.from_offer(offer)
+        with self.lock:
+            current = self._books.get(self._currency_of.get(entry.id))
+            if current is not None and entry.indexable and current.currency == entry.currency:
+                current.replace(current.entries[entry.id], entry)
+                self._notify(entry.currency, "update", entry.id, entry)
+                return
+            self._discard(entry.id)
+            if not entry.indexable:
+                return
+            book = self._books.get(entry.currency)
+            if book is None:
+                book = self._books[entry.currency] = CurrencyBook(entry.currency)
+            book.add(entry)
+            self._currency_of[entry.id] = entry.currency
+            self._notify(entry.currency, "add", entry.id, entry)
+
+    def remove(self, offer_id: int) -> None:
+        """Drop an offer from the book, e.g. after it was deleted."""
+        with self.lock:
+            self._discard(offer_id)
+
+    def _discard(self, offer_id: int) -> Optional[BookEntry]:
+        currency = self._currency_of.pop(offer_id, None)
+        if currency is None:
+            return None
+        entry = self._books[currency].discard(offer_id)
+        self._notify(currency, "remove", offer_id, None)
+        return entry
+
+    def offer_ids(self) -> Set[int]:
+        """Return the ids of every offer in the book."""
+        with self.lock:
+            return set(self._currency_of)
+
+    def entries(self, currency: str) -> List[BookEntry]:
+        """Return a copy of a currency's active offers, cheapest first."""
+        with self.lock:
+            book = self._books.get(currency)
+            return list(book.asks()) if book is not None else []
+
+    def search(
+        self,
+        currency: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        limit: Optional[int] = None,
+    ) -> List[BookEntry]:
+        """Return up to limit active offers matching the filters in (created_at, id) order.
+
+        Starts just after the after position. Each currency yields its
+        matches already in order, so they are merged and the merge stops at
+        limit rather than every match being collected and sorted.
+        """
+        with self.lock:
+            if currency:
+                books = [self._books[currency]] if currency in self._books else []
+            else:
+                books = list(self._books.values())
+            streams = [
+                book.search(min_price, max_price, min_amount, max_amount, after, limit) for book in books
+            ]
+            return list(islice(heapq.merge(*streams, key=sort_key), limit))
+
+
+order_book = OrderBook()
@@ -0,0 +1,95 @@
+"""
+Keyset (cursor) pagination helpers for list endpoints
+"""
+
+import base64
+import binascii
+import os
+from datetime import datetime
+from typing import Any, Optional, Sequence, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_, union_all
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pagination configuration
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+# Latest messages embedded per trade in a trade list page with include=messages
+SUMMARY_MESSAGES = int(os.getenv("SUMMARY_MESSAGES", "20"))
+
+
+def page_size(limit: Optional[int]) -> int:
+    """Resolve a requested page size, clamped to the server-side cap."""
+    if not limit:
+        return min(DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def sort_key(row: Any) -> Tuple[datetime, int]:
+    """Return the (created_at, id) position of a row in keyset order."""
+    return (row.created_at or datetime.min, row.id)
+
+
+def encode_cursor(created_at: Optional[datetime], row_id: int) -> str:
+    """Encode a keyset position as an opaque cursor string."""
+    created_at = created_at or datetime.min
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode an opaque cursor back into its (created_at, id) position."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def after_cursor(query: Any, model: Any, cursor: Optional[str]) -> Any:
+    """Restrict a query to the rows after the cursor's (created_at, id) position."""
+    if not cursor:
+        return query
+    created_at, row_id = decode_cursor(cursor)
+    return query.filter(or_(
+        model.created_at > created_at,
+        and_(model.created_at == created_at, model.id > row_id)
+    ))
+
+
+def keyset(query: Any, model: Any, cursor: Optional[str], limit: int) -> Any:
+    """Order a query by (created_at, id) and resume it just after the cursor.
+
+    One extra row is fetched so the caller can tell whether another page
+    exists. The cursor becomes a range predicate rather than an OFFSET, so
+    deep pages cost the same as the first one.
+    """
+    return after_cursor(query, model, cursor).order_by(model.created_at, model.id).limit(limit + 1)
+
+
+def keyset_union(queries: Sequence[Any], model: Any, cursor: Optional[str], limit: int) -> Any:
+    """Keyset page over the UNION ALL of queries that select disjoint rows of one model.
+
+    Where one query with an OR has to sort every match, each branch here
+    is read in order from its own index ending in (created_at, id), and
+    the database merges the branches until the page is full.
+    """
+    union = union_all(*(after_cursor(query, model, cursor) for query in queries))
+    columns = union.selected_columns
+    return union.order_by(columns.created_at, columns.id).limit(limit + 1)
+
+
+def make_page(rows: Sequence[Any], limit: int) -> dict:
+    """Build a page from up to limit + 1 rows fetched in keyset order."""
+    items = list(rows[:limit])
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(*sort_key(items[-1]))
+    return {"items": items, "next_cursor": next_cursor}
+
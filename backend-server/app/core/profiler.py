@@ -0,0 +1,310 @@
+"""
+Opt-in per-request SQL profiler with N+1 detection and a sampling CPU profile
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from greenlet import getcurrent
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Profiler configuration
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_HEADER_ENABLED = os.getenv("PROFILER_HEADER_ENABLED", "false").lower() == "true"
+PROFILER_CPU = os.getenv("PROFILER_CPU", "false").lower() == "true"
+PROFILER_N_PLUS_ONE_THRESHOLD = int(os.getenv("PROFILER_N_PLUS_ONE_THRESHOLD", "5"))
+PROFILER_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILER_SAMPLE_INTERVAL_MS", "5"))
+PROFILER_REPORT_DIR = os.getenv("PROFILER_REPORT_DIR", "")
+
+# Request header that turns profiling on for one request when PROFILER_HEADER_ENABLED is set:
+# "sql" (or any other value) profiles SQL only, "cpu" adds the sampling profile
+PROFILE_HEADER = b"x-profile"
+
+APP_DIR = str(Path(__file__).resolve().parents[1])
+HEADER_SQL_LIMIT = 200
+# A thread whose innermost frame is in one of these is blocked waiting, not using CPU
+IDLE_FILES = {"selectors.py", "threading.py", "queue.py"}
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"\$\d+|%\(\w+\)s|%s|:\w+|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def fingerprint(statement: str) -> str:
+    """Reduce a statement to its shape: literals and placeholders become ?, IN lists one ?."""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _STRING.sub("?", shape)
+    shape = _PLACEHOLDER.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    return _IN_LIST.sub("(?)", shape)
+
+
+def _is_app_frame(frame: Any) -> bool:
+    filename = frame.f_code.co_filename
+    return filename.startswith(APP_DIR) and filename != __file__
+
+
+def _describe(frame: Any) -> str:
+    return f"{os.path.relpath(frame.f_code.co_filename, APP_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+
+def caller() -> Optional[str]:
+    """The innermost application frame that led to the current statement.
+
+    Async sessions run SQL inside a greenlet whose own stack stops at
+    SQLAlchemy; the awaiting coroutines are on the suspended parent
+    greenlet's stack, so that is searched next.
+    """
+    frame = sys._getframe(1)
+    current = getcurrent()
+    while current is not None:
+        while frame is not None:
+            if _is_app_frame(frame):
+                return _describe(frame)
+            frame = frame.f_back
+        current = current.parent
+        frame = current.gr_frame if current is not None else None
+    return None
+
+
+class Profile:
+    """Everything recorded about one request."""
+
+    def __init__(self, method: str, path: str, cpu: bool) -> None:
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.statements: List[Dict[str, Any]] = []
+        self.threads: Set[int] = {threading.get_ident()}
+        self.sampler = StackSampler(self.threads) if cpu else None
+
+    def record(self, statement: str, elapsed: float, rows: int, location: Optional[str]) -> None:
+        self.threads.add(threading.get_ident())
+        self.statements.append({
+            "sql": statement,
+            "fingerprint": fingerprint(statement),
+            "ms": round(elapsed * 1000, 3),
+            "rows": rows,
+            "caller": location,
+        })
+
+    def n_plus_one(self, threshold: int = PROFILER_N_PLUS_ONE_THRESHOLD) -> List[Dict[str, Any]]:
+        """Statement shapes repeated at least threshold times, most repeated first."""
+        counts = Counter(entry["fingerprint"] for entry in self.statements)
+        suspects = []
+        for shape, count in counts.most_common():
+            if count < threshold:
+                break
+            entries = [entry for entry in self.statements if entry["fingerprint"] == shape]
+            suspects.append({
+                "fingerprint": shape,
+                "count": count,
+                "ms": round(sum(entry["ms"] for entry in entries), 3),
+                "callers": sorted({entry["caller"] for entry in entries if entry["caller"]}),
+            })
+        return suspects
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "statements": len(self.statements),
+            "sql_ms": round(sum(entry["ms"] for entry in self.statements), 3),
+        }
+
+
+class StackSampler:
+    """Samples thread stacks on an interval, from a background thread.
+
+    Samples are taken from the watched threads (the event loop thread, and
+    worker threads once they run SQL for the request) and from any thread
+    that is inside application code, which covers sync handlers running in
+    the threadpool. Threads blocked waiting are idle and not counted. Other
+    requests running at the same time show up in the samples too.
+    """
+
+    def __init__(self, threads: Set[int], interval: float = PROFILER_SAMPLE_INTERVAL_MS / 1000) -> None:
+        self.threads = threads
+        self.interval = interval
+        self.stacks: "Counter[str]" = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            watched = set(self.threads)
+            for ident, frame in sys._current_frames().items():
+                if ident == own or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack, in_app = [], ident in watched
+                while frame is not None:
+                    in_app = in_app or _is_app_frame(frame)
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if in_app:
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def top(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """The hottest functions by samples with them on top of the stack."""
+        leaves: Dict[str, int] = defaultdict(int)
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        ranked = sorted(leaves.items(), key=lambda item: -item[1])[:limit]
+        return [{"function": name, "samples": count} for name, count in ranked]
+
+
+# The profile of the request being handled, if it is being profiled
+current_profile: ContextVar[Optional[Profile]] = ContextVar("current_profile", default=None)
+
+_PROFILE_STARTS = "profiler_query_starts"
+
+
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                           context: Any, executemany: bool) -> None:
+    if current_profile.get() is not None:
+        conn.info.setdefault(_PROFILE_STARTS, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                          context: Any, executemany: bool) -> None:
+    profile = current_profile.get()
+    starts = conn.info.get(_PROFILE_STARTS)
+    if profile is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    profile.record(statement, elapsed, cursor.rowcount, caller())
+
+
+def _handle_error(exception_context: Any) -> None:
+    connection = exception_context.connection
+    starts = connection.info.get(_PROFILE_STARTS) if connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Record the engine's statements into the current request's profile."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _header_value(text: str) -> str:
+    text = text if len(text) <= HEADER_SQL_LIMIT else text[:HEADER_SQL_LIMIT - 3] + "..."
+    return text.encode("latin-1", "replace").decode("latin-1")
+
+
+class ProfilerMiddleware:
+    """Profiles requests when PROFILER_ENABLED is set, or on request via the X-Profile header.
+
+    The statement count, SQL time and any N+1 suspects are returned as
+    X-Profile-* response headers. With PROFILER_REPORT_DIR set, the full
+    statement log and CPU samples are written there as one JSON file per
+    request, named in the X-Profile-Report header.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    def requested(self, scope: Scope) -> Tuple[bool, bool]:
+        """Return whether to profile the request, and whether to sample its CPU."""
+        value = None
+        if PROFILER_HEADER_ENABLED:
+            value = dict(scope["headers"]).get(PROFILE_HEADER)
+        if value is None and not PROFILER_ENABLED:
+            return False, False
+        return True, PROFILER_CPU or value == b"cpu"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        enabled, cpu = self.requested(scope)
+        if not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], cpu)
+        report = Path(PROFILER_REPORT_DIR) / f"{int(time.time())}-{uuid.uuid4().hex[:8]}.json" if PROFILER_REPORT_DIR else None
+
+        async def send_with_profile(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                summary = profile.summary()
+                headers["X-Profile-Duration-Ms"] = str(summary["duration_ms"])
+                headers["X-Profile-Statements"] = str(summary["statements"])
+                headers["X-Profile-SQL-Ms"] = str(summary["sql_ms"])
+                suspects = profile.n_plus_one()
+                if suspects:
+                    headers["X-Profile-N-Plus-One"] = _header_value(" | ".join(
+                        f"{suspect['count']}x {suspect['fingerprint']}" for suspect in suspects
+                    ))
+                if report is not None:
+                    headers["X-Profile-Report"] = report.name
+            await send(message)
+
+        token = current_profile.set(profile)
+        if profile.sampler is not None:
+            profile.sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            current_profile.reset(token)
+            if profile.sampler is not None:
+                profile.sampler.stop()
+            self.finish(profile, report)
+
+    def finish(self, profile: Profile, report: Optional[Path]) -> None:
+        summary = profile.summary()
+        suspects = profile.n_plus_one()
+        for entry in profile.statements:
+            logger.info("%s %s %.3fms %s [%s]", profile.method, profile.path, entry["ms"], entry["sql"], entry["caller"])
+        for suspect in suspects:
+            logger.warning(
+                "possible N+1 in %s %s: %d x %s (%.3fms) from %s", profile.method, profile.path,
+                suspect["count"], suspect["fingerprint"], suspect["ms"], ", ".join(suspect["callers"]) or "unknown",
+            )
+        if report is None:
+            return
+        body = {"method": profile.method, "path": profile.path, **summary, "n_plus_one": suspects,
+                "queries": profile.statements}
+        if profile.sampler is not None:
+            body["cpu"] = {
+                "interval_ms": profile.sampler.interval * 1000,
+                "samples": profile.sampler.samples,
+                "top": profile.sampler.top(),
+                # Collapsed stacks, one "frame;frame;frame count" line each, for flame graph tools
+                "stacks": [f"{stack} {count}" for stack, count in profile.sampler.stacks.most_common()],
+            }
+        report.parent.mkdir(parents=True, exist_ok=True)
+        report.write_text(json.dumps(body, indent=2))
@@ -0,0 +1,136 @@
+"""
+Fan-out of realtime messages to WebSocket connections, across workers through the backend
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from dotenv import load_dotenv
+from .backends import Backend, backend
+
+load_dotenv()
+
+# Realtime configuration
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+
+
+class Subscription:
+    """One connection's bounded inbox on a channel.
+
+    A consumer too slow to keep up is marked overflowed instead of letting
+    its queue grow. The connection then either closes so the client
+    resumes from its last seen position, or is resynced from a snapshot.
+    """
+
+    def __init__(self, channel: str, maxsize: int) -> None:
+        self.channel = channel
+        self.queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, message: Any) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def reset(self) -> None:
+        """Drop everything queued and accept messages again."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.overflowed = False
+
+
+class ChannelHub:
+    """Routes published messages to every subscription on a channel.
+
+    With a backend, messages are also relayed under name to the hubs of
+    the other workers, so a subscriber sees them whichever worker its
+    connection landed on. Relayed messages must be JSON-encodable.
+    """
+
+    def __init__(self, queue_size: int = WS_QUEUE_SIZE, backend: Optional[Backend] = None,
+                 name: str = "hub") -> None:
+        self.queue_size = queue_size
+        self.backend = backend
+        self.name = name
+        self._subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        if backend is not None:
+            backend.subscribe(name, self._relayed)
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel, self.queue_size)
+        self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.channel)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.channel]
+
+    def publish(self, channel: str, message: Any) -> None:
+        """Deliver a message to the channel's subscribers without waiting on any of them."""
+        self._deliver(channel, message)
+        if self.backend is not None:
+            self.backend.publish(self.name, [channel, message])
+
+    def _deliver(self, channel: str, message: Any) -> None:
+        for subscription in list(self._subscriptions.get(channel, ())):
+            subscription.offer(message)
+
+    def _relayed(self, relayed: List[Any]) -> None:
+        channel, message = relayed
+        self._deliver(channel, message)
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self._subscriptions.get(channel, ()))
+
+
+chat_hub = ChannelHub(backend=backend, name="chat")
+
+
+async def pump(
+    websocket: Any,
+    subscription: Subscription,
+    transform: Callable[[Any], Optional[Any]],
+    resync: Optional[Callable[[], Awaitable[None]]] = None,
+) -> None:
+    """Forward a subscription to a WebSocket until either side gives up.
+
+    transform turns a published message into the frame to send, or None to
+    skip it. Incoming frames are read and discarded so disconnects are
+    noticed. A subscriber that overflowed is closed with 1013 (try again
+    later) so the client reconnects and resumes, unless resync is given:
+    then its backlog is dropped and resync sends a fresh snapshot instead.
+    """
+    async def forward() -> None:
+        while True:
+            message = await subscription.queue.get()
+            # A full queue is only drained through here, so overflow is seen promptly
+            if subscription.overflowed:
+                if resync is None:
+                    return
+                subscription.reset()
+                await resync()
+                continue
+            frame = transform(message)
+            if frame is not None:
+                await websocket.send_json(frame)
+
+    async def drain() -> None:
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.ensure_future(forward()), asyncio.ensure_future(drain())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if subscription.overflowed:
+        await websocket.close(code=1013)
@@ -0,0 +1,262 @@
+"""
+Tag-invalidated cache of public GET responses, with ETags and 304 revalidation
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from ..models.models import Offer, User
+from . import metrics
+from .backends import backend
+from .order_book import BookEntry, OrderBook, order_book
+
+load_dotenv()
+
+# Response cache configuration
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", "67108864"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+# Clients may keep a copy but must revalidate it, which is where If-None-Match comes in
+CACHE_CONTROL = "no-cache"
+# Rough bookkeeping cost of an entry beyond its body, so tiny bodies still count against the budget
+ENTRY_OVERHEAD_BYTES = 256
+# Invalidation generations are kept per hash slot rather than per tag, so they take fixed memory
+GENERATION_SLOTS = 4096
+
+REQUESTS = metrics.registry.register(metrics.Counter(
+    "response_cache_requests_total", "Cacheable GET requests by cache result.", ("result",)
+))
+
+
+def offer_tag(offer_id: int) -> str:
+    return f"offer:{offer_id}"
+
+
+def offers_tag(currency: Optional[str] = None) -> str:
+    """Tag of offer list pages, for one currency or unfiltered."""
+    return f"offers:{currency}" if currency is not None else "offers"
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match uses."""
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    headers: Tuple[Tuple[str, str], ...]
+    etag: str
+    tags: Tuple[str, ...]
+    expires_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + ENTRY_OVERHEAD_BYTES
+
+    @classmethod
+    def from_response(cls, response: Response, tags: Sequence[str], ttl: float) -> "CachedResponse":
+        body = bytes(response.body)
+        headers = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in response.raw_headers if name != b"content-length"
+        }
+        # A handler may supply its own validator, e.g. a row version
+        etag = headers.setdefault("etag", _etag(body))
+        headers["cache-control"] = CACHE_CONTROL
+        return cls(body, tuple(headers.items()), etag, tuple(tags), time.monotonic() + ttl)
+
+    def response(self) -> Response:
+        return Response(content=self.body, headers=dict(self.headers))
+
+    def not_modified(self) -> Response:
+        return Response(status_code=304, headers={"ETag": self.etag, "Cache-Control": CACHE_CONTROL})
+
+
+class ResponseCache:
+    """GET responses keyed by path and sorted query string, evicted LRU within a byte budget.
+
+    Each entry carries the tags of the rows it was built from, and writes
+    invalidate by tag, so only the responses they affect are dropped. Tags
+    have generations: a response computed while one of its tags was
+    invalidated is not stored, as it may predate the write. Tags share
+    generation slots by hash, which at worst skips storing a response.
+    The TTL only bounds the damage of a write path that forgets to
+    invalidate.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, book: OrderBook) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._keys_by_tag: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._generations = [0] * GENERATION_SLOTS
+        self._lock = threading.Lock()
+        # Matching and expiry change offers outside the offers router; the book sees them all
+        book.add_listener(self.record)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(request: Request) -> Hashable:
+        return request.url.path, tuple(sorted(request.query_params.multi_items()))
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _generation(self, tag: str) -> int:
+        return self._generations[hash(tag) % GENERATION_SLOTS]
+
+    def generations(self, tags: Iterable[str]) -> Tuple[int, ...]:
+        with self._lock:
+            return tuple(self._generation(tag) for tag in tags)
+
+    def set(self, key: Hashable, entry: CachedResponse, generations: Tuple[int, ...]) -> None:
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if generations != tuple(self._generation(tag) for tag in entry.tags):
+                return
+            self._drop(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            for tag in entry.tags:
+                self._keys_by_tag[tag].add(key)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def invalidate(self, *tags: str) -> None:
+        """Drop every response built from any of the tags."""
+        with self._lock:
+            for tag in tags:
+                self._generations[hash(tag) % GENERATION_SLOTS] += 1
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generations = [generation + 1 for generation in self._generations]
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            self.size = 0
+
+    async def serve(self, request: Request, tags: Sequence[str],
+                    handler: Callable[[], Awaitable[Response]]) -> Response:
+        """Answer from the cache, or run handler and cache its response if it is a 200.
+
+        A client whose If-None-Match still matches gets an empty 304.
+        """
+        if not RESPONSE_CACHE_ENABLED:
+            return await handler()
+        key = self.key(request)
+        entry = self.get(key)
+        if entry is None:
+            generations = self.generations(tags)
+            response = await handler()
+            if response.status_code != 200:
+                return response
+            entry = CachedResponse.from_response(response, tags, self.ttl)
+            self.set(key, entry, generations)
+            result = "miss"
+        else:
+            result = "hit"
+        if _matches(request.headers.get("if-none-match"), entry.etag):
+            REQUESTS.inc("not_modified")
+            return entry.not_modified()
+        REQUESTS.inc(result)
+        return entry.response()
+
+    def record(self, currency: str, op: str, offer_id: int, entry: Optional[BookEntry]) -> None:
+        """Book listener: any change to an offer invalidates it and the lists that could show it."""
+        self.invalidate(offer_tag(offer_id), offers_tag(currency), offers_tag())
+
+    def collect(self) -> Iterable[Tuple[str, str, str, List[Tuple[Sequence[str], Sequence[Any], float]]]]:
+        yield "response_cache_bytes", "gauge", "Bytes held by the response cache.", [((), (), self.size)]
+        yield "response_cache_entries", "gauge", "Responses held by the response cache.", [((), (), len(self))]
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL_SECONDS, order_book)
+metrics.registry.add_collector(response_cache.collect)
+
+# Tags invalidated by ORM writes, sent to the other workers; book changes reach them through their own books
+INVALIDATE_CHANNEL = "response_cache"
+backend.subscribe(INVALIDATE_CHANNEL, lambda tags: response_cache.invalidate(*tags))
+backend.on_reset(response_cache.clear)
+
+_CHANGED = "response_cache_changed_tags"
+
+
+def _collect_changes(session: Session, flush_context: Any) -> None:
+    changed = session.info.setdefault(_CHANGED, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Offer):
+            changed.add(offer_tag(obj.id))
+        elif isinstance(obj, User):
+            changed.add(user_tag(obj.id))
+
+
+def _invalidate_changes(session: Session) -> None:
+    tags = session.info.pop(_CHANGED, None)
+    if tags:
+        response_cache.invalidate(*tags)
+        backend.publish(INVALIDATE_CHANNEL, sorted(tags))
+
+
+def _discard_changes(session: Session, *args: Any) -> None:
+    session.info.pop(_CHANGED, None)
+
+
+def track_writes() -> None:
+    """Invalidate cached offers and users once a transaction that wrote them commits.
+
+    Hooks ORM flushes, so the routers and the admin panel are both
+    covered. Offer lists follow the order book instead, and Core UPDATEs
+    such as the matching engine's reach the cache through the book.
+    """
+    if event.contains(Session, "after_flush", _collect_changes):
+        return
+    event.listen(Session, "after_flush", _collect_changes)
+    event.listen(Session, "after_commit", _invalidate_changes)
+    event.listen(Session, "after_rollback", _discard_changes)
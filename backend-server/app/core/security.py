@@ -3,16 +3,21 @@ Security utilities for NexusSwap
 """
 
 from datetime import datetime, timedelta
+import time
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from dotenv import load_dotenv
-from ..database import get_db
+from ..database import get_async_db
 from ..models.models import User
+from .backends import backend
+from .cache import TTLCache
+from .workers import BoundedExecutor
 
 load_dotenv()
 
@@ -21,8 +26,32 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-here-please-change-i
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# Password hashing configuration
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
+# Principal cache configuration
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+# Login throttling configuration; off by default, 0 attempts turns it off
+LOGIN_ATTEMPTS_PER_WINDOW = int(os.getenv("LOGIN_ATTEMPTS_PER_WINDOW", "0"))
+LOGIN_WINDOW_SECONDS = int(os.getenv("LOGIN_WINDOW_SECONDS", "60"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token")
+
+# bcrypt releases the GIL, so a small thread pool hashes in parallel
+# without blocking the event loop
+password_pool = BoundedExecutor("password-hash", PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
+
+# Decoded token claims keyed by raw token, and detached users keyed by token subject
+claims_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+
+# Carries a changed user's email to the other workers, or None to drop every cached user
+PRINCIPALS_CHANNEL = "principals"
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
@@ -32,6 +61,31 @@ def get_password_hash(password: str) -> str:
     """Generate a password hash."""
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the hashing pool instead of the event loop."""
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Generate a password hash on the hashing pool instead of the event loop."""
+    return await password_pool.run(get_password_hash, password)
+
+async def check_login_rate(email: str) -> None:
+    """Refuse a login once the account has used up its attempts for the current window.
+
+    Attempts are counted in the shared backend, so the limit holds across
+    every worker, and before the password is checked, so guessing cannot
+    flood the hashing pool either.
+    """
+    if LOGIN_ATTEMPTS_PER_WINDOW <= 0:
+        return
+    attempts = await backend.incr(f"login:{email.lower()}", ttl=LOGIN_WINDOW_SECONDS)
+    if attempts > LOGIN_ATTEMPTS_PER_WINDOW:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": str(LOGIN_WINDOW_SECONDS)},
+        )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
     to_encode = data.copy()
@@ -43,27 +97,70 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_token(token: str) -> dict:
+    """Decode a JWT, reusing the claims of tokens seen recently."""
+    payload = claims_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Never keep claims past the token's own expiry
+        expires_in = payload["exp"] - time.time() if "exp" in payload else None
+        claims_cache.set(token, payload, ttl=expires_in)
+    return payload
+
+def invalidate_principal(email: Optional[str]) -> None:
+    """Drop a cached user, in every worker, so the next request reloads it from the database."""
+    if email:
+        principal_cache.delete(email)
+        backend.publish(PRINCIPALS_CHANNEL, email)
+
+def clear_principals() -> None:
+    """Drop every cached user in every worker."""
+    principal_cache.clear()
+    backend.publish(PRINCIPALS_CHANNEL, None)
+
+def _drop_principal(email: Optional[str]) -> None:
+    if email is None:
+        principal_cache.clear()
+    else:
+        principal_cache.delete(email)
+
+backend.subscribe(PRINCIPALS_CHANNEL, _drop_principal)
+backend.on_reset(principal_cache.clear)
+
+async def resolve_user(token: str, db: AsyncSession) -> Optional[User]:
+    """Resolve a JWT to its user, or None if the token or user is invalid."""
+    try:
+        email: Optional[str] = decode_token(token).get("sub")
+    except JWTError:
+        return None
+    if email is None:
+        return None
+    
+    user = principal_cache.get(email)
+    if user is not None:
+        return user
+    
+    epoch = principal_cache.epoch
+    user = (await db.execute(select(User).where(User.email == email))).scalar_one_or_none()
+    if user is None:
+        return None
+    # Detach the user so the cached copy is never flushed by a later request
+    db.expunge(user)
+    principal_cache.set(email, user, epoch=epoch)
+    return user
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """Get the current user from the JWT token."""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == email).first()
+    user = await resolve_user(token, db)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 async def get_current_active_user(
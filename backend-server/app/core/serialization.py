@@ -0,0 +1,76 @@
+"""
+Fast serialization of list responses from projected rows
+"""
+
+import enum
+from datetime import date, datetime
+from operator import attrgetter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+from fastapi.responses import UJSONResponse
+from pydantic import BaseModel
+from .pagination import make_page
+
+
+def _iso(value: Any) -> str:
+    return value.isoformat()
+
+
+def _enum_value(value: Any) -> Any:
+    return value.value
+
+
+def _converter(annotation: Any) -> Optional[Callable[[Any], Any]]:
+    """Return the conversion a field's values need to be JSON-ready, or None if they already are."""
+    # Optional[X] and friends: look through to the first concrete argument
+    for candidate in (annotation, *getattr(annotation, "__args__", ())):
+        if isinstance(candidate, type):
+            if issubclass(candidate, (datetime, date)):
+                return _iso
+            if issubclass(candidate, enum.Enum):
+                return _enum_value
+    return None
+
+
+class RowSerializer:
+    """Turns row tuples into the JSON-ready dicts a response schema would produce.
+
+    The field list and per-field conversions are worked out once from the
+    schema, so each row costs a dict(zip()) plus the few conversions its
+    datetime and enum fields need, with no pydantic validation. Rows must
+    come from columns in schema field order, e.g. select(*serializer.columns(Model)).
+    """
+
+    def __init__(self, schema: Type[BaseModel]) -> None:
+        self.schema = schema
+        self.fields: Tuple[str, ...] = tuple(schema.model_fields)
+        self._convert = tuple(
+            (position, name, converter)
+            for position, (name, field) in enumerate(schema.model_fields.items())
+            for converter in (_converter(field.annotation),)
+            if converter is not None
+        )
+        self._getter = attrgetter(*self.fields)
+
+    def columns(self, model: Any) -> List[Any]:
+        """Return the model's columns for a projection query, in field order."""
+        return [getattr(model, name) for name in self.fields]
+
+    def __call__(self, row: Sequence[Any]) -> Dict[str, Any]:
+        item = dict(zip(self.fields, row))
+        for position, name, converter in self._convert:
+            value = row[position]
+            if value is not None:
+                item[name] = converter(value)
+        return item
+
+    def from_object(self, obj: Any) -> Dict[str, Any]:
+        """Serialize an object exposing the schema's fields as attributes."""
+        values = self._getter(obj)
+        return self(values if len(self.fields) > 1 else (values,))
+
+
+def page_response(rows: Sequence[Any], limit: int, serialize: Callable[[Any], Dict[str, Any]]) -> UJSONResponse:
+    """Build a keyset page from up to limit + 1 rows and encode it with ujson."""
+    page = make_page(rows, limit)
+    page["items"] = [serialize(row) for row in page["items"]]
+    return UJSONResponse(page)
@@ -0,0 +1,57 @@
+"""
+Bounded worker pools for CPU-heavy work kept off the event loop
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from fastapi import HTTPException, status
+
+
+class BoundedExecutor:
+    """Thread pool with admission control.
+
+    At most max_workers calls run at once and at most max_queued more wait
+    for a free worker. Anything beyond that is rejected with a 503, so a
+    burst cannot build an unbounded backlog.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queued: int) -> None:
+        self.name = name
+        self.capacity = max_workers + max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Calls currently running or waiting for a worker."""
+        return self._pending
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on the pool, or raise 503 if the pool is saturated."""
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server busy, please retry",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Released when the call itself finishes, not when its awaiter is
+        # cancelled, as the worker thread keeps running regardless
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future: Optional["Future[Any]"] = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -2,28 +2,31 @@
 NexusSwap Database Configuration
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
-import os
 from ..models.base import Base
-
-load_dotenv()
-
-SQLALCHEMY_DATABASE_URL = os.getenv(
-    "DATABASE_URL",
-    "sqlite:///./nexusswap.db"
+from .engine import (
+    SQLALCHEMY_DATABASE_URL, ASYNC_DRIVERS, async_database_url,
+    build_engine, build_async_engine, pool_stats,
 )
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = build_engine(SQLALCHEMY_DATABASE_URL, name="sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = build_async_engine(SQLALCHEMY_DATABASE_URL, name="async")
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 # Dependency
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# Async dependency
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,250 @@
+"""
+Engine factory: pool tuning, per-backend connection setup and pool metrics
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.engine.url import URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    "sqlite:///./nexusswap.db"
+)
+
+# Pool configuration
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# SQLite configuration
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# PostgreSQL configuration
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "30000"))
+PG_APPLICATION_NAME = os.getenv("PG_APPLICATION_NAME", "nexusswap")
+
+# Async drivers used when DATABASE_URL names a sync one
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_database_url(url: str) -> str:
+    """Map a database URL onto the async driver for the same backend."""
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername])
+    return parsed.render_as_string(hide_password=False)
+
+
+class PoolMetrics:
+    """Connections in use and checkouts, counted by the pool's checkout and checkin
+    events so the two always agree, plus how long checkouts waited."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.checkouts = 0
+        self.saturated_checkouts = 0  # Checkouts that found every connection in use
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def checkout(self, *args: Any) -> None:
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def checkin(self, *args: Any) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+    def observe(self, waited: float, saturated: bool, timed_out: bool) -> None:
+        with self._lock:
+            self.saturated_checkouts += saturated
+            self.timeouts += timed_out
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return every total as of one moment."""
+        with self._lock:
+            return {
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "saturated_checkouts": self.saturated_checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+
+
+class _InstrumentedPool:
+    """Times every checkout; metrics survive the pool being recreated on dispose.
+
+    Checkouts and checkins are counted by the events track_pool() listens
+    for on the engine, which carry over to a recreated pool as well.
+    """
+
+    def __init__(self, *args: Any, metrics: Optional[PoolMetrics] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics or PoolMetrics()
+
+    def recreate(self) -> Any:
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self) -> Any:
+        saturated = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.metrics.observe(time.perf_counter() - started, saturated, timed_out)
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+# Engines whose pools are reported by pool_stats(), by name
+_engines: Dict[str, Engine] = {}
+
+
+def track_pool(engine: Engine) -> None:
+    """Count checkouts and checkins of an instrumented pool from the pool's own events."""
+    metrics = getattr(engine.pool, "metrics", None)
+    if metrics is not None:
+        event.listen(engine, "checkout", metrics.checkout)
+        event.listen(engine, "checkin", metrics.checkin)
+
+
+def _is_memory_sqlite(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_options(url: URL, pool_class: Any) -> Dict[str, Any]:
+    backend = url.get_backend_name()
+    options: Dict[str, Any] = {"connect_args": {}}
+    if _is_memory_sqlite(url):
+        # Every connection would be a separate empty database; keep the default single-connection pool
+        return options
+    options.update(
+        poolclass=pool_class,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    if backend == "sqlite":
+        options["connect_args"]["check_same_thread"] = False
+    else:
+        options.update(pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING)
+    if backend == "postgresql":
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"]["server_settings"] = {
+                "application_name": PG_APPLICATION_NAME,
+                "statement_timeout": str(PG_STATEMENT_TIMEOUT_MS),
+            }
+        else:
+            options["connect_args"]["application_name"] = PG_APPLICATION_NAME
+            options["connect_args"]["options"] = f"-c statement_timeout={PG_STATEMENT_TIMEOUT_MS}"
+    return options
+
+
+def _configure_sqlite(engine: Engine, url: URL) -> None:
+    """Apply the SQLite pragmas on every new connection."""
+    pragmas = [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+    ]
+    if not _is_memory_sqlite(url):
+        # WAL lets readers proceed while a writer commits; it needs a file
+        pragmas.insert(0, f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        pragmas.append(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def build_engine(url: str, name: Optional[str] = None, **kwargs: Any) -> Engine:
+    """Create a sync engine tuned for the backend named by url.
+
+    Keyword arguments override the computed create_engine options. When
+    name is given, the engine's pool is reported by pool_stats().
+    """
+    parsed = make_url(url)
+    options = _engine_options(parsed, InstrumentedQueuePool)
+    options.update(kwargs)
+    engine = create_engine(parsed, **options)
+    if parsed.get_backend_name() == "sqlite":
+        _configure_sqlite(engine, parsed)
+    track_pool(engine)
+    if name is not None:
+        _engines[name] = engine
+    return engine
+
+
+def build_async_engine(url: str, name: Optional[str] = None, **kwargs: Any) -> AsyncEngine:
+    """Create an async engine for url, switching to the backend's async driver."""
+    parsed = make_url(async_database_url(url))
+    options = _engine_options(parsed, InstrumentedAsyncQueuePool)
+    options.update(kwargs)
+    engine = create_async_engine(parsed, **options)
+    if parsed.get_backend_name() == "sqlite":
+        _configure_sqlite(engine.sync_engine, parsed)
+    track_pool(engine.sync_engine)
+    if name is not None:
+        _engines[name] = engine.sync_engine
+    return engine
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Return current usage and checkout wait totals for each named engine's pool."""
+    stats = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        entry: Dict[str, Any] = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                max_overflow=pool._max_overflow,
+                checked_out=pool.checkedout(),
+                idle=pool.checkedin(),
+            )
+        metrics = getattr(pool, "metrics", None)
+        if metrics is not None:
+            # In use and checkouts come from the same events, so they are never out of step
+            entry.update(metrics.snapshot())
+        stats[name] = entry
+    return stats
@@ -0,0 +1,47 @@
+"""
+Alembic migrations applied at startup
+"""
+
+import os
+from pathlib import Path
+from typing import Optional
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Migration configuration
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+
+def alembic_config(connection: Optional[Connection] = None) -> Config:
+    """Return the project's Alembic config, optionally bound to an open connection."""
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "migrations"))
+    config.attributes["configure_logger"] = False
+    if connection is not None:
+        config.attributes["connection"] = connection
+    return config
+
+
+def legacy_revision(connection: Connection) -> Optional[str]:
+    """Return the revision matching a database built by create_all, or None if it is not one."""
+    tables = set(inspect(connection).get_table_names())
+    if "alembic_version" in tables or "users" not in tables:
+        return None
+    return "0002" if "ledger_postings" in tables else "0001"
+
+
+def run_migrations(engine: Engine) -> None:
+    """Upgrade the schema to head, adopting databases created before migrations existed."""
+    with engine.begin() as connection:
+        config = alembic_config(connection)
+        revision = legacy_revision(connection)
+        if revision is not None:
+            command.stamp(config, revision)
+        command.upgrade(config, "head")
@@ -4,19 +4,25 @@ NexusSwap API
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqladmin import Admin
-from .database import engine, Base, SessionLocal
-from .routers import users, offers, trades, wallets
+from .database import engine, async_engine, SessionLocal, pool_stats
+from .routers import users, offers, trades, wallets, market
 from .database.init_db import init_db
+from .database.migrate import MIGRATE_ON_STARTUP, run_migrations
 from .admin.config import ADMIN_VIEWS
+from .core.order_book import order_book
+from .core.book_feed import book_feed
+from .core.book_sync import book_sync
+from .core.backends import backend
+from .core.expiry import EXPIRY_ENABLED, expiry_sweeper
+from .core.security import password_pool
+from .core import metrics, profiler, market_data, response_cache
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="NexusSwap API",
     description="API for NexusSwap - A P2P Cryptocurrency Exchange Platform",
@@ -32,11 +38,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record per-route latency, status codes and SQL work for /metrics
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(engine)
+    metrics.instrument_engine(async_engine.sync_engine)
+    metrics.registry.add_collector(metrics.pool_collector(pool_stats))
+
+# Debug profiling of SQL and CPU per request; off unless configured
+if profiler.PROFILER_ENABLED or profiler.PROFILER_HEADER_ENABLED:
+    app.add_middleware(profiler.ProfilerMiddleware)
+    profiler.instrument_engine(engine)
+    profiler.instrument_engine(async_engine.sync_engine)
+
 # Include routers
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(offers.router, prefix="/api/offers", tags=["offers"])
 app.include_router(trades.router, prefix="/api/trades", tags=["trades"])
 app.include_router(wallets.router, prefix="/api/wallets", tags=["wallets"])
+app.include_router(market.router, prefix="/api/market", tags=["market"])
+
+# Keep market candles current as trades complete
+market_data.track_trade_completions()
+# Drop cached offer and user responses when their rows are written
+response_cache.track_writes()
 
 # Configure admin panel
 admin = Admin(app, engine)
@@ -46,12 +71,39 @@ for view in ADMIN_VIEWS:
 @app.on_event("startup")
 async def startup_event():
     """Initialize the application."""
+    # Bring the schema up to date; disable when migrations run as a deploy step
+    if MIGRATE_ON_STARTUP:
+        run_migrations(engine)
+    # Listen to the other workers before loading state, so no change made meanwhile is missed
+    await backend.start()
     # Initialize database with admin user
     db = SessionLocal()
     try:
         init_db(db)
+        # Load active offers into the in-memory order book
+        order_book.load(db)
+        market_data.last_prices.load(db)
     finally:
         db.close()
+    # Start pushing order book deltas to WebSocket subscribers
+    book_feed.start()
+    # Apply offers changed by the other workers to this worker's order book
+    book_sync.start()
+    # Periodically cancel abandoned trades and retire stale offers
+    if EXPIRY_ENABLED:
+        expiry_sweeper.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release background resources."""
+    await book_feed.stop()
+    await book_sync.stop()
+    await expiry_sweeper.stop()
+    await backend.close()
+    password_pool.shutdown()
+    # Pooled aiosqlite connections each own a worker thread that would block exit
+    await async_engine.dispose()
+    engine.dispose()
 
 @app.get("/")
 async def root():
@@ -65,4 +117,11 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"} 
\ No newline at end of file
+    return {"status": "healthy", "database_pools": pool_stats()} 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    if not metrics.METRICS_ENABLED:
+        return PlainTextResponse("metrics are disabled\n", status_code=404)
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
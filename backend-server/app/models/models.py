@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Float, ForeignKey, Enum, Boolean, Text, Integer, DateTime
+from sqlalchemy import Column, String, Float, ForeignKey, Enum, Boolean, Text, Integer, BigInteger, DateTime, UniqueConstraint, Index
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 import enum
 from .base import Base
@@ -34,19 +35,33 @@ class User(BaseModel):
 
 class Wallet(BaseModel):
     __tablename__ = "wallets"
+    __table_args__ = (
+        Index("ix_wallets_user_currency", "user_id", "currency"),
+        # Keyset pages of a user's wallets
+        Index("ix_wallets_user_created", "user_id", "created_at", "id"),
+    )
     
     user_id = Column(Integer, ForeignKey("users.id"))
     currency = Column(String)  # e.g., "BTC", "ETH"
-    balance = Column(Float, default=0.0)
+    balance = Column(Float, default=0.0)  # Display copy of balance_minor, written by the ledger
+    balance_minor = Column(BigInteger, default=0, nullable=False)  # Authoritative balance in minor units
+    posting_sequence = Column(Integer, default=0, nullable=False)  # Sequence of the latest ledger posting
     wallet_address = Column(String, unique=True)
     is_escrow = Column(Boolean, default=False)
     
     # Relationships
     user = relationship("User", back_populates="wallets")
     transactions = relationship("Transaction", back_populates="wallet")
+    postings = relationship("LedgerPosting", back_populates="wallet")
 
 class Offer(BaseModel):
     __tablename__ = "offers"
+    __table_args__ = (
+        Index("ix_offers_active_currency_price", "is_active", "currency", "price_per_unit"),
+        Index("ix_offers_seller_id", "seller_id"),
+        # The expiry sweeper finds active offers by last update
+        Index("ix_offers_active_updated", "is_active", "updated_at"),
+    )
     
     seller_id = Column(Integer, ForeignKey("users.id"))
     currency = Column(String)  # e.g., "BTC", "ETH"
@@ -54,10 +69,14 @@ class Offer(BaseModel):
     max_amount = Column(Float)
     price_per_unit = Column(Float)
     is_active = Column(Boolean, default=True)
+    is_exhausted = Column(Boolean, default=False, nullable=False)  # Deactivated by trades taking its amount
+    version = Column(Integer, default=1, nullable=False)  # Bumped by every write; updates compare-and-swap on it
     
     # Relationships
     seller = relationship("User", back_populates="offers")
     trades = relationship("Trade", back_populates="offer")
+    
+    __mapper_args__ = {"version_id_col": version}
 
 class TradeStatus(str, enum.Enum):
     PENDING = "pending"
@@ -69,6 +88,16 @@ class TradeStatus(str, enum.Enum):
 
 class Trade(BaseModel):
     __tablename__ = "trades"
+    __table_args__ = (
+        # Keyset pages of a user's trades, one index per side of the buyer/seller OR
+        Index("ix_trades_buyer_created", "buyer_id", "created_at", "id"),
+        Index("ix_trades_seller_created", "seller_id", "created_at", "id"),
+        Index("ix_trades_offer_id", "offer_id"),
+        # Candle rebuilds walk completed trades in completion order
+        Index("ix_trades_status_completed", "status", "completed_at", "id"),
+        # The expiry sweeper finds open trades by status and last update
+        Index("ix_trades_status_updated", "status", "updated_at"),
+    )
     
     trade_id = Column(String, unique=True, index=True)
     offer_id = Column(Integer, ForeignKey("offers.id"))
@@ -79,6 +108,8 @@ class Trade(BaseModel):
     total_price = Column(Float)
     status = Column(Enum(TradeStatus), default=TradeStatus.PENDING)
     moderator_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    completed_at = Column(DateTime, nullable=True)  # Set when status becomes COMPLETED
+    version = Column(Integer, default=1, nullable=False)  # Bumped by every write; updates compare-and-swap on it
     
     # Relationships
     offer = relationship("Offer", back_populates="trades")
@@ -86,9 +117,16 @@ class Trade(BaseModel):
     seller = relationship("User", foreign_keys=[seller_id], back_populates="trades_as_seller")
     moderator = relationship("User", foreign_keys=[moderator_id])
     messages = relationship("TradeMessage", back_populates="trade")
+    
+    __mapper_args__ = {"version_id_col": version}
 
 class TradeMessage(BaseModel):
     __tablename__ = "trade_messages"
+    __table_args__ = (
+        Index("ix_trade_messages_trade_created", "trade_id", "created_at", "id"),
+        # Chat replay after a message id, and the latest messages per trade
+        Index("ix_trade_messages_trade_id", "trade_id", "id"),
+    )
     
     trade_id = Column(Integer, ForeignKey("trades.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
@@ -100,6 +138,7 @@ class TradeMessage(BaseModel):
 
 class Transaction(BaseModel):
     __tablename__ = "transactions"
+    __table_args__ = (Index("ix_transactions_wallet_created", "wallet_id", "created_at", "id"),)
     
     wallet_id = Column(Integer, ForeignKey("wallets.id"))
     amount = Column(Float)
@@ -108,4 +147,54 @@ class Transaction(BaseModel):
     reference_id = Column(String, unique=True)
     
     # Relationships
-    wallet = relationship("Wallet", back_populates="transactions") 
\ No newline at end of file
+    wallet = relationship("Wallet", back_populates="transactions") 
+
+# Append-only: postings are never updated or deleted
+class LedgerPosting(Base):
+    __tablename__ = "ledger_postings"
+    __table_args__ = (UniqueConstraint("wallet_id", "sequence"),)
+    
+    id = Column(Integer, primary_key=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=True)
+    sequence = Column(Integer, nullable=False)  # Per-wallet, gap-free
+    amount_minor = Column(BigInteger, nullable=False)  # Signed delta in minor units
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Relationships
+    wallet = relationship("Wallet", back_populates="postings")
+    transaction = relationship("Transaction")
+
+# Balance as of a posting sequence, so history lookups don't replay every posting
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+    __table_args__ = (UniqueConstraint("wallet_id", "sequence"),)
+    
+    id = Column(Integer, primary_key=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)
+    balance_minor = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# Precomputed OHLCV per currency and interval, maintained by app.core.market_data
+class MarketCandle(Base):
+    __tablename__ = "market_candles"
+    __table_args__ = (UniqueConstraint("currency", "interval", "bucket_start"),)
+    
+    id = Column(Integer, primary_key=True)
+    currency = Column(String, nullable=False)
+    interval = Column(String, nullable=False)  # "1m", "1h" or "1d"
+    bucket_start = Column(DateTime, nullable=False)
+    open = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=False)
+    volume = Column(Float, nullable=False)  # Units of the currency traded
+    quote_volume = Column(Float, nullable=False)  # Sum of total_price, for VWAP
+    trade_count = Column(Integer, nullable=False)
+    first_trade_at = Column(DateTime, nullable=False)  # Completion time of the trade that set open
+    last_trade_at = Column(DateTime, nullable=False)  # Completion time of the trade that set close
+    
+    @hybrid_property
+    def vwap(self):
+        return self.quote_volume / self.volume
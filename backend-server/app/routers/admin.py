@@ -39,6 +39,7 @@ def block_user(
     
     user.is_blocked = True
     db.commit()
+    security.invalidate_principal(user.email)
     return {"message": "User blocked successfully"}
 
 @router.post("/users/{user_id}/unblock")
@@ -59,4 +60,5 @@ def unblock_user(
     
     user.is_blocked = False
     db.commit()
+    security.invalidate_principal(user.email)
     return {"message": "User unblocked successfully"} 
\ No newline at end of file
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import Response, UJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime, timedelta
+from ..database import get_async_db
+from ..models import models
+from ..schemas import market_schemas
+from ..core.pagination import page_size
+from ..core.serialization import RowSerializer
+from ..core.depth import DEPTH_DEFAULT_LEVELS, DEPTH_MAX_LEVELS, market_depth
+from ..core.market_data import last_prices
+
+router = APIRouter()
+
+candle_rows = RowSerializer(market_schemas.Candle)
+
+@router.get("/candles", response_model=List[market_schemas.Candle])
+async def get_candles(
+    currency: str,
+    interval: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    limit = page_size(limit)
+    query = select(*candle_rows.columns(models.MarketCandle)).where(
+        models.MarketCandle.currency == currency,
+        models.MarketCandle.interval == interval
+    )
+    if end is not None:
+        query = query.where(models.MarketCandle.bucket_start < end)
+    if start is not None:
+        # A range reads forward from start
+        query = query.where(models.MarketCandle.bucket_start >= start).order_by(models.MarketCandle.bucket_start)
+        rows = (await db.execute(query.limit(limit))).all()
+    else:
+        # Otherwise the most recent candles, still returned oldest first
+        query = query.order_by(models.MarketCandle.bucket_start.desc())
+        rows = (await db.execute(query.limit(limit))).all()[::-1]
+    return UJSONResponse([candle_rows(row) for row in rows])
+
+@router.get("/stats", response_model=market_schemas.MarketStats)
+async def get_market_stats(
+    currency: str,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Rolling 24 hours from hourly candles; the latest price is kept in memory by market_data
+    now = datetime.utcnow()
+    window_start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=23)
+    candles = (await db.execute(
+        select(models.MarketCandle)
+        .where(
+            models.MarketCandle.currency == currency,
+            models.MarketCandle.interval == "1h",
+            models.MarketCandle.bucket_start >= window_start
+        )
+        .order_by(models.MarketCandle.bucket_start)
+    )).scalars().all()
+    last_price = last_prices.get(currency)
+    if last_price is None:
+        # Not traded since startup seeded the prices; the last minute candle is the only other source
+        last_price = (await db.execute(
+            select(models.MarketCandle.close)
+            .where(models.MarketCandle.currency == currency, models.MarketCandle.interval == "1m")
+            .order_by(models.MarketCandle.bucket_start.desc())
+            .limit(1)
+        )).scalar_one_or_none()
+
+    stats = market_schemas.MarketStats(currency=currency, window_start=window_start, last_price=last_price)
+    if candles:
+        stats.open = candles[0].open
+        stats.high = max(candle.high for candle in candles)
+        stats.low = min(candle.low for candle in candles)
+        stats.volume = sum(candle.volume for candle in candles)
+        stats.quote_volume = sum(candle.quote_volume for candle in candles)
+        stats.trade_count = sum(candle.trade_count for candle in candles)
+        stats.vwap = stats.quote_volume / stats.volume if stats.volume else None
+        if last_price is not None and stats.open:
+            stats.change_percent = (last_price - stats.open) / stats.open * 100
+    return stats
+
+@router.get("/depth", response_model=market_schemas.MarketDepth)
+async def get_market_depth(
+    currency: str,
+    step: Optional[float] = Query(None, gt=0),
+    levels: int = Query(DEPTH_DEFAULT_LEVELS, ge=1, le=DEPTH_MAX_LEVELS)
+):
+    # Served from array snapshots of the in-memory order book, cached until the book changes
+    return Response(market_depth.depth(currency, step, levels), media_type="application/json")
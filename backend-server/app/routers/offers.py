@@ -1,17 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Query, Request, Response, WebSocket, WebSocketDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from ..database import get_db
+from ..database import get_async_db
 from ..models import models
 from ..schemas import offer_schemas
+from ..schemas.pagination_schemas import Page
 from ..core import security
+from ..core.concurrency import check_if_match, commit_or_conflict, etag, set_etag
+from ..core.order_book import order_book
+from ..core.book_feed import book_feed, channel
+from ..core.realtime import pump
+from ..core.pagination import decode_cursor, make_page, page_size
+from ..core.response_cache import offer_tag, offers_tag, response_cache
+from ..core.serialization import RowSerializer
+from fastapi.responses import UJSONResponse
 
 router = APIRouter()
 
+offer_rows = RowSerializer(offer_schemas.Offer)
+
 @router.post("/", response_model=offer_schemas.Offer)
-def create_offer(
+async def create_offer(
     offer: offer_schemas.OfferCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     db_offer = models.Offer(
@@ -19,75 +30,111 @@ def create_offer(
         seller_id=current_user.id
     )
     db.add(db_offer)
-    db.commit()
-    db.refresh(db_offer)
+    await db.commit()
+    await db.refresh(db_offer)
+    order_book.upsert(db_offer)
     return db_offer
 
-@router.get("/", response_model=List[offer_schemas.Offer])
-def get_offers(
+@router.get("/", response_model=Page[offer_schemas.Offer])
+async def get_offers(
+    request: Request,
     currency: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     min_amount: Optional[float] = None,
     max_amount: Optional[float] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1)
 ):
-    query = db.query(models.Offer).filter(models.Offer.is_active == True)
+    async def handle() -> Response:
+        # Served from the in-memory order book rather than scanning the offers table
+        size = page_size(limit)
+        offers = order_book.search(
+            currency=currency,
+            min_price=min_price or None,
+            max_price=max_price or None,
+            min_amount=min_amount or None,
+            max_amount=max_amount or None,
+            after=decode_cursor(cursor) if cursor else None,
+            limit=size + 1,
+        )
+        page = make_page(offers, size)
+        page["items"] = [offer_rows.from_object(entry) for entry in page["items"]]
+        return UJSONResponse(page)
+    
+    # Any change in the book invalidates these pages, through the book listener
+    return await response_cache.serve(request, [offers_tag(currency or None)], handle)
+
+@router.websocket("/ws/{currency}")
+async def stream_offers(websocket: WebSocket, currency: str):
+    await websocket.accept()
+    # Subscribe before the snapshot so no delta after it is missed
+    subscription = book_feed.hub.subscribe(channel(currency))
     
-    if currency:
-        query = query.filter(models.Offer.currency == currency)
-    if min_price:
-        query = query.filter(models.Offer.price_per_unit >= min_price)
-    if max_price:
-        query = query.filter(models.Offer.price_per_unit <= max_price)
-    if min_amount:
-        query = query.filter(models.Offer.min_amount >= min_amount)
-    if max_amount:
-        query = query.filter(models.Offer.max_amount <= max_amount)
+    async def resync():
+        await websocket.send_json(book_feed.snapshot(currency))
     
-    return query.all()
+    try:
+        await resync()
+        await pump(websocket, subscription, lambda frame: frame, resync=resync)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        book_feed.hub.unsubscribe(subscription)
 
 @router.get("/{offer_id}", response_model=offer_schemas.Offer)
-def get_offer(offer_id: int, db: Session = Depends(get_db)):
-    offer = db.query(models.Offer).filter(models.Offer.id == offer_id).first()
-    if not offer:
-        raise HTTPException(status_code=404, detail="Offer not found")
-    return offer
+async def get_offer(offer_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def handle() -> Response:
+        offer = await db.get(models.Offer, offer_id)
+        if not offer:
+            raise HTTPException(status_code=404, detail="Offer not found")
+        return UJSONResponse(offer_rows.from_object(offer), headers={"ETag": etag(offer.version)})
+    
+    return await response_cache.serve(request, [offer_tag(offer_id)], handle)
 
 @router.put("/{offer_id}", response_model=offer_schemas.Offer)
-def update_offer(
+async def update_offer(
     offer_id: int,
     offer_update: offer_schemas.OfferUpdate,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    db_offer = db.query(models.Offer).filter(models.Offer.id == offer_id).first()
+    db_offer = await db.get(models.Offer, offer_id)
     if not db_offer:
         raise HTTPException(status_code=404, detail="Offer not found")
     
     if db_offer.seller_id != current_user.id and current_user.role != models.UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Not enough permissions")
+    check_if_match(if_match, db_offer.version, "Offer")
     
     for field, value in offer_update.dict(exclude_unset=True).items():
         setattr(db_offer, field, value)
     
-    db.commit()
-    db.refresh(db_offer)
+    # The UPDATE only applies if the row is still at the version read above
+    await commit_or_conflict(db, "Offer")
+    await db.refresh(db_offer)
+    order_book.upsert(db_offer)
+    set_etag(response, db_offer.version)
     return db_offer
 
 @router.delete("/{offer_id}")
-def delete_offer(
+async def delete_offer(
     offer_id: int,
-    db: Session = Depends(get_db),
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    db_offer = db.query(models.Offer).filter(models.Offer.id == offer_id).first()
+    db_offer = await db.get(models.Offer, offer_id)
     if not db_offer:
         raise HTTPException(status_code=404, detail="Offer not found")
     
     if db_offer.seller_id != current_user.id and current_user.role != models.UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Not enough permissions")
+    check_if_match(if_match, db_offer.version, "Offer")
     
-    db.delete(db_offer)
-    db.commit()
-    return {"message": "Offer deleted successfully"} 
\ No newline at end of file
+    await db.delete(db_offer)
+    await commit_or_conflict(db, "Offer")
+    order_book.remove(offer_id)
+    return {"message": "Offer deleted successfully"}
@@ -1,83 +1,217 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import UJSONResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
 import uuid
-from ..database import get_db
+from collections import defaultdict
+from ..database import get_async_db, AsyncSessionLocal
 from ..models import models
 from ..schemas import trade_schemas
+from ..schemas.pagination_schemas import Page
 from ..core import security
+from ..core.concurrency import check_if_match, commit_or_conflict, etag, set_etag
+from ..core.idempotency import fingerprint, idempotency_store
+from ..core.matching import matching_engine, release, reserve
+from ..core.order_book import order_book
+from ..core.pagination import SUMMARY_MESSAGES, keyset, keyset_union, make_page, page_size
+from ..core.realtime import chat_hub, pump
+from ..core.serialization import RowSerializer, page_response
 
 router = APIRouter()
 
+trade_rows = RowSerializer(trade_schemas.TradeInfo)
+message_rows = RowSerializer(trade_schemas.TradeMessage)
+
 @router.post("/", response_model=trade_schemas.Trade)
-def create_trade(
+async def create_trade(
     trade: trade_schemas.TradeCreate,
-    db: Session = Depends(get_db),
+    if_match: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    async def handle() -> Response:
+        # Get the offer
+        offer = await db.get(models.Offer, trade.offer_id)
+        if not offer:
+            raise HTTPException(status_code=404, detail="Offer not found")
+        if not offer.is_active:
+            raise HTTPException(status_code=400, detail="Offer is not active")
+        # If-Match here names the offer version the buyer saw, so a repriced offer is refused
+        check_if_match(if_match, offer.version, "Offer")
+        
+        # Validate amount
+        if trade.amount < offer.min_amount or trade.amount > offer.max_amount:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Amount must be between {offer.min_amount} and {offer.max_amount}"
+            )
+        
+        # Create trade; a new trade has no messages, so the collection starts loaded
+        db_trade = models.Trade(
+            trade_id=str(uuid.uuid4()),
+            offer_id=trade.offer_id,
+            buyer_id=current_user.id,
+            seller_id=offer.seller_id,
+            amount=trade.amount,
+            price_per_unit=offer.price_per_unit,
+            total_price=trade.amount * offer.price_per_unit,
+            status=models.TradeStatus.PENDING,
+            messages=[]
+        )
+        db.add(db_trade)
+        # The amount is reserved from the offer, as a market fill takes it, until the trade is cancelled
+        reserved = await reserve(db, offer, trade.amount)
+        if reserved is None:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Offer was changed by another request, reload and retry"
+            )
+        await db.commit()
+        order_book.upsert(reserved)
+        return UJSONResponse(
+            trade_schemas.Trade.model_validate(db_trade).model_dump(mode="json"),
+            headers={"ETag": etag(db_trade.version)}
+        )
+    
+    # A retried request with the same Idempotency-Key gets the first response instead of a second trade
+    return await idempotency_store.run(
+        (current_user.id, "create_trade"), idempotency_key, fingerprint(trade, if_match), handle
+    )
+
+@router.post("/market", response_model=trade_schemas.MarketOrderResult)
+async def create_market_order(
+    order: trade_schemas.MarketOrderCreate,
+    idempotency_key: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    # Get the offer
-    offer = db.query(models.Offer).filter(models.Offer.id == trade.offer_id).first()
-    if not offer:
-        raise HTTPException(status_code=404, detail="Offer not found")
-    if not offer.is_active:
-        raise HTTPException(status_code=400, detail="Offer is not active")
-    
-    # Validate amount
-    if trade.amount < offer.min_amount or trade.amount > offer.max_amount:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Amount must be between {offer.min_amount} and {offer.max_amount}"
+    if order.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    
+    async def handle() -> Response:
+        trades, filled, remaining = await matching_engine.execute(
+            db,
+            buyer_id=current_user.id,
+            currency=order.currency,
+            amount=order.amount,
+            max_price=order.max_price
         )
+        return UJSONResponse(trade_schemas.MarketOrderResult.model_validate({
+            "trades": trades,
+            "filled_amount": filled,
+            "remaining_amount": remaining
+        }, from_attributes=True).model_dump(mode="json"))
     
-    # Create trade
-    db_trade = models.Trade(
-        trade_id=str(uuid.uuid4()),
-        offer_id=trade.offer_id,
-        buyer_id=current_user.id,
-        seller_id=offer.seller_id,
-        amount=trade.amount,
-        price_per_unit=offer.price_per_unit,
-        total_price=trade.amount * offer.price_per_unit,
-        status=models.TradeStatus.PENDING
+    return await idempotency_store.run(
+        (current_user.id, "create_market_order"), idempotency_key, fingerprint(order), handle
     )
-    db.add(db_trade)
-    db.commit()
-    db.refresh(db_trade)
-    return db_trade
 
-@router.get("/", response_model=List[trade_schemas.Trade])
-def get_trades(
-    db: Session = Depends(get_db),
+@router.get("/", response_model=Page[trade_schemas.TradeSummary])
+async def get_trades(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    include: Optional[str] = Query(None, pattern="^messages$"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    return db.query(models.Trade).filter(
-        (models.Trade.buyer_id == current_user.id) |
-        (models.Trade.seller_id == current_user.id)
-    ).all()
+    limit = page_size(limit)
+    # One branch per side, each walking its own (user, created_at, id) index
+    columns = trade_rows.columns(models.Trade)
+    query = keyset_union([
+        select(*columns).where(models.Trade.buyer_id == current_user.id),
+        select(*columns).where(
+            models.Trade.seller_id == current_user.id, models.Trade.buyer_id != current_user.id
+        ),
+    ], models.Trade, cursor, limit)
+    page = make_page((await db.execute(query)).all(), limit)
+    trade_ids = [row.id for row in page["items"]]
+    
+    # Summaries come from batched queries over the page, never one per trade
+    counts, last_messages, messages = {}, {}, defaultdict(list)
+    if trade_ids:
+        counts = dict((await db.execute(
+            select(models.TradeMessage.trade_id, func.count(models.TradeMessage.id))
+            .where(models.TradeMessage.trade_id.in_(trade_ids))
+            .group_by(models.TradeMessage.trade_id)
+        )).all())
+    if include == "messages" and trade_ids:
+        # Only each trade's latest messages; the full history is paged from /{trade_id}/messages
+        recent = select(
+            *message_rows.columns(models.TradeMessage),
+            func.row_number().over(
+                partition_by=models.TradeMessage.trade_id, order_by=models.TradeMessage.id.desc()
+            ).label("position"),
+        ).where(models.TradeMessage.trade_id.in_(trade_ids)).subquery()
+        for row in (await db.execute(
+            select(*[recent.c[name] for name in message_rows.fields])
+            .where(recent.c.position <= SUMMARY_MESSAGES)
+            .order_by(recent.c.id)
+        )).all():
+            messages[row.trade_id].append(message_rows(row))
+        last_messages = {trade_id: items[-1] for trade_id, items in messages.items()}
+    elif trade_ids:
+        latest_ids = (
+            select(func.max(models.TradeMessage.id))
+            .where(models.TradeMessage.trade_id.in_(trade_ids))
+            .group_by(models.TradeMessage.trade_id)
+        )
+        last_messages = {
+            row.trade_id: message_rows(row)
+            for row in (await db.execute(
+                select(*message_rows.columns(models.TradeMessage))
+                .where(models.TradeMessage.id.in_(latest_ids))
+            )).all()
+        }
+    
+    items = []
+    for row in page["items"]:
+        item = trade_rows(row)
+        item["message_count"] = counts.get(row.id, 0)
+        item["last_message"] = last_messages.get(row.id)
+        item["messages"] = messages.get(row.id, []) if include == "messages" else None
+        items.append(item)
+    page["items"] = items
+    return UJSONResponse(page)
 
 @router.get("/{trade_id}", response_model=trade_schemas.Trade)
-def get_trade(
+async def get_trade(
     trade_id: str,
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    trade = db.query(models.Trade).filter(models.Trade.trade_id == trade_id).first()
+    trade = (await db.execute(
+        select(models.Trade)
+        .options(selectinload(models.Trade.messages))
+        .where(models.Trade.trade_id == trade_id)
+    )).scalar_one_or_none()
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
     
     if trade.buyer_id != current_user.id and trade.seller_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view this trade")
     
+    set_etag(response, trade.version)
     return trade
 
 @router.put("/{trade_id}", response_model=trade_schemas.Trade)
-def update_trade(
+async def update_trade(
     trade_id: str,
     trade_update: trade_schemas.TradeUpdate,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    trade = db.query(models.Trade).filter(models.Trade.trade_id == trade_id).first()
+    trade = (await db.execute(
+        select(models.Trade)
+        .options(selectinload(models.Trade.messages))
+        .where(models.Trade.trade_id == trade_id)
+    )).scalar_one_or_none()
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
     
@@ -86,22 +220,37 @@ def update_trade(
         trade.seller_id != current_user.id and 
         current_user.role != models.UserRole.ADMIN):
         raise HTTPException(status_code=403, detail="Not authorized to update this trade")
+    check_if_match(if_match, trade.version, "Trade")
     
-    for field, value in trade_update.dict(exclude_unset=True).items():
+    changes = trade_update.dict(exclude_unset=True)
+    cancelling = changes.get("status") == models.TradeStatus.CANCELLED
+    if trade.status == models.TradeStatus.CANCELLED and "status" in changes and not cancelling:
+        # Its amount was given back to the offer and may have been taken since
+        raise HTTPException(status_code=400, detail="A cancelled trade cannot be reopened")
+    released = []
+    if cancelling and trade.status != models.TradeStatus.CANCELLED:
+        released = await release(db, [(trade.offer_id, trade.amount)])
+    
+    for field, value in changes.items():
         setattr(trade, field, value)
     
-    db.commit()
-    db.refresh(trade)
+    # The UPDATE only applies if the row is still at the version read above
+    await commit_or_conflict(db, "Trade")
+    for offer in released:
+        order_book.upsert(offer)
+    set_etag(response, trade.version)
     return trade
 
 @router.post("/{trade_id}/messages", response_model=trade_schemas.TradeMessage)
-def create_trade_message(
+async def create_trade_message(
     trade_id: str,
     message: trade_schemas.TradeMessageCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    trade = db.query(models.Trade).filter(models.Trade.trade_id == trade_id).first()
+    trade = (await db.execute(
+        select(models.Trade).where(models.Trade.trade_id == trade_id)
+    )).scalar_one_or_none()
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
     
@@ -114,21 +263,96 @@ def create_trade_message(
         content=message.content
     )
     db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
+    await db.commit()
+    await db.refresh(db_message)
+    
+    # Push to the buyer's and seller's open chat connections
+    chat_hub.publish(
+        f"trade:{trade.id}",
+        trade_schemas.TradeMessage.model_validate(db_message).model_dump(mode="json")
+    )
     return db_message
 
-@router.get("/{trade_id}/messages", response_model=List[trade_schemas.TradeMessage])
-def get_trade_messages(
+@router.get("/{trade_id}/messages", response_model=Page[trade_schemas.TradeMessage])
+async def get_trade_messages(
     trade_id: str,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    trade = db.query(models.Trade).filter(models.Trade.trade_id == trade_id).first()
+    trade = (await db.execute(
+        select(models.Trade).where(models.Trade.trade_id == trade_id)
+    )).scalar_one_or_none()
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
     
     if trade.buyer_id != current_user.id and trade.seller_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view messages in this trade")
     
-    return trade.messages 
\ No newline at end of file
+    limit = page_size(limit)
+    query = select(*message_rows.columns(models.TradeMessage)).where(
+        models.TradeMessage.trade_id == trade.id
+    )
+    rows = (await db.execute(keyset(query, models.TradeMessage, cursor, limit))).all()
+    return page_response(rows, limit, message_rows)
+
+@router.websocket("/{trade_id}/ws")
+async def trade_chat(
+    websocket: WebSocket,
+    trade_id: str,
+    token: Optional[str] = None,
+    last_id: int = 0
+):
+    # Browsers cannot set headers on a WebSocket, so the JWT may also come as ?token=
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials
+    
+    async with AsyncSessionLocal() as db:
+        user = await security.resolve_user(token, db) if token else None
+        trade = (await db.execute(
+            select(models.Trade).where(models.Trade.trade_id == trade_id)
+        )).scalar_one_or_none()
+    if (user is None or not user.is_active or user.is_blocked or trade is None or
+            (trade.buyer_id != user.id and trade.seller_id != user.id)):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    # Subscribe before replaying so nothing posted meanwhile is missed
+    subscription = chat_hub.subscribe(f"trade:{trade.id}")
+    
+    def live_frame(message: dict) -> Optional[dict]:
+        # Messages already replayed may also be queued; skip them
+        if message["id"] <= last_id:
+            return None
+        return {"type": "message", "data": message}
+    
+    # Whatever ends the connection, the subscription must not outlive it
+    try:
+        # Replay what the client missed since last_id, one page at a time
+        limit = page_size(None)
+        async with AsyncSessionLocal() as db:
+            while True:
+                messages = (await db.execute(
+                    select(models.TradeMessage)
+                    .where(models.TradeMessage.trade_id == trade.id, models.TradeMessage.id > last_id)
+                    .order_by(models.TradeMessage.id)
+                    .limit(limit)
+                )).scalars().all()
+                for message in messages:
+                    await websocket.send_json({
+                        "type": "message",
+                        "data": trade_schemas.TradeMessage.model_validate(message).model_dump(mode="json")
+                    })
+                    last_id = message.id
+                if len(messages) < limit:
+                    break
+        
+        await pump(websocket, subscription, live_frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        chat_hub.unsubscribe(subscription)
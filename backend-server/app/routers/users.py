@@ -1,52 +1,85 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi.responses import UJSONResponse
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from ..database import get_db
+from datetime import timedelta
+from ..database import get_async_db
 from ..models import models
 from ..schemas import user_schemas
 from ..core import security
+from ..core.response_cache import response_cache, user_tag
+from ..core.serialization import RowSerializer
 
 router = APIRouter()
 
+user_rows = RowSerializer(user_schemas.User)
+
 @router.post("/", response_model=user_schemas.User)
-def create_user(user: user_schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def create_user(user: user_schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(
+        select(models.User).where(models.User.email == user.email)
+    )).scalar_one_or_none()
     if db_user:
         raise HTTPException(
             status_code=400,
             detail="Email already registered"
         )
     
-    hashed_password = security.get_password_hash(user.password)
+    hashed_password = await security.get_password_hash_async(user.password)
     db_user = models.User(
         email=user.email,
         username=user.username,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
+@router.post("/token", response_model=user_schemas.Token)
+async def login(
+    form: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db)
+):
+    await security.check_login_rate(form.username)
+    user = (await db.execute(
+        select(models.User).where(models.User.email == form.username)
+    )).scalar_one_or_none()
+    # bcrypt runs on the hashing pool so a burst of logins cannot stall the event loop
+    if user is None or not await security.verify_password_async(form.password, user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = security.create_access_token(
+        {"sub": user.email}, timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
 @router.get("/me", response_model=user_schemas.User)
-def read_users_me(
-    current_user: models.User = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
+async def read_users_me(
+    current_user: models.User = Depends(security.get_current_user)
 ):
     return current_user
 
 @router.get("/{user_id}", response_model=user_schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+async def read_user(user_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def handle() -> Response:
+        db_user = await db.get(models.User, user_id)
+        if db_user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return UJSONResponse(user_rows.from_object(db_user))
+    
+    return await response_cache.serve(request, [user_tag(user_id)], handle)
 
 @router.put("/{user_id}", response_model=user_schemas.User)
-def update_user(
+async def update_user(
     user_id: int,
     user: user_schemas.UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
     if current_user.id != user_id and current_user.role != models.UserRole.ADMIN:
@@ -55,13 +88,16 @@ def update_user(
             detail="Not enough permissions"
         )
     
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = await db.get(models.User, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
+    previous_email = db_user.email
     for field, value in user.dict(exclude_unset=True).items():
         setattr(db_user, field, value)
     
-    db.commit()
-    db.refresh(db_user)
-    return db_user 
\ No newline at end of file
+    await db.commit()
+    await db.refresh(db_user)
+    security.invalidate_principal(previous_email)
+    security.invalidate_principal(db_user.email)
+    return db_user
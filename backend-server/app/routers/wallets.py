@@ -1,25 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Query, Response
+from fastapi.responses import UJSONResponse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
 import uuid
-from ..database import get_db
+from ..database import get_async_db
 from ..models import models
 from ..schemas import wallet_schemas
-from ..core import security
+from ..schemas.pagination_schemas import Page
+from ..core import security, ledger
+from ..core.idempotency import fingerprint, idempotency_store
+from ..core.pagination import keyset, page_size
+from ..core.serialization import RowSerializer, page_response
 
 router = APIRouter()
 
+wallet_rows = RowSerializer(wallet_schemas.Wallet)
+transaction_rows = RowSerializer(wallet_schemas.Transaction)
+
 @router.post("/", response_model=wallet_schemas.Wallet)
-def create_wallet(
+async def create_wallet(
     wallet: wallet_schemas.WalletCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     # Check if user already has a wallet for this currency
-    existing_wallet = db.query(models.Wallet).filter(
-        models.Wallet.user_id == current_user.id,
-        models.Wallet.currency == wallet.currency
-    ).first()
+    existing_wallet = (await db.execute(
+        select(models.Wallet).where(
+            models.Wallet.user_id == current_user.id,
+            models.Wallet.currency == wallet.currency
+        )
+    )).scalars().first()
     
     if existing_wallet:
         raise HTTPException(
@@ -33,24 +46,63 @@ def create_wallet(
         balance=0.0
     )
     db.add(db_wallet)
-    db.commit()
-    db.refresh(db_wallet)
+    await db.commit()
+    await db.refresh(db_wallet)
     return db_wallet
 
-@router.get("/", response_model=List[wallet_schemas.Wallet])
-def get_wallets(
-    db: Session = Depends(get_db),
+@router.get("/", response_model=Page[wallet_schemas.Wallet])
+async def get_wallets(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    return db.query(models.Wallet).filter(models.Wallet.user_id == current_user.id).all()
+    limit = page_size(limit)
+    query = select(*wallet_rows.columns(models.Wallet)).where(models.Wallet.user_id == current_user.id)
+    rows = (await db.execute(keyset(query, models.Wallet, cursor, limit))).all()
+    return page_response(rows, limit, wallet_rows)
+
+@router.post("/transactions/batch", response_model=wallet_schemas.TransactionBatchResult)
+async def create_transactions_batch(
+    batch: wallet_schemas.TransactionBatch,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    # Bulk ingestion is for internal processors, e.g. deposit crediting
+    if current_user.role != models.UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    if len(batch.items) > ledger.LEDGER_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch may contain at most {ledger.LEDGER_BATCH_MAX_ITEMS} items"
+        )
+    
+    try:
+        results = await ledger.post_batch(db, batch.items)
+    except ledger.DuplicateReference as exc:
+        # reference_id is unique; one inserted meanwhile is a conflict, not a server error
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"A reference_id was created concurrently; the first {exc.committed} items were committed, retry the rest"
+        )
+    created = sum(1 for result in results if result["status"] == "created")
+    return {
+        "created": created,
+        "rejected": len(results) - created,
+        "results": results
+    }
 
 @router.get("/{wallet_id}", response_model=wallet_schemas.Wallet)
-def get_wallet(
+async def get_wallet(
     wallet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    wallet = db.query(models.Wallet).filter(models.Wallet.id == wallet_id).first()
+    wallet = await db.get(models.Wallet, wallet_id)
     if not wallet:
         raise HTTPException(status_code=404, detail="Wallet not found")
     
@@ -60,70 +112,102 @@ def get_wallet(
     return wallet
 
 @router.get("/{wallet_id}/balance", response_model=wallet_schemas.WalletBalance)
-def get_wallet_balance(
+async def get_wallet_balance(
     wallet_id: int,
-    db: Session = Depends(get_db),
+    at: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    wallet = db.query(models.Wallet).filter(models.Wallet.id == wallet_id).first()
+    wallet = await db.get(models.Wallet, wallet_id)
     if not wallet:
         raise HTTPException(status_code=404, detail="Wallet not found")
     
     if wallet.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view this wallet")
     
+    # Historical balances come from the ledger, the current one from the wallet row
+    balance_minor = wallet.balance_minor
+    if at is not None:
+        balance_minor = await ledger.balance_at(db, wallet.id, at)
+    
     return {
         "currency": wallet.currency,
-        "balance": wallet.balance,
+        "balance": ledger.to_major(balance_minor, wallet.currency),
         "wallet_address": wallet.wallet_address
     }
 
 @router.post("/{wallet_id}/transactions", response_model=wallet_schemas.Transaction)
-def create_transaction(
+async def create_transaction(
     wallet_id: int,
     transaction: wallet_schemas.TransactionCreate,
-    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    wallet = db.query(models.Wallet).filter(models.Wallet.id == wallet_id).first()
-    if not wallet:
-        raise HTTPException(status_code=404, detail="Wallet not found")
-    
-    if wallet.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to create transactions for this wallet")
-    
-    # For withdrawals, check if there's enough balance
-    if transaction.transaction_type == "withdrawal" and wallet.balance < transaction.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
+    async def handle() -> Response:
+        wallet = await db.get(models.Wallet, wallet_id)
+        if not wallet:
+            raise HTTPException(status_code=404, detail="Wallet not found")
+        
+        if wallet.user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Not authorized to create transactions for this wallet")
+        
+        amount_minor = ledger.to_minor(transaction.amount, wallet.currency)
+        if amount_minor <= 0:
+            raise HTTPException(status_code=400, detail="Amount must be positive")
+        
+        db_transaction = models.Transaction(
+            **transaction.dict(),
+            wallet_id=wallet_id,
+            status="pending"
+        )
+        db.add(db_transaction)
+        try:
+            await db.flush()
+        except IntegrityError:
+            # reference_id is unique; a repeat is a conflict, not a server error
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Transaction {transaction.reference_id} already exists"
+            )
+        
+        # Update wallet balance based on transaction type; the ledger rejects overdrafts atomically
+        delta = ledger.signed_amount(transaction.transaction_type, amount_minor)
+        if delta:
+            try:
+                await ledger.post(db, wallet, delta, transaction_id=db_transaction.id)
+            except ledger.InsufficientFunds:
+                await db.rollback()
+                raise HTTPException(status_code=400, detail="Insufficient balance")
+        
+        await db.commit()
+        await db.refresh(db_transaction)
+        return UJSONResponse(wallet_schemas.Transaction.model_validate(db_transaction).model_dump(mode="json"))
     
-    db_transaction = models.Transaction(
-        **transaction.dict(),
-        wallet_id=wallet_id,
-        status="pending"
+    # A retried request with the same Idempotency-Key gets the first response instead of a 409
+    return await idempotency_store.run(
+        (current_user.id, "create_transaction"), idempotency_key, fingerprint(wallet_id, transaction), handle
     )
-    db.add(db_transaction)
-    
-    # Update wallet balance based on transaction type
-    if transaction.transaction_type == "deposit":
-        wallet.balance += transaction.amount
-    elif transaction.transaction_type == "withdrawal":
-        wallet.balance -= transaction.amount
-    
-    db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
 
-@router.get("/{wallet_id}/transactions", response_model=List[wallet_schemas.Transaction])
-def get_wallet_transactions(
+@router.get("/{wallet_id}/transactions", response_model=Page[wallet_schemas.Transaction])
+async def get_wallet_transactions(
     wallet_id: int,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    wallet = db.query(models.Wallet).filter(models.Wallet.id == wallet_id).first()
+    wallet = await db.get(models.Wallet, wallet_id)
     if not wallet:
         raise HTTPException(status_code=404, detail="Wallet not found")
     
     if wallet.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view transactions for this wallet")
     
-    return wallet.transactions 
\ No newline at end of file
+    limit = page_size(limit)
+    query = select(*transaction_rows.columns(models.Transaction)).where(
+        models.Transaction.wallet_id == wallet.id
+    )
+    rows = (await db.execute(keyset(query, models.Transaction, cursor, limit))).all()
+    return page_response(rows, limit, transaction_rows)
@@ -0,0 +1,48 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+
+class Candle(BaseModel):
+    bucket_start: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    quote_volume: float
+    vwap: float
+    trade_count: int
+
+    class Config:
+        from_attributes = True
+
+class MarketStats(BaseModel):
+    currency: str
+    window_start: datetime
+    last_price: Optional[float] = None
+    open: Optional[float] = None
+    high: Optional[float] = None
+    low: Optional[float] = None
+    volume: float = 0.0
+    quote_volume: float = 0.0
+    vwap: Optional[float] = None
+    trade_count: int = 0
+    change_percent: Optional[float] = None
+
+class DepthLevel(BaseModel):
+    price: float
+    amount: float
+    offers: int
+    cumulative_amount: float
+    cumulative_cost: float
+
+class MarketDepth(BaseModel):
+    currency: str
+    best_ask: Optional[float] = None
+    last_price: Optional[float] = None
+    spread: Optional[float] = None
+    spread_percent: Optional[float] = None
+    step: float
+    total_offers: int
+    total_amount: float
+    levels: List[DepthLevel]
@@ -25,7 +25,7 @@ class TradeMessage(TradeMessageBase):
     class Config:
         from_attributes = True
 
-class Trade(TradeBase):
+class TradeInfo(TradeBase):
     id: int
     trade_id: str
     buyer_id: int
@@ -35,11 +35,28 @@ class Trade(TradeBase):
     status: TradeStatus
     moderator_id: Optional[int] = None
     created_at: datetime
-    messages: List[TradeMessage] = []
 
     class Config:
         from_attributes = True
 
+class Trade(TradeInfo):
+    messages: List[TradeMessage] = []
+
+class TradeSummary(TradeInfo):
+    message_count: int = 0
+    last_message: Optional[TradeMessage] = None
+    messages: Optional[List[TradeMessage]] = None  # Only with include=messages: the latest SUMMARY_MESSAGES, oldest first
+
+class MarketOrderCreate(BaseModel):
+    currency: str
+    amount: float
+    max_price: Optional[float] = None
+
+class MarketOrderResult(BaseModel):
+    trades: List[Trade]
+    filled_amount: float
+    remaining_amount: float
+
 class TradeUpdate(BaseModel):
     status: Optional[TradeStatus] = None
     moderator_id: Optional[int] = None 
\ No newline at end of file
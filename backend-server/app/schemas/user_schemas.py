@@ -23,4 +23,8 @@ class User(UserBase):
     is_blocked: bool
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
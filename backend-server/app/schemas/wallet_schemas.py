@@ -36,6 +36,24 @@ class Transaction(TransactionBase):
     class Config:
         from_attributes = True
 
+class BatchTransactionCreate(TransactionCreate):
+    wallet_id: int
+
+class TransactionBatch(BaseModel):
+    items: List[BatchTransactionCreate]
+
+class BatchItemResult(BaseModel):
+    index: int
+    reference_id: str
+    status: str  # "created", "rejected"
+    transaction_id: Optional[int] = None
+    error: Optional[str] = None
+
+class TransactionBatchResult(BaseModel):
+    created: int
+    rejected: int
+    results: List[BatchItemResult]
+
 class WalletBalance(BaseModel):
     currency: str
     balance: float
@@ -0,0 +1,3 @@
+"""
+NexusSwap Benchmarks
+"""
@@ -0,0 +1,89 @@
+"""
+Market depth: SQL aggregation over the offers table vs cached array snapshots
+
+Run from backend-server/:
+    python -m benchmarks.bench_depth --offers 200000 --levels 50
+"""
+
+import argparse
+import time
+from typing import Callable
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import Session
+from app.core.depth import MarketDepth
+from app.core.market_data import LastPrices
+from app.core.order_book import OrderBook
+from app.models.base import Base
+from app.models.models import Offer, User
+from .bench_matching import build_book
+
+STEP = 10.0
+
+
+def seed(session: Session, offers: int, seed: int) -> OrderBook:
+    """Load the same offers into SQLite and into an order book."""
+    entries = list(build_book(offers, sellers=1000, seed=seed).entries.values())
+    session.execute(insert(User).values(id=1, email="bench@example.com", username="bench"))
+    session.execute(insert(Offer), [
+        {
+            "id": entry.id, "seller_id": 1, "currency": entry.currency, "min_amount": entry.min_amount,
+            "max_amount": entry.max_amount, "price_per_unit": entry.price_per_unit, "is_active": True,
+        }
+        for entry in entries
+    ])
+    session.commit()
+    book = OrderBook()
+    book.load(session)
+    return book
+
+
+def sql_depth(session: Session, levels: int) -> int:
+    """What a client had to do without the endpoint, pushed down into one GROUP BY."""
+    level = func.ceil(Offer.price_per_unit / STEP) if session.bind.dialect.name != "sqlite" else (
+        func.cast(Offer.price_per_unit / STEP + 0.999999999, Offer.id.type)
+    )
+    rows = session.execute(
+        select(level.label("level"), func.sum(Offer.max_amount), func.count(Offer.id))
+        .where(Offer.is_active == True, Offer.currency == "BTC")
+        .group_by("level")
+        .order_by("level")
+        .limit(levels)
+    ).all()
+    return len(rows)
+
+
+def measure(name: str, run: Callable[[], object], repeat: int) -> float:
+    run()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    per_call = (time.perf_counter() - started) / repeat
+    print(f"{name:<32} {per_call * 1e6:>12,.1f} us/query")
+    return per_call
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--offers", type=int, default=200_000)
+    parser.add_argument("--levels", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        book = seed(session, args.offers, args.seed)
+        depth = MarketDepth(book, LastPrices())
+        print(f"{args.offers} resting offers, {args.levels} levels of width {STEP}")
+        sql = measure("sql group by", lambda: sql_depth(session, args.levels), 5)
+        measure("first snapshot + levels", lambda: (depth._arrays.clear(), depth.depth("BTC", STEP, args.levels)), 5)
+        entries = list(book.book("BTC").entries.values())[:100]
+        measure("100 changed offers + levels", lambda: ([book.upsert(entry) for entry in entries],
+                                                         depth.depth("BTC", STEP, args.levels)), 50)
+        measure("levels from snapshot", lambda: (depth.cache.clear(), depth.depth("BTC", STEP, args.levels)), 200)
+        cached = measure("cached", lambda: depth.depth("BTC", STEP, args.levels), 100_000)
+    print(f"cached speedup over sql: {sql / cached:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
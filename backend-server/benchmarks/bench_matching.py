@@ -0,0 +1,91 @@
+"""
+Matching engine throughput against a large resting order book
+
+Run from backend-server/:
+    python -m benchmarks.bench_matching --offers 1000000 --orders 20000
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime
+from app.core.matching import match_book
+from app.core.order_book import BookEntry, CurrencyBook
+
+
+def build_book(offers: int, sellers: int, seed: int) -> CurrencyBook:
+    """Build a one-currency book of resting offers priced around 30,000."""
+    rng = random.Random(seed)
+    created_at = datetime.utcnow()
+    entries = []
+    for offer_id in range(1, offers + 1):
+        min_amount = round(rng.uniform(0.001, 0.05), 8)
+        entries.append(BookEntry(
+            id=offer_id,
+            seller_id=rng.randrange(1, sellers + 1),
+            currency="BTC",
+            min_amount=min_amount,
+            max_amount=round(min_amount + rng.uniform(0.01, 2.0), 8),
+            price_per_unit=round(rng.gauss(30000, 1500), 2),
+            is_active=True,
+            created_at=created_at,
+            version=1,
+        ))
+    book = CurrencyBook("BTC")
+    book.rebuild(entries)
+    return book
+
+
+def apply_fills(book: CurrencyBook, fills) -> None:
+    """Mirror what the engine does after commit: shrink or remove each filled offer."""
+    for fill in fills:
+        entry = book.entries[fill.offer_id]
+        if fill.exhausted:
+            book.discard(entry.id)
+        else:
+            book.replace(entry, BookEntry(
+                id=entry.id,
+                seller_id=entry.seller_id,
+                currency=entry.currency,
+                min_amount=entry.min_amount,
+                max_amount=fill.left,
+                price_per_unit=entry.price_per_unit,
+                is_active=True,
+                created_at=entry.created_at,
+                version=entry.version + 1,
+            ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--offers", type=int, default=1_000_000)
+    parser.add_argument("--orders", type=int, default=20_000)
+    parser.add_argument("--sellers", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    book = build_book(args.offers, args.sellers, args.seed)
+    print(f"built book of {len(book):,} offers in {time.perf_counter() - started:.2f}s")
+
+    rng = random.Random(args.seed + 1)
+    orders = [
+        (round(rng.uniform(0.01, 5.0), 8), round(rng.gauss(31000, 1000), 2), rng.randrange(1, args.sellers + 1))
+        for _ in range(args.orders)
+    ]
+
+    fills_total = 0
+    started = time.perf_counter()
+    for amount, max_price, buyer_id in orders:
+        fills, _ = match_book(book, amount, max_price, buyer_id)
+        apply_fills(book, fills)
+        fills_total += len(fills)
+    elapsed = time.perf_counter() - started
+
+    print(f"matched {args.orders:,} orders ({fills_total:,} fills) in {elapsed:.2f}s")
+    print(f"{args.orders / elapsed:,.0f} matches/s, {fills_total / elapsed:,.0f} fills/s, "
+          f"{len(book):,} offers left resting")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+List response serialization: ORM objects through pydantic vs projected rows
+
+Run from backend-server/:
+    python -m benchmarks.bench_serialization --rows 50000 --page 500
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+import ujson
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from app.core.pagination import keyset, make_page
+from app.core.serialization import RowSerializer
+from app.models.base import Base
+from app.models.models import Transaction, User, Wallet
+from app.schemas import wallet_schemas
+from app.schemas.pagination_schemas import Page
+
+
+def seed(session: Session, rows: int) -> None:
+    """Create one wallet holding rows transactions."""
+    session.execute(insert(User).values(id=1, email="bench@example.com", username="bench"))
+    session.execute(insert(Wallet).values(id=1, user_id=1, currency="BTC", wallet_address="bench"))
+    start = datetime(2024, 1, 1)
+    session.execute(insert(Transaction), [
+        {
+            "wallet_id": 1,
+            "amount": round(0.001 * (i % 997 + 1), 8),
+            "transaction_type": "deposit" if i % 3 else "withdrawal",
+            "status": "completed",
+            "reference_id": f"ref-{i}",
+            "created_at": start + timedelta(seconds=i),
+        }
+        for i in range(rows)
+    ])
+    session.commit()
+
+
+def orm_pages(session: Session, page: int) -> int:
+    """What the endpoint used to do: ORM rows, pydantic from_attributes, stdlib json."""
+    adapter = TypeAdapter(Page[wallet_schemas.Transaction])
+    query = select(Transaction).where(Transaction.wallet_id == 1)
+    cursor, total = None, 0
+    while True:
+        result = make_page(session.execute(keyset(query, Transaction, cursor, page)).scalars().all(), page)
+        body = json.dumps(
+            adapter.dump_python(adapter.validate_python(result, from_attributes=True), mode="json"),
+            ensure_ascii=False, separators=(",", ":"),
+        )
+        total += len(result["items"])
+        session.expunge_all()
+        cursor = result["next_cursor"]
+        if cursor is None or not body:
+            return total
+
+
+def row_pages(session: Session, page: int) -> int:
+    """The fast path: column projection, compiled row serializer, ujson."""
+    serialize = RowSerializer(wallet_schemas.Transaction)
+    query = select(*serialize.columns(Transaction)).where(Transaction.wallet_id == 1)
+    cursor, total = None, 0
+    while True:
+        result = make_page(session.execute(keyset(query, Transaction, cursor, page)).all(), page)
+        result["items"] = [serialize(row) for row in result["items"]]
+        body = ujson.dumps(result, ensure_ascii=False)
+        total += len(result["items"])
+        cursor = result["next_cursor"]
+        if cursor is None or not body:
+            return total
+
+
+def measure(name: str, run: Callable[[], int], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = run()
+        best = min(best, time.perf_counter() - started)
+    rate = rows / best
+    print(f"{name:<28} {rows:>8} rows  {best * 1000:>9.1f} ms  {rate:>12,.0f} rows/s")
+    return rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--page", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session, args.rows)
+        print(f"{args.rows} transactions, pages of {args.page}, best of {args.repeat}")
+        before = measure("orm + pydantic + json", lambda: orm_pages(session, args.page), args.repeat)
+        after = measure("rows + serializer + ujson", lambda: row_pages(session, args.page), args.repeat)
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""
+Load test: latency and throughput of the API under realistic request mixes
+
+Seeds a database with scripts.generate_data, boots app.main:app under
+uvicorn against it and drives a weighted mix of offer browsing, trade
+creation, chat and deposits at each concurrency level. Reports p50/p95/p99 latency and throughput per route,
+and can save the results as a baseline and diff a later run against it.
+
+Run from backend-server/:
+    python -m benchmarks.loadtest --concurrency 1,8,32 --duration 15 --save baseline.json
+    python -m benchmarks.loadtest --concurrency 1,8,32 --duration 15 --compare baseline.json
+
+--database-url takes any URL the app supports, e.g. a scratch Postgres
+database; by default a fresh SQLite file is created in a temp directory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import aiohttp
+from sqlalchemy import select
+from app.core.security import create_access_token
+from app.database.engine import build_engine
+from app.database.migrate import run_migrations
+from app.models.models import Offer, Trade, User, Wallet
+from scripts.generate_data import Profile, generate
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+PASSWORD = "loadtest"
+
+# Scenario weights of the default mix; browsing dominates as it does in production
+DEFAULT_MIX = "browse=50,offer=10,trades=10,trade=8,chat=12,deposit=10"
+
+
+@dataclass
+class Account:
+    """A seeded user and what its requests may touch."""
+    id: int
+    headers: Dict[str, str]
+    wallets: Dict[str, int]
+    trades: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Fixture:
+    accounts: List[Account]
+    offers: Dict[str, List[Tuple[int, int, float]]]  # currency -> [(offer_id, seller_id, min_amount)]
+
+
+def seed(url: str, users: int, offers: int, trades: int, accounts: int, seed: int, rng: random.Random) -> Fixture:
+    """Create the schema, load a generated dataset and read back what the scenarios need."""
+    engine = build_engine(url)
+    run_migrations(engine)
+    generate(engine, Profile(users=users, offers=offers, trades=users * trades, password=PASSWORD, seed=seed),
+             log=lambda line: None)
+    token_ttl = timedelta(hours=12)
+
+    with engine.connect() as connection:
+        candidates = connection.execute(
+            select(User.id, User.email).where(User.is_blocked.is_(False)).order_by(User.id)
+        ).all()
+        picked = dict(rng.sample(candidates, min(accounts, len(candidates))))
+        wallets: Dict[int, Dict[str, int]] = defaultdict(dict)
+        owned = defaultdict(list)
+        for start in range(0, len(picked), 500):
+            chunk = list(picked)[start:start + 500]
+            for user_id, currency, wallet_id in connection.execute(
+                select(Wallet.user_id, Wallet.currency, Wallet.id).where(Wallet.user_id.in_(chunk))
+            ):
+                wallets[user_id][currency] = wallet_id
+            for buyer_id, public_id in connection.execute(
+                select(Trade.buyer_id, Trade.trade_id).where(Trade.buyer_id.in_(chunk))
+            ):
+                owned[buyer_id].append(public_id)
+        book: Dict[str, List[Tuple[int, int, float]]] = defaultdict(list)
+        for offer_id, seller_id, currency, min_amount in connection.execute(
+            select(Offer.id, Offer.seller_id, Offer.currency, Offer.min_amount)
+            .where(Offer.is_active.is_(True))
+            .order_by(Offer.id)
+        ):
+            book[currency].append((offer_id, seller_id, min_amount))
+    engine.dispose()
+
+    fixture_accounts = []
+    for user_id, email in picked.items():
+        token = create_access_token({"sub": email}, expires_delta=token_ttl)
+        fixture_accounts.append(Account(
+            id=user_id, headers={"Authorization": f"Bearer {token}"},
+            wallets=wallets[user_id], trades=owned[user_id],
+        ))
+    return Fixture(accounts=fixture_accounts, offers=dict(book))
+
+
+# A scenario issues one or more requests and returns (route, status, seconds) for each
+Scenario = Callable[[aiohttp.ClientSession, Fixture, random.Random], Awaitable[List[Tuple[str, int, float]]]]
+
+
+async def timed(session: aiohttp.ClientSession, route: str, method: str, url: str, **kwargs: Any) -> Tuple[str, int, float, Any]:
+    started = time.perf_counter()
+    async with session.request(method, url, **kwargs) as response:
+        body = await response.read()
+        elapsed = time.perf_counter() - started
+        data = json.loads(body) if response.status < 300 and body else None
+        return route, response.status, elapsed, data
+
+
+async def browse(session, fixture, rng):
+    currency = rng.choice(list(fixture.offers))
+    route, status, elapsed, _ = await timed(
+        session, "GET /api/offers", "GET", f"/api/offers/?currency={currency}&limit=50"
+    )
+    return [(route, status, elapsed)]
+
+
+async def view_offer(session, fixture, rng):
+    offer_id, _, _ = rng.choice(fixture.offers[rng.choice(list(fixture.offers))])
+    route, status, elapsed, _ = await timed(session, "GET /api/offers/{id}", "GET", f"/api/offers/{offer_id}")
+    return [(route, status, elapsed)]
+
+
+async def list_trades(session, fixture, rng):
+    account = rng.choice(fixture.accounts)
+    route, status, elapsed, _ = await timed(
+        session, "GET /api/trades", "GET", "/api/trades/?limit=20", headers=account.headers
+    )
+    return [(route, status, elapsed)]
+
+
+async def create_trade(session, fixture, rng):
+    account = rng.choice(fixture.accounts)
+    offer_id, _, min_amount = rng.choice(fixture.offers[rng.choice(list(fixture.offers))])
+    route, status, elapsed, data = await timed(
+        session, "POST /api/trades", "POST", "/api/trades/",
+        json={"offer_id": offer_id, "amount": min_amount}, headers=account.headers,
+    )
+    if data is not None:
+        account.trades.append(data["trade_id"])
+    return [(route, status, elapsed)]
+
+
+async def chat(session, fixture, rng):
+    account = rng.choice([account for account in fixture.accounts if account.trades] or fixture.accounts)
+    trade_id = rng.choice(account.trades)
+    results = []
+    route, status, elapsed, _ = await timed(
+        session, "POST /api/trades/{id}/messages", "POST", f"/api/trades/{trade_id}/messages",
+        json={"content": "is the payment through?"}, headers=account.headers,
+    )
+    results.append((route, status, elapsed))
+    route, status, elapsed, _ = await timed(
+        session, "GET /api/trades/{id}/messages", "GET", f"/api/trades/{trade_id}/messages?limit=50",
+        headers=account.headers,
+    )
+    results.append((route, status, elapsed))
+    return results
+
+
+async def deposit(session, fixture, rng):
+    account = rng.choice(fixture.accounts)
+    currency = rng.choice(list(account.wallets))
+    route, status, elapsed, _ = await timed(
+        session, "POST /api/wallets/{id}/transactions", "POST",
+        f"/api/wallets/{account.wallets[currency]}/transactions",
+        json={"amount": round(rng.uniform(0.01, 1), 4), "transaction_type": "deposit",
+              "reference_id": uuid.uuid4().hex},
+        headers=account.headers,
+    )
+    return [(route, status, elapsed)]
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "browse": browse,
+    "offer": view_offer,
+    "trades": list_trades,
+    "trade": create_trade,
+    "chat": chat,
+    "deposit": deposit,
+}
+
+
+def parse_mix(spec: str) -> Tuple[List[str], List[float]]:
+    names, weights = [], []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), int(round(q / 100 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / duration, 2),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(1000 * percentile(ordered, 50), 3),
+        "p95_ms": round(1000 * percentile(ordered, 95), 3),
+        "p99_ms": round(1000 * percentile(ordered, 99), 3),
+        "max_ms": round(1000 * ordered[-1], 3) if ordered else 0.0,
+    }
+
+
+async def run_level(
+    base_url: str, fixture: Fixture, mix: Tuple[List[str], List[float]],
+    concurrency: int, duration: float, warmup: float, seed_value: int,
+) -> Dict[str, Any]:
+    """Run closed-loop workers for warmup + duration seconds, recording only after the warmup."""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    names, weights = mix
+    started = time.perf_counter()
+    record_from = started + warmup
+    stop_at = record_from + duration
+
+    async def worker(index: int, session: aiohttp.ClientSession) -> None:
+        rng = random.Random(seed_value * 1000 + index)
+        while time.perf_counter() < stop_at:
+            scenario = SCENARIOS[rng.choices(names, weights)[0]]
+            try:
+                results = await scenario(session, fixture, rng)
+            except aiohttp.ClientError:
+                results = [("connection errors", 599, 0.0)]
+            if time.perf_counter() < record_from:
+                continue
+            for route, status, elapsed in results:
+                latencies[route].append(elapsed)
+                errors[route] += status >= 400
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(base_url, connector=connector) as session:
+        await asyncio.gather(*(worker(index, session) for index in range(concurrency)))
+
+    routes = {route: summarize(values, errors[route], duration) for route, values in sorted(latencies.items())}
+    everything = [value for values in latencies.values() for value in values]
+    return {"routes": routes, "total": summarize(everything, sum(errors.values()), duration)}
+
+
+def start_server(url: str, port: int) -> subprocess.Popen:
+    # Seeded history is backdated, so expiry would empty the book mid-run
+    env = dict(os.environ, DATABASE_URL=url, EXPIRY_ENABLED="false")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+async def wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession(base_url) as session:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise SystemExit(f"server exited with code {server.returncode}")
+            try:
+                async with session.get("/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("server did not become ready")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_level(concurrency: int, result: Dict[str, Any]) -> None:
+    print(f"\nconcurrency {concurrency}")
+    print(f"  {'route':<38} {'req':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in [*result["routes"].items(), ("total", result["total"])]:
+        print(
+            f"  {route:<38} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>9.1f} "
+            f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}"
+        )
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> int:
+    """Print per-route changes against a baseline and return how many regressed beyond threshold."""
+    regressions = 0
+    print(f"\ncompared with baseline {baseline['meta'].get('commit')} (threshold {threshold:.0%})")
+    for level, result in current["levels"].items():
+        before_level = baseline["levels"].get(level)
+        if before_level is None:
+            continue
+        before_routes = {**before_level["routes"], "total": before_level["total"]}
+        for route, stats in [*result["routes"].items(), ("total", result["total"])]:
+            before = before_routes.get(route)
+            if not before or not before["requests"]:
+                continue
+            p95 = stats["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+            rps = stats["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0.0
+            regressed = p95 > threshold or rps < -threshold
+            regressions += regressed
+            print(
+                f"  {'REGRESSED' if regressed else 'ok':<9} c={level:<4} {route:<38} "
+                f"p95 {before['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms ({p95:+.0%})  "
+                f"rps {before['throughput_rps']:.1f} -> {stats['throughput_rps']:.1f} ({rps:+.0%})"
+            )
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> int:
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.database_url or f"sqlite:///{Path(directory) / 'loadtest.db'}"
+        started = time.perf_counter()
+        fixture = seed(
+            url, args.users, args.offers, args.trades, args.accounts, args.seed, random.Random(args.seed)
+        )
+        print(f"seeded {args.users} users and {args.offers} offers in {time.perf_counter() - started:.1f}s")
+
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = start_server(url, args.port)
+        try:
+            await wait_ready(base_url, server)
+            levels = {}
+            for concurrency in args.concurrency:
+                result = await run_level(
+                    base_url, fixture, mix, concurrency, args.duration, args.warmup, args.seed
+                )
+                levels[str(concurrency)] = result
+                print_level(concurrency, result)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "database": url.split(":", 1)[0],
+            "python": platform.python_version(),
+            "mix": args.mix,
+            "duration": args.duration,
+            "users": args.users,
+            "offers": args.offers,
+            "accounts": args.accounts,
+            "seed": args.seed,
+        },
+        "levels": levels,
+    }
+    if args.save:
+        Path(args.save).write_text(json.dumps(report, indent=2))
+        print(f"\nsaved results to {args.save}")
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), report, args.threshold)
+        if regressions:
+            print(f"{regressions} regressions beyond {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", help="database to seed and serve; default: temp SQLite file")
+    parser.add_argument("--concurrency", type=lambda value: [int(part) for part in value.split(",")],
+                        default=[1, 8, 32], help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured per level")
+    parser.add_argument("--warmup", type=float, default=2, help="unrecorded seconds before each level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight pairs")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--offers", type=int, default=5000)
+    parser.add_argument("--trades", type=int, default=5, help="seeded trades per user")
+    parser.add_argument("--accounts", type=int, default=200, help="seeded users the scenarios log in as")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to diff against; exits 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="allowed relative p95 increase or throughput drop")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
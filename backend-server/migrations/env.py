@@ -0,0 +1,49 @@
+"""
+Alembic environment for the NexusSwap schema
+"""
+
+from logging.config import fileConfig
+from alembic import context
+from app.database import SQLALCHEMY_DATABASE_URL, build_engine
+from app.models.base import Base
+from app.models import models  # noqa: F401 - registers the tables on Base.metadata
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def configure(**kwargs) -> None:
+    # Batch mode lets ALTER-style migrations run on SQLite by copying the table
+    context.configure(target_metadata=target_metadata, render_as_batch=True, **kwargs)
+
+
+def run_migrations_offline() -> None:
+    configure(url=SQLALCHEMY_DATABASE_URL, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    # The application passes its own connection when migrating at startup
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        configure(connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    engine = build_engine(SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as connection:
+        configure(connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
+    engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
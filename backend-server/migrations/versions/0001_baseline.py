@@ -0,0 +1,110 @@
+"""Baseline schema as created by Base.metadata.create_all before migrations
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def timestamps():
+    return [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        *timestamps(),
+        sa.Column("email", sa.String(), nullable=True),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("hashed_password", sa.String(), nullable=True),
+        sa.Column("role", sa.Enum("USER", "ADMIN", "MODERATOR", name="userrole"), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("is_blocked", sa.Boolean(), nullable=True),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    op.create_table(
+        "wallets",
+        *timestamps(),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("currency", sa.String(), nullable=True),
+        sa.Column("balance", sa.Float(), nullable=True),
+        sa.Column("wallet_address", sa.String(), nullable=True),
+        sa.Column("is_escrow", sa.Boolean(), nullable=True),
+        sa.UniqueConstraint("wallet_address"),
+    )
+    op.create_index("ix_wallets_id", "wallets", ["id"])
+
+    op.create_table(
+        "offers",
+        *timestamps(),
+        sa.Column("seller_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("currency", sa.String(), nullable=True),
+        sa.Column("min_amount", sa.Float(), nullable=True),
+        sa.Column("max_amount", sa.Float(), nullable=True),
+        sa.Column("price_per_unit", sa.Float(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+    )
+    op.create_index("ix_offers_id", "offers", ["id"])
+
+    op.create_table(
+        "trades",
+        *timestamps(),
+        sa.Column("trade_id", sa.String(), nullable=True),
+        sa.Column("offer_id", sa.Integer(), sa.ForeignKey("offers.id"), nullable=True),
+        sa.Column("buyer_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("seller_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("amount", sa.Float(), nullable=True),
+        sa.Column("price_per_unit", sa.Float(), nullable=True),
+        sa.Column("total_price", sa.Float(), nullable=True),
+        sa.Column(
+            "status",
+            sa.Enum("PENDING", "IN_PROGRESS", "PAID", "COMPLETED", "DISPUTED", "CANCELLED", name="tradestatus"),
+            nullable=True,
+        ),
+        sa.Column("moderator_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+    )
+    op.create_index("ix_trades_id", "trades", ["id"])
+    op.create_index("ix_trades_trade_id", "trades", ["trade_id"], unique=True)
+
+    op.create_table(
+        "trade_messages",
+        *timestamps(),
+        sa.Column("trade_id", sa.Integer(), sa.ForeignKey("trades.id"), nullable=True),
+        sa.Column("sender_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("content", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_trade_messages_id", "trade_messages", ["id"])
+
+    op.create_table(
+        "transactions",
+        *timestamps(),
+        sa.Column("wallet_id", sa.Integer(), sa.ForeignKey("wallets.id"), nullable=True),
+        sa.Column("amount", sa.Float(), nullable=True),
+        sa.Column("transaction_type", sa.String(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("reference_id", sa.String(), nullable=True),
+        sa.UniqueConstraint("reference_id"),
+    )
+    op.create_index("ix_transactions_id", "transactions", ["id"])
+
+
+def downgrade() -> None:
+    for table in ("transactions", "trade_messages", "trades", "offers", "wallets", "users"):
+        op.drop_table(table)
+    sa.Enum(name="tradestatus").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="userrole").drop(op.get_bind(), checkfirst=True)
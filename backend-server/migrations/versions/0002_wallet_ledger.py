@@ -0,0 +1,85 @@
+"""Wallet ledger: minor-unit balances, postings and snapshots
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Frozen copy of app.core.ledger's table as of this revision
+CURRENCY_DECIMALS = {"BTC": 8, "ETH": 8, "USDT": 6, "USDC": 6}
+DEFAULT_DECIMALS = 8
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("wallets") as batch:
+        batch.add_column(sa.Column("balance_minor", sa.BigInteger(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("posting_sequence", sa.Integer(), nullable=False, server_default="0"))
+
+    # Carry existing float balances over into minor units
+    wallets = sa.table(
+        "wallets", sa.column("id"), sa.column("currency"), sa.column("balance"), sa.column("balance_minor"),
+        sa.column("posting_sequence"), sa.column("created_at"),
+    )
+    scale = sa.case(
+        *[(sa.func.upper(wallets.c.currency) == currency, 10 ** places)
+          for currency, places in CURRENCY_DECIMALS.items()],
+        else_=10 ** DEFAULT_DECIMALS,
+    )
+    op.execute(
+        wallets.update().values(
+            balance_minor=sa.cast(sa.func.round(sa.func.coalesce(wallets.c.balance, 0) * scale), sa.BigInteger)
+        )
+    )
+
+    op.create_table(
+        "ledger_postings",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("wallet_id", sa.Integer(), sa.ForeignKey("wallets.id"), nullable=False),
+        sa.Column("transaction_id", sa.Integer(), sa.ForeignKey("transactions.id"), nullable=True),
+        sa.Column("sequence", sa.Integer(), nullable=False),
+        sa.Column("amount_minor", sa.BigInteger(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.UniqueConstraint("wallet_id", "sequence"),
+    )
+    op.create_table(
+        "balance_snapshots",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("wallet_id", sa.Integer(), sa.ForeignKey("wallets.id"), nullable=False),
+        sa.Column("sequence", sa.Integer(), nullable=False),
+        sa.Column("balance_minor", sa.BigInteger(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.UniqueConstraint("wallet_id", "sequence"),
+    )
+
+    # Open each funded wallet's ledger with its carried-over balance as posting 1,
+    # so balance_at, which sums postings, includes it
+    postings = sa.table(
+        "ledger_postings", sa.column("wallet_id"), sa.column("sequence"), sa.column("amount_minor"),
+        sa.column("created_at"),
+    )
+    op.execute(
+        postings.insert().from_select(
+            ["wallet_id", "sequence", "amount_minor", "created_at"],
+            sa.select(
+                wallets.c.id, sa.literal(1), wallets.c.balance_minor,
+                sa.func.coalesce(wallets.c.created_at, sa.func.current_timestamp()),
+            ).where(wallets.c.balance_minor != 0),
+        )
+    )
+    op.execute(wallets.update().where(wallets.c.balance_minor != 0).values(posting_sequence=1))
+
+
+def downgrade() -> None:
+    op.drop_table("balance_snapshots")
+    op.drop_table("ledger_postings")
+    with op.batch_alter_table("wallets") as batch:
+        batch.drop_column("posting_sequence")
+        batch.drop_column("balance_minor")
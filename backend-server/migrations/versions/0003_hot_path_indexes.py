@@ -0,0 +1,35 @@
+"""Indexes for the hot query shapes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# name, table, columns; kept in step with __table_args__ in app/models/models.py
+INDEXES = [
+    ("ix_offers_active_currency_price", "offers", ["is_active", "currency", "price_per_unit"]),
+    ("ix_offers_seller_id", "offers", ["seller_id"]),
+    ("ix_trades_buyer_created", "trades", ["buyer_id", "created_at", "id"]),
+    ("ix_trades_seller_created", "trades", ["seller_id", "created_at", "id"]),
+    ("ix_trades_offer_id", "trades", ["offer_id"]),
+    ("ix_wallets_user_currency", "wallets", ["user_id", "currency"]),
+    ("ix_transactions_wallet_created", "transactions", ["wallet_id", "created_at", "id"]),
+    ("ix_trade_messages_trade_created", "trade_messages", ["trade_id", "created_at", "id"]),
+]
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
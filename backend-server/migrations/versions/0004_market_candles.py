@@ -0,0 +1,50 @@
+"""Trade completion time and market candles
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("trades") as batch:
+        batch.add_column(sa.Column("completed_at", sa.DateTime(), nullable=True))
+        batch.create_index("ix_trades_completed_at", ["completed_at"])
+
+    # Completion was never recorded; the last update is the best estimate
+    trades = sa.table("trades", sa.column("status"), sa.column("updated_at"), sa.column("completed_at"))
+    op.execute(trades.update().where(trades.c.status == "COMPLETED").values(completed_at=trades.c.updated_at))
+
+    op.create_table(
+        "market_candles",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("currency", sa.String(), nullable=False),
+        sa.Column("interval", sa.String(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("open", sa.Float(), nullable=False),
+        sa.Column("high", sa.Float(), nullable=False),
+        sa.Column("low", sa.Float(), nullable=False),
+        sa.Column("close", sa.Float(), nullable=False),
+        sa.Column("volume", sa.Float(), nullable=False),
+        sa.Column("quote_volume", sa.Float(), nullable=False),
+        sa.Column("trade_count", sa.Integer(), nullable=False),
+        sa.Column("first_trade_at", sa.DateTime(), nullable=False),
+        sa.Column("last_trade_at", sa.DateTime(), nullable=False),
+        sa.UniqueConstraint("currency", "interval", "bucket_start"),
+    )
+    # Candles for the backfilled trades come from: python -m scripts.rebuild_candles
+
+
+def downgrade() -> None:
+    op.drop_table("market_candles")
+    with op.batch_alter_table("trades") as batch:
+        batch.drop_index("ix_trades_completed_at")
+        batch.drop_column("completed_at")
@@ -0,0 +1,34 @@
+"""Indexes for the expiry sweeper and completed trade scans
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# name, table, columns; kept in step with __table_args__ in app/models/models.py
+INDEXES = [
+    ("ix_offers_active_updated", "offers", ["is_active", "updated_at"]),
+    ("ix_trades_status_updated", "trades", ["status", "updated_at"]),
+]
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+    # Leading with status keeps candle rebuilds off the sweeper's status index
+    op.drop_index("ix_trades_completed_at", table_name="trades")
+    op.create_index("ix_trades_status_completed", "trades", ["status", "completed_at", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_trades_status_completed", table_name="trades")
+    op.create_index("ix_trades_completed_at", "trades", ["completed_at"])
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
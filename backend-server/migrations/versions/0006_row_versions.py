@@ -0,0 +1,26 @@
+"""Row versions on offers and trades for optimistic concurrency
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    for table in ("offers", "trades"):
+        with op.batch_alter_table(table) as batch:
+            batch.add_column(sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade() -> None:
+    for table in ("trades", "offers"):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("version")
@@ -0,0 +1,29 @@
+"""Indexes that serve the ORDER BY of wallet pages and chat replay
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+# name, table, columns; kept in step with __table_args__ in app/models/models.py
+INDEXES = [
+    ("ix_wallets_user_created", "wallets", ["user_id", "created_at", "id"]),
+    ("ix_trade_messages_trade_id", "trade_messages", ["trade_id", "id"]),
+]
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,34 @@
+"""Offers record whether trades, rather than the seller or expiry, deactivated them
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("offers") as batch:
+        batch.add_column(sa.Column("is_exhausted", sa.Boolean(), nullable=False, server_default=sa.false()))
+
+    # Inactive offers left below their minimum are the ones trades deactivated before this revision
+    offers = sa.table(
+        "offers", sa.column("is_active"), sa.column("is_exhausted"), sa.column("min_amount"), sa.column("max_amount"),
+    )
+    op.execute(
+        offers.update()
+        .where(offers.c.is_active == sa.false(), offers.c.max_amount < offers.c.min_amount)
+        .values(is_exhausted=True)
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("offers") as batch:
+        batch.drop_column("is_exhausted")
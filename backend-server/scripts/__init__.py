@@ -0,0 +1,3 @@
+"""
+NexusSwap maintenance scripts
+"""
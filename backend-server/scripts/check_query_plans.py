@@ -0,0 +1,137 @@
+"""
+Fail if a hot query's SQLite plan regresses to a table scan
+
+Builds a scratch database from the Alembic migrations and runs EXPLAIN
+QUERY PLAN on the statements the API issues on its hot paths. Exits
+non-zero if any of them scans a table instead of searching an index, or
+if a keyset page sorts its rows instead of reading them in index order,
+so it can gate CI. tests/test_query_plans.py runs the same checks.
+
+Run from backend-server/:
+    python -m scripts.check_query_plans
+"""
+
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, List, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection
+from app.core.pagination import encode_cursor, keyset, keyset_union
+from app.database.engine import build_engine
+from app.database.migrate import run_migrations
+from app.models.models import (
+    BalanceSnapshot, LedgerPosting, MarketCandle, Offer, Trade, TradeMessage, Transaction, User, Wallet,
+)
+
+CURSOR_AT = datetime(2024, 1, 1)
+# Pages that must come straight off an index in (created_at, id) order
+KEYSET_PATHS = {
+    "user trades page", "trade message page", "trade message replay",
+    "user wallets page", "wallet transactions page",
+}
+
+
+def cursor() -> str:
+    return encode_cursor(CURSOR_AT, 1)
+
+
+def hot_queries() -> List[Tuple[str, Any]]:
+    """Statements shaped like the ones the routers and core modules run."""
+    return [
+        ("user by email", select(User).where(User.email == "a@example.com")),
+        ("order book load", select(Offer).where(Offer.is_active == True)),
+        ("offers by currency and price", select(Offer).where(
+            Offer.is_active == True, Offer.currency == "BTC", Offer.price_per_unit <= 30000,
+        ).order_by(Offer.price_per_unit)),
+        ("offers by seller", select(Offer).where(Offer.seller_id == 1)),
+        ("user trades page", keyset_union([
+            select(Trade).where(Trade.buyer_id == 1),
+            select(Trade).where(Trade.seller_id == 1, Trade.buyer_id != 1),
+        ], Trade, cursor(), 50)),
+        ("trade by public id", select(Trade).where(Trade.trade_id == "abc")),
+        ("trades of an offer", select(Trade).where(Trade.offer_id == 1)),
+        ("trade message page", keyset(
+            select(TradeMessage).where(TradeMessage.trade_id == 1), TradeMessage, cursor(), 50
+        )),
+        ("trade message replay", select(TradeMessage).where(
+            TradeMessage.trade_id == 1, TradeMessage.id > 10
+        ).order_by(TradeMessage.id).limit(50)),
+        ("trade message counts", select(TradeMessage.trade_id, func.count(TradeMessage.id)).where(
+            TradeMessage.trade_id.in_([1, 2, 3])
+        ).group_by(TradeMessage.trade_id)),
+        ("user wallets page", keyset(select(Wallet).where(Wallet.user_id == 1), Wallet, cursor(), 50)),
+        ("wallet by currency", select(Wallet).where(Wallet.user_id == 1, Wallet.currency == "BTC")),
+        ("wallet transactions page", keyset(
+            select(Transaction).where(Transaction.wallet_id == 1), Transaction, cursor(), 50
+        )),
+        ("transaction references", select(Transaction.reference_id).where(
+            Transaction.reference_id.in_(["a", "b"])
+        )),
+        ("balance snapshot", select(BalanceSnapshot.sequence, BalanceSnapshot.balance_minor).where(
+            BalanceSnapshot.wallet_id == 1, BalanceSnapshot.created_at <= CURSOR_AT
+        ).order_by(BalanceSnapshot.sequence.desc()).limit(1)),
+        ("postings since snapshot", select(func.coalesce(func.sum(LedgerPosting.amount_minor), 0)).where(
+            LedgerPosting.wallet_id == 1, LedgerPosting.sequence > 100, LedgerPosting.sequence <= 200,
+        )),
+        ("latest candles", select(MarketCandle).where(
+            MarketCandle.currency == "BTC", MarketCandle.interval == "1h",
+        ).order_by(MarketCandle.bucket_start.desc()).limit(50)),
+        ("candle range", select(MarketCandle).where(
+            MarketCandle.currency == "BTC", MarketCandle.interval == "1m", MarketCandle.bucket_start >= CURSOR_AT,
+        ).order_by(MarketCandle.bucket_start).limit(50)),
+        ("completed trades to rebuild", select(Trade.id).where(
+            Trade.status == "COMPLETED", Trade.completed_at >= CURSOR_AT,
+        ).order_by(Trade.completed_at, Trade.id).limit(1000)),
+        ("stale trades to expire", select(Trade.id).where(
+            Trade.status == "PENDING", Trade.updated_at < CURSOR_AT,
+        ).order_by(Trade.updated_at).limit(1000)),
+        ("stale offers to expire", select(Offer.id).where(
+            Offer.is_active == True, Offer.updated_at < CURSOR_AT,
+        ).order_by(Offer.updated_at).limit(1000)),
+    ]
+
+
+def scans(plan: List[str]) -> List[str]:
+    """Return plan steps that read a whole table or index rather than searching it."""
+    return [step for step in plan if step.startswith("SCAN ") and step != "SCAN CONSTANT ROW"]
+
+
+def sorts(plan: List[str]) -> List[str]:
+    """Return plan steps that sort rows in a temporary B-tree."""
+    return [step for step in plan if step.startswith("USE TEMP B-TREE")]
+
+
+def problems(name: str, plan: List[str]) -> List[str]:
+    """Return what is wrong with the plan of the named hot query."""
+    return scans(plan) + (sorts(plan) if name in KEYSET_PATHS else [])
+
+
+def explain(connection: Connection, statement: Any) -> List[str]:
+    """Return the steps of SQLite's query plan for a statement."""
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[key] for key in compiled.positiontup)
+    return [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + compiled.string, params)]
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = build_engine(f"sqlite:///{Path(directory) / 'plans.db'}")
+        run_migrations(engine)
+        failures = 0
+        with engine.connect() as connection:
+            for name, statement in hot_queries():
+                plan = explain(connection, statement)
+                bad = problems(name, plan)
+                failures += bool(bad)
+                print(f"{'FAIL' if bad else 'ok  '} {name}: {'; '.join(plan)}")
+        engine.dispose()
+    if failures:
+        print(f"{failures} hot queries scan a table or sort a keyset page", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
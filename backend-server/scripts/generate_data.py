@@ -0,0 +1,449 @@
+"""
+Synthetic data generator and bulk loader
+
+Generates referentially consistent users, wallets, offers, trades, trade
+messages and transactions (with their ledger postings and snapshots) with
+numpy, then loads them with bulk core inserts. Secondary indexes are
+dropped for the load and rebuilt once at the end, and every user shares
+one precomputed password hash. Market candles are rebuilt from the
+generated completed trades. Rows are appended after the current maximum
+ids, so an existing database can be grown.
+
+Run from backend-server/:
+    python -m scripts.generate_data --users 100000 --offers 500000 --trades 1000000
+    python -m scripts.generate_data --database-url sqlite:///./big.db --seller-concentration 1.3 \\
+        --currency BTC:30000:0.03 --currency ETH:2000:0.05
+"""
+
+import argparse
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection, Engine
+from app.core import market_data
+from app.core.ledger import LEDGER_SNAPSHOT_INTERVAL, minor_units
+from app.core.security import get_password_hash
+from app.database.engine import SQLALCHEMY_DATABASE_URL, build_engine
+from app.database.migrate import run_migrations
+from app.models.models import (
+    BalanceSnapshot, LedgerPosting, Offer, Trade, TradeMessage, TradeStatus, Transaction,
+    User, UserRole, Wallet,
+)
+
+# Share of trades in each status
+TRADE_STATUSES = {
+    TradeStatus.COMPLETED: 0.55,
+    TradeStatus.CANCELLED: 0.15,
+    TradeStatus.PENDING: 0.10,
+    TradeStatus.IN_PROGRESS: 0.08,
+    TradeStatus.PAID: 0.07,
+    TradeStatus.DISPUTED: 0.05,
+}
+
+MESSAGES = np.array([
+    "Hi, is this offer still available?",
+    "Sent the payment, please check.",
+    "Received, releasing now.",
+    "Can you do a slightly better price?",
+    "Thanks, smooth trade!",
+    "Waiting for the bank transfer to clear.",
+], dtype=object)
+
+
+@dataclass
+class Profile:
+    """Sizes and distributions of the data to generate."""
+    users: int = 10000
+    offers: int = 50000
+    trades: int = 100000
+    messages_per_trade: float = 3.0  # Poisson mean
+    transactions_per_wallet: float = 5.0  # Poisson mean
+    # currency -> (centre price, volatility of the lognormal price curve)
+    currencies: Dict[str, Tuple[float, float]] = field(default_factory=lambda: {
+        "BTC": (30000.0, 0.03),
+        "ETH": (2000.0, 0.05),
+        "USDT": (1.0, 0.002),
+    })
+    seller_concentration: float = 1.1  # Zipf exponent over sellers; 0 spreads offers evenly
+    active_share: float = 0.8
+    withdrawal_share: float = 0.3
+    days: int = 90
+    password: str = "password"
+    seed: int = 1
+    batch_size: int = 50000
+
+
+class Columns(dict):
+    """Column name -> equal-length array of values for one table."""
+
+    @property
+    def rows(self) -> int:
+        return len(next(iter(self.values()))) if dict.__len__(self) else 0
+
+
+def zipf_weights(count: int, exponent: float, rng: np.random.Generator) -> np.ndarray:
+    """Probabilities over count items following a Zipf law, randomly assigned to items."""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def timestamps(base: np.datetime64, offsets_us: np.ndarray) -> List[datetime]:
+    return (base + offsets_us.astype("timedelta64[us]")).astype("datetime64[us]").tolist()
+
+
+def group_ranks(groups: np.ndarray) -> np.ndarray:
+    """1-based position of each element within its group, for an array sorted by group."""
+    starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    sizes = np.diff(np.r_[starts, len(groups)])
+    return np.arange(len(groups)) - np.repeat(starts, sizes) + 1
+
+
+class Generator:
+    """Builds every table's columns in memory, then writes them in foreign-key order."""
+
+    def __init__(self, profile: Profile, offsets: Dict[str, int]) -> None:
+        self.profile = profile
+        self.offsets = offsets
+        self.rng = np.random.default_rng(profile.seed)
+        self.now = np.datetime64(datetime.utcnow(), "us")
+        self.start = self.now - np.timedelta64(profile.days, "D")
+        self.span_us = profile.days * 86_400_000_000
+        self.currencies = list(profile.currencies)
+
+    def ids(self, table: str, count: int) -> np.ndarray:
+        return np.arange(1, count + 1, dtype=np.int64) + self.offsets.get(table, 0)
+
+    def users(self) -> Columns:
+        p = self.profile
+        ids = self.ids("users", p.users)
+        created = self.rng.integers(0, self.span_us, p.users)
+        names = [f"user{i}" for i in ids.tolist()]
+        return Columns(
+            id=ids,
+            email=[f"{name}@example.com" for name in names],
+            username=names,
+            hashed_password=[get_password_hash(p.password)] * p.users,
+            role=[UserRole.USER] * p.users,
+            is_active=np.ones(p.users, dtype=bool),
+            is_blocked=self.rng.random(p.users) < 0.01,
+            created_at=timestamps(self.start, created),
+            updated_at=timestamps(self.start, created),
+        )
+
+    def offers(self, user_ids: np.ndarray) -> Columns:
+        p = self.profile
+        count = p.offers
+        currency_index = self.rng.integers(0, len(self.currencies), count)
+        centres = np.array([p.currencies[c][0] for c in self.currencies])[currency_index]
+        volatility = np.array([p.currencies[c][1] for c in self.currencies])[currency_index]
+        prices = np.round(centres * np.exp(volatility * self.rng.standard_normal(count)), 2)
+        # Order sizes are drawn as notional value, then converted to units at the offer's price
+        min_notional = self.rng.lognormal(np.log(100), 0.8, count)
+        min_amount = np.round(min_notional / prices, 6)
+        min_amount = np.maximum(min_amount, 1e-6)
+        max_amount = np.round(min_amount * (1 + self.rng.lognormal(np.log(20), 1.0, count)), 6)
+
+        if p.seller_concentration > 0:
+            sellers = self.rng.choice(user_ids, count, p=zipf_weights(len(user_ids), p.seller_concentration, self.rng))
+        else:
+            sellers = self.rng.choice(user_ids, count)
+        created = self.rng.integers(0, self.span_us, count)
+        return Columns(
+            id=self.ids("offers", count),
+            seller_id=sellers,
+            currency=np.array(self.currencies, dtype=object)[currency_index],
+            min_amount=min_amount,
+            max_amount=max_amount,
+            price_per_unit=prices,
+            is_active=self.rng.random(count) < p.active_share,
+            created_at=timestamps(self.start, created),
+            updated_at=timestamps(self.start, created),
+            _created_us=created,
+        )
+
+    def trades(self, offers: Columns, user_ids: np.ndarray) -> Columns:
+        p = self.profile
+        count = p.trades
+        picked = self.rng.integers(0, offers.rows, count)
+        sellers = offers["seller_id"][picked]
+        buyers = self.rng.choice(user_ids, count)
+        if len(user_ids) > 1:
+            # Nobody trades with themselves: move such buyers to the next user
+            clash = buyers == sellers
+            positions = np.searchsorted(user_ids, buyers[clash])
+            buyers[clash] = user_ids[(positions + 1) % len(user_ids)]
+        amounts = offers["min_amount"][picked] + self.rng.random(count) * (
+            offers["max_amount"][picked] - offers["min_amount"][picked]
+        )
+        amounts = np.round(amounts, 6)
+        prices = offers["price_per_unit"][picked]
+        status_index = self.rng.choice(len(TRADE_STATUSES), count, p=np.array(list(TRADE_STATUSES.values())))
+        statuses = np.array(list(TRADE_STATUSES), dtype=object)[status_index]
+        offer_created = offers["_created_us"][picked]
+        created = offer_created + (self.rng.random(count) * (self.span_us - offer_created)).astype(np.int64)
+        # Completed trades settle some minutes after they open
+        completed = status_index == list(TRADE_STATUSES).index(TradeStatus.COMPLETED)
+        settled = np.minimum(created + self.rng.exponential(1_800_000_000, count).astype(np.int64), self.span_us)
+        updated = np.where(completed, settled, created)
+        completed_at = timestamps(self.start, settled)
+        ids = self.ids("trades", count)
+        # Random high bits over the row id, so loads repeated with one seed into one database never collide
+        high_bits = self.rng.integers(0, 2 ** 63, count, dtype=np.int64)
+        return Columns(
+            id=ids,
+            trade_id=[
+                str(uuid.UUID(int=(high << 64) | trade_id)) for high, trade_id in zip(high_bits.tolist(), ids.tolist())
+            ],
+            offer_id=offers["id"][picked],
+            buyer_id=buyers,
+            seller_id=sellers,
+            amount=amounts,
+            price_per_unit=prices,
+            total_price=np.round(amounts * prices, 2),
+            status=statuses,
+            moderator_id=[None] * count,
+            completed_at=[value if done else None for value, done in zip(completed_at, completed.tolist())],
+            created_at=timestamps(self.start, created),
+            updated_at=timestamps(self.start, updated),
+            _created_us=created,
+        )
+
+    def messages(self, trades: Columns) -> Columns:
+        per_trade = self.rng.poisson(self.profile.messages_per_trade, trades.rows)
+        picked = np.repeat(np.arange(trades.rows), per_trade)
+        count = len(picked)
+        # Buyer and seller take turns, each message a few minutes after the previous one
+        turn = group_ranks(picked) if count else np.zeros(0, dtype=np.int64)
+        senders = np.where(turn % 2 == 1, trades["buyer_id"][picked], trades["seller_id"][picked])
+        gaps = self.rng.exponential(300_000_000, count).astype(np.int64)
+        created = np.minimum(trades["_created_us"][picked] + gaps * turn, self.span_us)
+        return Columns(
+            id=self.ids("trade_messages", count),
+            trade_id=trades["id"][picked],
+            sender_id=senders,
+            content=MESSAGES[self.rng.integers(0, len(MESSAGES), count)],
+            created_at=timestamps(self.start, created),
+            updated_at=timestamps(self.start, created),
+        )
+
+    def wallets(self, user_ids: np.ndarray) -> Columns:
+        owners = np.repeat(user_ids, len(self.currencies))
+        currencies = np.tile(np.array(self.currencies, dtype=object), len(user_ids))
+        ids = self.ids("wallets", len(owners))
+        created = self.rng.integers(0, self.span_us, len(owners))
+        return Columns(
+            id=ids,
+            user_id=owners,
+            currency=currencies,
+            wallet_address=[f"gen-{wallet_id}" for wallet_id in ids.tolist()],
+            is_escrow=np.zeros(len(owners), dtype=bool),
+            created_at=timestamps(self.start, created),
+            updated_at=timestamps(self.start, created),
+        )
+
+    def ledger(self, wallets: Columns) -> Tuple[Columns, Columns, Columns]:
+        """Generate transactions with their postings and snapshots, and set wallet balances.
+
+        Each wallet's deposits are posted before its withdrawals, and the
+        withdrawals are scaled to the deposits, so no running balance goes
+        negative.
+        """
+        p = self.profile
+        scales = np.array([minor_units(c) for c in wallets["currency"].tolist()], dtype=np.int64)
+        per_wallet = self.rng.poisson(p.transactions_per_wallet, wallets.rows)
+        wallet_index = np.repeat(np.arange(wallets.rows), per_wallet)
+        count = len(wallet_index)
+        withdrawal = self.rng.random(count) < p.withdrawal_share
+        # Sizes in units of the currency, from notional value at the centre price
+        centre = np.array([p.currencies.get(c, (1.0, 0))[0] for c in wallets["currency"].tolist()])
+        units = self.rng.lognormal(np.log(200), 1.0, count) / centre[wallet_index]
+        amount_minor = np.maximum(1, np.round(units * scales[wallet_index])).astype(np.int64)
+
+        deposits = np.bincount(wallet_index, weights=np.where(withdrawal, 0, amount_minor), minlength=wallets.rows)
+        withdrawals = np.bincount(wallet_index, weights=np.where(withdrawal, amount_minor, 0), minlength=wallets.rows)
+        # A wallet with no deposits cannot withdraw; otherwise scale withdrawals down to what was deposited
+        withdrawal &= deposits[wallet_index] > 0
+        ratio = np.where(withdrawals > deposits, deposits / np.maximum(withdrawals, 1), 1.0)
+        amount_minor = np.where(
+            withdrawal, np.maximum(1, np.floor(amount_minor * ratio[wallet_index])), amount_minor
+        ).astype(np.int64)
+        signed = np.where(withdrawal, -amount_minor, amount_minor)
+
+        # Deposits first within each wallet; timestamps ascend with the posting sequence
+        times = self.rng.integers(0, self.span_us, count)
+        order = np.lexsort((times, withdrawal, wallet_index))
+        ordered_times = times[np.lexsort((times, wallet_index))]
+        wallet_index, withdrawal = wallet_index[order], withdrawal[order]
+        amount_minor, signed = amount_minor[order], signed[order]
+        sequence = group_ranks(wallet_index) if count else np.zeros(0, dtype=np.int64)
+        running = np.cumsum(signed)
+        running -= np.repeat(np.r_[0, running][np.r_[0, np.cumsum(per_wallet)][:-1]], per_wallet)
+
+        created = timestamps(self.start, ordered_times)
+        transaction_ids = self.ids("transactions", count)
+        wallet_ids = wallets["id"][wallet_index]
+        transactions = Columns(
+            id=transaction_ids,
+            wallet_id=wallet_ids,
+            amount=amount_minor / scales[wallet_index],
+            transaction_type=np.where(withdrawal, "withdrawal", "deposit").astype(object),
+            status=["completed"] * count,
+            reference_id=[f"gen-{transaction_id}" for transaction_id in transaction_ids.tolist()],
+            created_at=created,
+            updated_at=created,
+        )
+        postings = Columns(
+            id=self.ids("ledger_postings", count),
+            wallet_id=wallet_ids,
+            transaction_id=transaction_ids,
+            sequence=sequence,
+            amount_minor=signed,
+            created_at=created,
+        )
+        snapshot = (sequence % LEDGER_SNAPSHOT_INTERVAL == 0) if LEDGER_SNAPSHOT_INTERVAL > 0 else np.zeros(count, bool)
+        snapshot_rows = np.flatnonzero(snapshot)
+        snapshots = Columns(
+            id=self.ids("balance_snapshots", len(snapshot_rows)),
+            wallet_id=wallet_ids[snapshot_rows],
+            sequence=sequence[snapshot_rows],
+            balance_minor=running[snapshot_rows],
+            created_at=[created[i] for i in snapshot_rows.tolist()],
+        )
+
+        balance_minor = np.bincount(wallet_index, weights=signed, minlength=wallets.rows).astype(np.int64)
+        wallets["balance_minor"] = balance_minor
+        wallets["balance"] = balance_minor / scales
+        wallets["posting_sequence"] = per_wallet.astype(np.int64)
+        return transactions, postings, snapshots
+
+
+def current_offsets(connection: Connection) -> Dict[str, int]:
+    """Highest id in use per table, so generated rows never collide with existing ones."""
+    offsets = {}
+    for model in (User, Wallet, Offer, Trade, TradeMessage, Transaction, LedgerPosting, BalanceSnapshot):
+        offsets[model.__tablename__] = connection.execute(select(func.coalesce(func.max(model.id), 0))).scalar_one()
+    return offsets
+
+
+def bulk_insert(connection: Connection, model: Any, columns: Columns, batch_size: int) -> int:
+    """executemany core INSERTs of the columns, batch_size rows at a time."""
+    names = [name for name in columns if not name.startswith("_")]
+    values = [
+        columns[name].tolist() if isinstance(columns[name], np.ndarray) else list(columns[name])
+        for name in names
+    ]
+    rows = list(zip(*values))
+    table = model.__table__
+    for start in range(0, len(rows), batch_size):
+        connection.execute(table.insert(), [dict(zip(names, row)) for row in rows[start:start + batch_size]])
+    return len(rows)
+
+
+def fast_load_settings(connection: Connection) -> None:
+    """Trade durability for speed while loading; the data can always be regenerated."""
+    if connection.dialect.name == "sqlite":
+        for pragma in ("synchronous = OFF", "temp_store = MEMORY", "cache_size = -262144"):
+            connection.exec_driver_sql(f"PRAGMA {pragma}")
+    elif connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("SET LOCAL synchronous_commit = off")
+
+
+def generate(engine: Engine, profile: Profile, log: Any = print) -> Dict[str, int]:
+    """Generate and load a dataset, returning the rows written per table."""
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        offsets = current_offsets(connection)
+    generator = Generator(profile, offsets)
+
+    users = generator.users()
+    offers = generator.offers(users["id"])
+    trades = generator.trades(offers, users["id"])
+    messages = generator.messages(trades)
+    wallets = generator.wallets(users["id"])
+    transactions, postings, snapshots = generator.ledger(wallets)
+    log(f"generated in {time.perf_counter() - started:.1f}s")
+
+    tables = [
+        (User, users), (Wallet, wallets), (Offer, offers), (Trade, trades), (TradeMessage, messages),
+        (Transaction, transactions), (LedgerPosting, postings), (BalanceSnapshot, snapshots),
+    ]
+    written = {}
+    with engine.begin() as connection:
+        fast_load_settings(connection)
+        # Build each index once over the loaded rows instead of updating it per insert
+        indexes = [index for model, _ in tables for index in model.__table__.indexes]
+        for index in indexes:
+            index.drop(connection, checkfirst=True)
+        for model, columns in tables:
+            table_started = time.perf_counter()
+            written[model.__tablename__] = count = bulk_insert(connection, model, columns, profile.batch_size)
+            elapsed = time.perf_counter() - table_started
+            log(f"{model.__tablename__:<18} {count:>10,} rows  {elapsed:>7.1f}s  {count / max(elapsed, 1e-9):>12,.0f} rows/s")
+        index_started = time.perf_counter()
+        for index in indexes:
+            index.create(connection)
+        log(f"rebuilt {len(indexes)} indexes in {time.perf_counter() - index_started:.1f}s")
+        connection.exec_driver_sql("ANALYZE")
+
+        candles_started = time.perf_counter()
+        settled = [value for value in trades["completed_at"] if value is not None]
+        folded = market_data.rebuild(connection, since=min(settled)) if settled else 0
+        log(f"rebuilt candles from {folded:,} completed trades in {time.perf_counter() - candles_started:.1f}s")
+
+    total = sum(written.values())
+    elapsed = time.perf_counter() - started
+    log(f"total {total:,} rows in {elapsed:.1f}s ({total / elapsed * 60:,.0f} rows/min)")
+    return written
+
+
+def parse_currency(value: str) -> Tuple[str, Tuple[float, float]]:
+    currency, price, volatility = value.split(":")
+    return currency.upper(), (float(price), float(volatility))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default=SQLALCHEMY_DATABASE_URL)
+    parser.add_argument("--users", type=int, default=Profile.users)
+    parser.add_argument("--offers", type=int, default=Profile.offers)
+    parser.add_argument("--trades", type=int, default=Profile.trades)
+    parser.add_argument("--messages-per-trade", type=float, default=Profile.messages_per_trade)
+    parser.add_argument("--transactions-per-wallet", type=float, default=Profile.transactions_per_wallet)
+    parser.add_argument("--currency", action="append", type=parse_currency, metavar="CODE:PRICE:VOLATILITY",
+                        help="price curve per currency; repeat for several (default BTC, ETH, USDT)")
+    parser.add_argument("--seller-concentration", type=float, default=Profile.seller_concentration,
+                        help="Zipf exponent of offers per seller; 0 for uniform")
+    parser.add_argument("--active-share", type=float, default=Profile.active_share)
+    parser.add_argument("--withdrawal-share", type=float, default=Profile.withdrawal_share)
+    parser.add_argument("--days", type=int, default=Profile.days, help="history spread over this many days")
+    parser.add_argument("--password", default=Profile.password, help="password of every generated user")
+    parser.add_argument("--seed", type=int, default=Profile.seed)
+    parser.add_argument("--batch-size", type=int, default=Profile.batch_size)
+    args = parser.parse_args()
+
+    profile = Profile(
+        users=args.users, offers=args.offers, trades=args.trades,
+        messages_per_trade=args.messages_per_trade, transactions_per_wallet=args.transactions_per_wallet,
+        seller_concentration=args.seller_concentration, active_share=args.active_share,
+        withdrawal_share=args.withdrawal_share, days=args.days, password=args.password,
+        seed=args.seed, batch_size=args.batch_size,
+    )
+    if args.currency:
+        profile.currencies = dict(args.currency)
+    if profile.users < 1 or (profile.trades and not profile.offers):
+        sys.exit("need at least one user, and offers to trade against")
+
+    engine = build_engine(args.database_url)
+    run_migrations(engine)
+    generate(engine, profile)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
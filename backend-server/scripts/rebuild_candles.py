@@ -0,0 +1,38 @@
+"""
+Rebuild market candles from completed trades
+
+Candles are normally kept current as trades complete. Run this after
+importing trades, after the 0004 migration backfills completion times, or
+to repair a range after trades were moved out of COMPLETED.
+
+Run from backend-server/:
+    python -m scripts.rebuild_candles
+    python -m scripts.rebuild_candles --currency BTC --since 2024-06-01
+"""
+
+import argparse
+import time
+from datetime import datetime
+from app.core.market_data import MARKET_REBUILD_BATCH_SIZE, rebuild
+from app.database.engine import SQLALCHEMY_DATABASE_URL, build_engine
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default=SQLALCHEMY_DATABASE_URL)
+    parser.add_argument("--currency", action="append", help="currency to rebuild; repeat for several (default all)")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="only rebuild from the start of this day onwards (default everything)")
+    parser.add_argument("--batch-size", type=int, default=MARKET_REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    engine = build_engine(args.database_url)
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        folded = rebuild(connection, currencies=args.currency, since=args.since, batch_size=args.batch_size)
+    engine.dispose()
+    print(f"rebuilt candles from {folded:,} completed trades in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
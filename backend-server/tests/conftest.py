@@ -0,0 +1,67 @@
+import os
+import tempfile
+import pytest
+
+# Point the app at a scratch database before anything imports it
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ["EXPIRY_ENABLED"] = "false"
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["PROFILER_HEADER_ENABLED"] = "true"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    """One running app for the whole session; startup migrates the scratch database."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def client(app_client):
+    """The running app, emptied of every row and everything cached from them."""
+    from app.core import security
+    from app.core.backends import backend
+    from app.core.order_book import order_book
+    from app.core.response_cache import response_cache
+    from app.database import SessionLocal, engine
+    from app.models.base import Base
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    with SessionLocal() as db:
+        order_book.load(db)
+    response_cache.clear()
+    security.claims_cache.clear()
+    security.principal_cache.clear()
+    # Idempotency keys and login counters live in the default in-process backend
+    backend.broker._values.clear()
+    return app_client
+
+
+@pytest.fixture
+def make_user(client):
+    """Create a user directly in the database and return it with bearer auth headers."""
+    from app.core import security
+    from app.database import SessionLocal
+    from app.models import models
+
+    def make(name, role=None):
+        with SessionLocal() as db:
+            user = models.User(email=f"{name}@example.com", username=name, hashed_password="x")
+            if role is not None:
+                user.role = role
+            db.add(user)
+            db.commit()
+            db.refresh(user)
+            db.expunge(user)
+        token = security.create_access_token({"sub": user.email})
+        return user, {"Authorization": f"Bearer {token}"}
+
+    return make
@@ -0,0 +1,132 @@
+import asyncio
+import fakeredis
+import pytest
+from fastapi import HTTPException
+from app.core import security
+from app.core.backends import MemoryBackend, MemoryBroker
+from app.core.backends.redis import RedisBackend
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def memory_pair():
+    broker = MemoryBroker(1000)
+    return MemoryBackend(broker), MemoryBackend(broker)
+
+
+def redis_pair():
+    # Two clients on one fake server, like two workers on one Redis
+    server = fakeredis.FakeServer()
+    return tuple(
+        RedisBackend(None, "test:", 100, client=fakeredis.aioredis.FakeRedis(server=server))
+        for _ in range(2)
+    )
+
+
+@pytest.fixture(params=[memory_pair, redis_pair], ids=["memory", "redis"])
+async def backends(request):
+    pair = request.param()
+    for backend in pair:
+        await backend.start()
+    yield pair
+    for backend in pair:
+        await backend.close()
+
+
+async def eventually(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+async def test_set_get_delete(backends):
+    first, second = backends
+    assert await first.get("key") is None
+    assert await first.set("key", b"value")
+    assert await second.get("key") == b"value"
+    await second.delete("key")
+    assert await first.get("key") is None
+
+
+async def test_values_expire_after_their_ttl(backends):
+    first, second = backends
+    await first.set("short", b"1", ttl=0.5)
+    await first.set("long", b"2", ttl=60)
+    assert await second.get("short") == b"1"
+    await asyncio.sleep(0.6)
+    assert await second.get("short") is None
+    assert await second.get("long") == b"2"
+
+
+async def test_only_if_absent_keeps_the_first_value(backends):
+    first, second = backends
+    assert await first.set("claim", b"first", only_if_absent=True)
+    assert not await second.set("claim", b"second", only_if_absent=True)
+    assert await second.get("claim") == b"first"
+    await first.delete("claim")
+    assert await second.set("claim", b"second", only_if_absent=True)
+
+
+async def test_concurrent_increments_are_never_lost(backends):
+    first, second = backends
+    results = await asyncio.gather(*(
+        backend.incr("counter") for _ in range(50) for backend in backends
+    ))
+    assert sorted(results) == list(range(1, 101))
+    assert await first.incr("counter", 5) == 105
+    assert await second.get("counter") == b"105"
+
+
+async def test_counter_with_ttl_restarts_after_expiry(backends):
+    first, second = backends
+    assert await first.incr("window", ttl=0.05) == 1
+    assert await second.incr("window", ttl=0.05) == 2
+    await asyncio.sleep(0.1)
+    assert await first.incr("window", ttl=0.05) == 1
+
+
+async def test_messages_reach_peers_but_not_the_publisher(backends):
+    first, second = backends
+    sent, received = [], []
+    first.subscribe("channel", sent.append)
+    second.subscribe("channel", received.append)
+    first.publish("channel", {"offer_id": 1})
+    first.publish("channel", [2, 3])
+    await eventually(lambda: len(received) == 2)
+    assert received == [{"offer_id": 1}, [2, 3]]
+    assert sent == []
+
+
+async def test_messages_only_reach_their_channel(backends):
+    first, second = backends
+    received = []
+    second.subscribe("wanted", received.append)
+    first.publish("other", "ignored")
+    first.publish("wanted", "delivered")
+    await eventually(lambda: received)
+    assert received == ["delivered"]
+
+
+async def test_login_attempts_are_limited_per_window(monkeypatch):
+    monkeypatch.setattr(security, "backend", MemoryBackend(MemoryBroker(100)))
+    monkeypatch.setattr(security, "LOGIN_ATTEMPTS_PER_WINDOW", 2)
+    await security.check_login_rate("a@example.com")
+    await security.check_login_rate("A@example.com")
+    with pytest.raises(HTTPException) as exc_info:
+        await security.check_login_rate("a@example.com")
+    assert exc_info.value.status_code == 429
+    # Other accounts have their own counters
+    await security.check_login_rate("b@example.com")
+
+
+async def test_login_attempts_are_not_limited_by_default(monkeypatch):
+    monkeypatch.setattr(security, "backend", MemoryBackend(MemoryBroker(100)))
+    for _ in range(20):
+        await security.check_login_rate("a@example.com")
+    assert await security.backend.get("login:a@example.com") is None
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from datetime import datetime
+import pytest
+from app.core.book_feed import BookFeed, book_feed, channel
+from app.core.order_book import BookEntry, OrderBook
+from app.core.realtime import ChannelHub, pump
+
+
+def entry(offer_id, price, currency="BTC", active=True):
+    return BookEntry(id=offer_id, seller_id=1, currency=currency, min_amount=0.1, max_amount=1.0,
+                     price_per_unit=price, is_active=active, created_at=datetime(2024, 1, 1), version=1)
+
+
+@pytest.fixture
+def feed():
+    # The tick task is never started; tests flush by hand
+    return BookFeed(OrderBook(), tick=60)
+
+
+def frames(subscription):
+    queued = []
+    while not subscription.queue.empty():
+        queued.append(subscription.queue.get_nowait())
+    return queued
+
+
+def changes(frame):
+    return [(change["op"], change["id"], change.get("offer", {}).get("price_per_unit")) for change in frame["changes"]]
+
+
+def test_a_tick_sends_each_offer_once_in_its_final_state(feed):
+    subscription = feed.hub.subscribe(channel("BTC"))
+    feed.book.upsert(entry(1, 100))
+    feed.book.upsert(entry(1, 101))
+    feed.book.upsert(entry(2, 100))
+    feed.book.upsert(entry(2, 100, active=False))
+    feed.book.upsert(entry(3, 100, currency="ETH"))
+    feed.flush()
+    [frame] = frames(subscription)
+    assert (frame["type"], frame["currency"], frame["seq"]) == ("delta", "BTC", 1)
+    # Offer 2 came and went within the tick, so subscribers never hear of it
+    assert changes(frame) == [("add", 1, 101)]
+
+
+def test_later_ticks_report_updates_and_removals(feed):
+    subscription = feed.hub.subscribe(channel("BTC"))
+    feed.book.upsert(entry(1, 100))
+    feed.book.upsert(entry(2, 100))
+    feed.flush()
+    feed.book.remove(1)
+    feed.book.upsert(entry(1, 102))
+    feed.book.upsert(entry(2, 105))
+    feed.book.upsert(entry(2, 106))
+    feed.flush()
+    feed.book.remove(2)
+    feed.flush()
+    feed.flush()
+    first, second, third = frames(subscription)
+    assert [frame["seq"] for frame in (first, second, third)] == [1, 2, 3]
+    assert changes(second) == [("update", 1, 102), ("update", 2, 106)]
+    assert changes(third) == [("remove", 2, None)]
+
+
+def test_snapshot_carries_the_seq_it_includes(feed):
+    subscription = feed.hub.subscribe(channel("BTC"))
+    feed.book.upsert(entry(1, 101))
+    feed.book.upsert(entry(2, 100))
+    feed.flush()
+    snapshot = feed.snapshot("BTC")
+    assert (snapshot["type"], snapshot["seq"]) == ("snapshot", frames(subscription)[0]["seq"])
+    assert [offer["id"] for offer in snapshot["offers"]] == [2, 1]
+
+
+def test_currencies_without_subscribers_send_nothing(feed):
+    feed.book.upsert(entry(1, 100))
+    feed.flush()
+    assert feed.snapshot("BTC")["seq"] == 0
+    subscription = feed.hub.subscribe(channel("BTC"))
+    feed.book.upsert(entry(2, 100))
+    feed.flush()
+    assert [frame["seq"] for frame in frames(subscription)] == [1]
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send_json(self, frame):
+        self.sent.append(frame)
+
+    async def receive_text(self):
+        await asyncio.Event().wait()
+
+    async def close(self, code):
+        self.closed = code
+
+
+@pytest.mark.anyio
+async def test_a_slow_subscriber_is_resynced_from_a_snapshot(feed):
+    feed.hub = ChannelHub(queue_size=2)
+    websocket = FakeWebSocket()
+    subscription = feed.hub.subscribe(channel("BTC"))
+
+    async def resync():
+        await websocket.send_json(feed.snapshot("BTC"))
+
+    task = asyncio.ensure_future(pump(websocket, subscription, lambda frame: frame, resync=resync))
+    # Four ticks land before the pump runs, overflowing its queue of two
+    for price in range(100, 104):
+        feed.book.upsert(entry(price, price))
+        feed.flush()
+    await asyncio.sleep(0.01)
+    feed.book.upsert(entry(1, 99))
+    feed.flush()
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    snapshot, delta = websocket.sent
+    assert (snapshot["type"], snapshot["seq"], len(snapshot["offers"])) == ("snapshot", 4, 4)
+    assert (delta["type"], delta["seq"], changes(delta)) == ("delta", 5, [("add", 1, 99)])
+    assert websocket.closed is None
+
+
+def test_websocket_sends_a_snapshot_then_deltas(client, make_user):
+    _, headers = make_user("seller")
+    first = client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": 100,
+    }, headers=headers).json()
+    # Let the tick holding the first offer pass, or its delta would repeat what the snapshot has
+    time.sleep(book_feed.tick * 2)
+    with client.websocket_connect("/api/offers/ws/BTC") as websocket:
+        snapshot = websocket.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert [offer["id"] for offer in snapshot["offers"]] == [first["id"]]
+        second = client.post("/api/offers/", json={
+            "currency": "BTC", "min_amount": 0.1, "max_amount": 2, "price_per_unit": 99,
+        }, headers=headers).json()
+        delta = websocket.receive_json()
+        assert delta["type"] == "delta" and delta["seq"] > snapshot["seq"]
+        assert [(change["op"], change["offer"]["id"]) for change in delta["changes"]] == [("add", second["id"])]
@@ -0,0 +1,124 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from app.core.concurrency import check_if_match
+from app.database import SessionLocal, async_engine
+from app.models import models
+
+
+@pytest.mark.parametrize("if_match", [None, "*", '"3"', '"2", "3"', '"2","3"', '"2", *'])
+def test_if_match_accepts_the_current_version(if_match):
+    check_if_match(if_match, 3, "Offer")
+
+
+@pytest.mark.parametrize("if_match", ['"2"', 'W/"3"', '"2", W/"3"', '3', ""])
+def test_if_match_refuses_other_and_weak_tags(if_match):
+    with pytest.raises(HTTPException) as exc_info:
+        check_if_match(if_match, 3, "Offer")
+    assert exc_info.value.status_code == 409 and exc_info.value.headers == {"ETag": '"3"'}
+
+
+@pytest.fixture
+def parties(make_user):
+    return make_user("seller")[1], make_user("buyer")[1]
+
+
+@pytest.fixture
+def offer(client, parties):
+    seller, _ = parties
+    return client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": 100,
+    }, headers=seller).json()
+
+
+@pytest.fixture
+def trade(client, parties, offer):
+    _, buyer = parties
+    return client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 0.5}, headers=buyer).json()
+
+
+def test_offer_updates_check_if_match(client, parties, offer):
+    seller, _ = parties
+    url = f"/api/offers/{offer['id']}"
+    stale = client.put(url, json={"price_per_unit": 101}, headers={**seller, "If-Match": '"0"'})
+    assert stale.status_code == 409 and stale.headers["etag"] == '"1"'
+    updated = client.put(url, json={"price_per_unit": 101}, headers={**seller, "If-Match": '"0", "1"'})
+    assert updated.status_code == 200 and updated.headers["etag"] == '"2"'
+    assert client.put(url, json={"price_per_unit": 102}, headers={**seller, "If-Match": "*"}).status_code == 200
+    assert client.put(url, json={"price_per_unit": 103}, headers={**seller, "If-Match": 'W/"3"'}).status_code == 409
+
+
+def test_trade_updates_check_if_match(client, parties, trade):
+    _, buyer = parties
+    url = f"/api/trades/{trade['trade_id']}"
+    current = client.get(url, headers=buyer).headers["etag"]
+    stale = client.put(url, json={"status": "in_progress"}, headers={**buyer, "If-Match": '"99"'})
+    assert stale.status_code == 409 and stale.headers["etag"] == current
+    updated = client.put(url, json={"status": "in_progress"}, headers={**buyer, "If-Match": current})
+    assert updated.status_code == 200 and updated.headers["etag"] != current
+
+
+def test_trades_on_a_repriced_offer_are_refused(client, parties, offer):
+    seller, buyer = parties
+    client.put(f"/api/offers/{offer['id']}", json={"price_per_unit": 150}, headers=seller)
+    refused = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 0.5},
+                          headers={**buyer, "If-Match": '"1"'})
+    assert refused.status_code == 409 and refused.headers["etag"] == '"2"'
+    accepted = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 0.5},
+                           headers={**buyer, "If-Match": '"2"'})
+    assert accepted.status_code == 200 and accepted.json()["price_per_unit"] == 150
+
+
+@pytest.fixture
+def concurrent_write():
+    """Bumps a row's version just before the request's UPDATE of its table, as a concurrent commit would."""
+    injected = []
+
+    def arm(table, row_id):
+        def race(connection, cursor, statement, parameters, context, executemany):
+            if statement.startswith(f"UPDATE {table} ") and not injected:
+                injected.append(True)
+                connection.exec_driver_sql(f"UPDATE {table} SET version = version + 1 WHERE id = {row_id}")
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", race)
+        disarms.append(race)
+
+    disarms = []
+    yield arm
+    for race in disarms:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", race)
+    assert injected
+
+
+def version(model, row_id):
+    with SessionLocal() as db:
+        return db.get(model, row_id).version
+
+
+def test_a_concurrent_offer_write_is_a_409(client, parties, offer, concurrent_write):
+    seller, _ = parties
+    concurrent_write("offers", offer["id"])
+    response = client.put(f"/api/offers/{offer['id']}", json={"price_per_unit": 101}, headers=seller)
+    assert response.status_code == 409 and "changed by another request" in response.json()["detail"]
+    with SessionLocal() as db:
+        assert db.get(models.Offer, offer["id"]).price_per_unit == 100
+
+
+def test_a_concurrent_trade_write_is_a_409(client, parties, trade, concurrent_write):
+    _, buyer = parties
+    before = version(models.Trade, trade["id"])
+    concurrent_write("trades", trade["id"])
+    response = client.put(f"/api/trades/{trade['trade_id']}", json={"status": "in_progress"}, headers=buyer)
+    assert response.status_code == 409
+    # Rolled back with the request, injected bump included
+    assert version(models.Trade, trade["id"]) == before
+
+
+def test_a_trade_on_an_offer_changed_while_reserving_is_a_409(client, parties, offer, concurrent_write):
+    _, buyer = parties
+    concurrent_write("offers", offer["id"])
+    response = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 0.5}, headers=buyer)
+    assert response.status_code == 409
+    with SessionLocal() as db:
+        assert db.query(models.Trade).count() == 0
+        assert db.get(models.Offer, offer["id"]).max_amount == 1
@@ -0,0 +1,97 @@
+import random
+from dataclasses import replace
+from datetime import datetime
+import numpy as np
+import pytest
+import ujson
+from app.core.depth import BookArrays, MarketDepth
+from app.core.market_data import LastPrices
+from app.core.order_book import BookEntry, OrderBook
+
+
+def entry(offer_id, price, amount=1.0, active=True):
+    return BookEntry(id=offer_id, seller_id=1, currency="BTC", min_amount=0.1, max_amount=amount,
+                     price_per_unit=price, is_active=active, created_at=datetime(2024, 1, 1), version=1)
+
+
+@pytest.fixture
+def depth():
+    return MarketDepth(OrderBook(), LastPrices())
+
+
+def fresh(depth):
+    live = depth.book.book("BTC")
+    return BookArrays.from_entries(live, 0, list(live.asks()))
+
+
+def assert_matches_a_fresh_build(depth):
+    patched, rebuilt = depth.arrays("BTC"), fresh(depth)
+    assert patched.ids.tolist() == rebuilt.ids.tolist()
+    assert np.array_equal(patched.prices, rebuilt.prices)
+    assert np.array_equal(patched.amounts, rebuilt.amounts)
+
+
+def test_several_adds_are_inserted_in_price_order(depth):
+    depth.book.upsert(entry(1, 200))
+    depth.arrays("BTC")
+    for offer_id, price in ((2, 500), (3, 100), (4, 300), (5, 1000), (6, 200)):
+        depth.book.upsert(entry(offer_id, price))
+    assert depth.arrays("BTC").prices.tolist() == [100, 200, 200, 300, 500, 1000]
+    assert_matches_a_fresh_build(depth)
+
+
+def test_offers_at_an_existing_price_keep_id_order(depth):
+    for offer_id in (2, 4, 6):
+        depth.book.upsert(entry(offer_id, 100))
+    depth.arrays("BTC")
+    # A repriced offer keeps its id, so it can land before offers already at its new price
+    depth.book.upsert(entry(1, 100))
+    depth.book.upsert(entry(5, 100))
+    depth.book.upsert(entry(7, 99))
+    assert depth.arrays("BTC").ids.tolist() == [7, 1, 2, 4, 5, 6]
+    assert_matches_a_fresh_build(depth)
+
+
+def test_mixed_changes_match_a_fresh_build(depth):
+    rng = random.Random(7)
+    offers = {}
+    for offer_id in range(1, 41):
+        offers[offer_id] = entry(offer_id, rng.choice([99, 100, 101, 105, 110]), rng.uniform(0.1, 5))
+        depth.book.upsert(offers[offer_id])
+    depth.arrays("BTC")
+    next_id = 41
+    for _ in range(30):
+        for _ in range(rng.randint(1, 8)):
+            action = rng.random()
+            if action < 0.3 or not offers:
+                offers[next_id] = entry(next_id, rng.choice([98, 100, 102, 105, 120]), rng.uniform(0.1, 5))
+                depth.book.upsert(offers[next_id])
+                next_id += 1
+            elif action < 0.5:
+                offer_id = rng.choice(list(offers))
+                del offers[offer_id]
+                depth.book.remove(offer_id)
+            elif action < 0.6:
+                offer_id = rng.choice(list(offers))
+                depth.book.upsert(replace(offers.pop(offer_id), is_active=False))
+            elif action < 0.8:
+                offer_id = rng.choice(list(offers))
+                offers[offer_id] = replace(offers[offer_id], max_amount=rng.uniform(0.1, 5))
+                depth.book.upsert(offers[offer_id])
+            else:
+                offer_id = rng.choice(list(offers))
+                offers[offer_id] = replace(offers[offer_id], price_per_unit=rng.choice([97, 100, 103, 105]))
+                depth.book.upsert(offers[offer_id])
+        assert_matches_a_fresh_build(depth)
+
+
+def test_depth_levels_follow_patched_arrays(depth):
+    depth.book.upsert(entry(1, 100, 1))
+    assert ujson.loads(depth.depth("BTC", step=10))["total_offers"] == 1
+    for offer_id, price in ((2, 125), (3, 101), (4, 119)):
+        depth.book.upsert(entry(offer_id, price, 2))
+    body = ujson.loads(depth.depth("BTC", step=10))
+    assert [(level["price"], level["offers"], level["amount"]) for level in body["levels"]] == [
+        (100, 1, 1), (110, 1, 2), (120, 1, 2), (130, 1, 2),
+    ]
+    assert body["levels"][-1]["cumulative_amount"] == 7
@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import exc
+from app.database.engine import (
+    InstrumentedAsyncQueuePool, InstrumentedQueuePool, _engines, async_database_url, build_async_engine,
+    build_engine, pool_stats,
+)
+
+
+@pytest.fixture
+def engines():
+    """Reports only the test's own engines, restoring the app's afterwards."""
+    saved = dict(_engines)
+    _engines.clear()
+    yield
+    _engines.clear()
+    _engines.update(saved)
+
+
+@pytest.mark.parametrize("url, async_url", [
+    ("sqlite:///./app.db", "sqlite+aiosqlite:///./app.db"),
+    ("postgresql://u:secret@db/app", "postgresql+asyncpg://u:secret@db/app"),
+    ("postgresql+asyncpg://u@db/app", "postgresql+asyncpg://u@db/app"),
+])
+def test_async_urls_switch_to_the_async_driver(url, async_url):
+    assert async_database_url(url) == async_url
+
+
+def pragmas(connection):
+    return {
+        name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        for name in ("journal_mode", "synchronous", "busy_timeout", "mmap_size")
+    }
+
+
+def test_sqlite_file_connections_get_every_pragma(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    try:
+        with engine.connect() as connection:
+            assert pragmas(connection) == {
+                "journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000, "mmap_size": 256 * 1024 * 1024,
+            }
+        assert isinstance(engine.pool, InstrumentedQueuePool)
+    finally:
+        engine.dispose()
+
+
+def test_in_memory_sqlite_keeps_its_single_connection_pool():
+    engine = build_engine("sqlite://")
+    try:
+        with engine.connect() as connection:
+            settings = pragmas(connection)
+        # No WAL or mmap without a file, but the per-connection pragmas still apply
+        assert (settings["journal_mode"], settings["synchronous"], settings["busy_timeout"]) == ("memory", 1, 5000)
+        assert not isinstance(engine.pool, InstrumentedQueuePool)
+    finally:
+        engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_async_sqlite_connections_get_the_pragmas(tmp_path, engines):
+    engine = build_async_engine(f"sqlite:///{tmp_path / 'app.db'}", name="async")
+    try:
+        async with engine.connect() as connection:
+            assert await connection.run_sync(pragmas) == {
+                "journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000, "mmap_size": 256 * 1024 * 1024,
+            }
+            assert pool_stats()["async"]["checked_out"] == 1
+        stats = pool_stats()["async"]
+        assert (stats["pool"], stats["checked_out"], stats["checkouts"]) == ("InstrumentedAsyncQueuePool", 0, 1)
+        assert isinstance(engine.pool, InstrumentedAsyncQueuePool)
+    finally:
+        await engine.dispose()
+
+
+def test_pool_stats_count_checkouts_saturation_and_timeouts(tmp_path, engines):
+    engine = build_engine(f"sqlite:///{tmp_path / 'app.db'}", name="tight",
+                          pool_size=1, max_overflow=0, pool_timeout=0.05)
+    try:
+        with engine.connect():
+            stats = pool_stats()["tight"]
+            assert (stats["size"], stats["max_overflow"], stats["checked_out"], stats["checkouts"]) == (1, 0, 1, 1)
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+        stats = pool_stats()["tight"]
+        assert (stats["checked_out"], stats["idle"], stats["checkouts"]) == (0, 1, 1)
+        assert (stats["saturated_checkouts"], stats["timeouts"]) == (1, 1)
+        assert stats["wait_seconds_max"] >= 0.05 and stats["wait_seconds_total"] >= stats["wait_seconds_max"]
+
+        # Disposing recreates the pool; the totals carry over to it
+        engine.dispose()
+        with engine.connect():
+            pass
+        stats = pool_stats()["tight"]
+        assert (stats["checked_out"], stats["checkouts"], stats["timeouts"]) == (0, 2, 1)
+    finally:
+        engine.dispose()
+
+
+def test_health_reports_the_app_pools(client):
+    pools = client.get("/health").json()["database_pools"]
+    assert set(pools) >= {"sync", "async"}
+    assert {pool["pool"] for pool in pools.values()} >= {"InstrumentedQueuePool", "InstrumentedAsyncQueuePool"}
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event, select, update
+from app.core.expiry import ExpirySweeper
+from app.core.order_book import order_book
+from app.database import SessionLocal, async_engine
+from app.models import models
+
+pytestmark = pytest.mark.anyio
+
+OLD = datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def sweeper():
+    return ExpirySweeper(async_engine, order_book, interval=60, batch_size=2)
+
+
+@pytest.fixture
+def parties(make_user):
+    return make_user("seller")[1], make_user("buyer")[1]
+
+
+def offer(client, headers, max_amount=1, min_amount=0.1):
+    return client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": min_amount, "max_amount": max_amount, "price_per_unit": 100,
+    }, headers=headers).json()
+
+
+def trade(client, headers, offer_id, amount):
+    return client.post("/api/trades/", json={"offer_id": offer_id, "amount": amount}, headers=headers).json()
+
+
+def age(model, *ids):
+    with SessionLocal() as db:
+        db.execute(update(model).where(model.id.in_(ids)).values(updated_at=OLD))
+        db.commit()
+
+
+def rows(model, *columns):
+    with SessionLocal() as db:
+        return db.execute(select(model.id, *columns).order_by(model.id)).all()
+
+
+@pytest.fixture
+def updates():
+    """Records each UPDATE the sweeper sends, by table."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE"):
+            statements.append(statement.split()[1])
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+async def test_stale_trades_are_cancelled_in_bounded_batches(client, parties, sweeper, updates):
+    seller, buyer = parties
+    created = offer(client, seller, max_amount=10)
+    trades = [trade(client, buyer, created["id"], 1) for _ in range(5)]
+    age(models.Trade, *[item["id"] for item in trades[:4]])
+    cutoff = datetime.utcnow() - timedelta(hours=1)
+    assert await sweeper.expire_trades(models.TradeStatus.PENDING, cutoff) == 4
+    # Two full batches, then an empty one that ends the loop
+    assert updates.count("trades") == 3
+    statuses = [status for _, status in rows(models.Trade, models.Trade.status)]
+    assert statuses == [models.TradeStatus.CANCELLED] * 4 + [models.TradeStatus.PENDING]
+    # The outer UPDATE repeats the staleness test, so a second pass finds nothing
+    assert await sweeper.expire_trades(models.TradeStatus.PENDING, cutoff) == 0
+
+
+async def test_cancelled_trades_release_their_offers(client, parties, sweeper):
+    seller, buyer = parties
+    partial, emptied = offer(client, seller), offer(client, seller)
+    trades = [trade(client, buyer, partial["id"], 0.4), trade(client, buyer, emptied["id"], 1)]
+    assert [entry.id for entry in order_book.search("BTC")] == [partial["id"]]
+    age(models.Trade, *[item["id"] for item in trades])
+    assert await sweeper.expire_trades(models.TradeStatus.PENDING, datetime.utcnow()) == 2
+    assert rows(models.Offer, models.Offer.max_amount, models.Offer.is_active, models.Offer.is_exhausted) == [
+        (partial["id"], 1, True, False), (emptied["id"], 1, True, False),
+    ]
+    # Both offers are back in this worker's book at their new versions
+    assert [(entry.id, entry.max_amount, entry.version) for entry in order_book.search("BTC")] == [
+        (partial["id"], 1, 3), (emptied["id"], 1, 3),
+    ]
+
+
+async def test_stale_offers_leave_the_book_and_stay_out(client, parties, sweeper):
+    seller, buyer = parties
+    offers = [offer(client, seller) for _ in range(3)]
+    reserved = trade(client, buyer, offers[0]["id"], 0.5)
+    age(models.Offer, offers[0]["id"], offers[1]["id"])
+    assert await sweeper.expire_offers(datetime.utcnow() - timedelta(hours=1)) == 2
+    assert [entry.id for entry in order_book.search("BTC")] == [offers[2]["id"]]
+    active = [is_active for _, is_active in rows(models.Offer, models.Offer.is_active)]
+    assert active == [False, False, True]
+    # Cancelling a trade gives the amount back but does not revive an expired offer
+    client.put(f"/api/trades/{reserved['trade_id']}", json={"status": "cancelled"}, headers=buyer)
+    assert rows(models.Offer, models.Offer.max_amount, models.Offer.is_active)[0] == (offers[0]["id"], 1, False)
+    assert [entry.id for entry in order_book.search("BTC")] == [offers[2]["id"]]
+
+
+async def test_sweep_counts_each_kind(client, parties, sweeper):
+    seller, buyer = parties
+    created = offer(client, seller)
+    reserved = trade(client, buyer, created["id"], 0.5)
+    counts = await sweeper.sweep(now=datetime.utcnow() + timedelta(days=365))
+    assert counts == {"trade_pending": 1, "trade_in_progress": 0, "offer": 1}
+    # The trade was cancelled first, so the offer it released still expired
+    assert rows(models.Offer, models.Offer.max_amount, models.Offer.is_active) == [(created["id"], 1, False)]
+    assert rows(models.Trade, models.Trade.status) == [(reserved["id"], models.TradeStatus.CANCELLED)]
@@ -0,0 +1,107 @@
+from collections import defaultdict
+import pytest
+from sqlalchemy import func, inspect, select
+from app.core import market_data
+from app.database.engine import build_engine
+from app.database.migrate import run_migrations
+from app.models import models
+from scripts import generate_data
+from scripts.generate_data import Profile, generate
+
+PROFILE = Profile(users=40, offers=120, trades=300, messages_per_trade=2, transactions_per_wallet=6, batch_size=37)
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    """A database loaded twice by the generator, the second load appending to the first."""
+    engine = build_engine(f"sqlite:///{tmp_path_factory.mktemp('generated') / 'generated.db'}")
+    run_migrations(engine)
+    log = []
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # Small enough that most wallets get snapshots
+        monkeypatch.setattr(generate_data, "LEDGER_SNAPSHOT_INTERVAL", 3)
+        written = [generate(engine, PROFILE, log.append), generate(engine, PROFILE, log.append)]
+    with engine.connect() as connection:
+        yield connection, written, log
+    engine.dispose()
+
+
+def count(connection, model):
+    return connection.execute(select(func.count()).select_from(model)).scalar_one()
+
+
+def test_every_row_written_is_loaded(dataset):
+    connection, written, log = dataset
+    first, second = written
+    assert (first["users"], first["offers"], first["trades"]) == (40, 120, 300)
+    for model in (models.User, models.Wallet, models.Offer, models.Trade, models.TradeMessage,
+                  models.Transaction, models.LedgerPosting, models.BalanceSnapshot):
+        table = model.__tablename__
+        assert count(connection, model) == first[table] + second[table], table
+    assert any("rows/min" in line for line in log)
+
+
+def test_rows_reference_each_other_consistently(dataset):
+    connection, _, _ = dataset
+    offers = {row.id: row for row in connection.execute(select(models.Offer))}
+    users = set(connection.execute(select(models.User.id)).scalars())
+    trades = connection.execute(select(models.Trade)).all()
+    for trade in trades:
+        offer = offers[trade.offer_id]
+        assert trade.seller_id == offer.seller_id and trade.buyer_id in users and trade.buyer_id != trade.seller_id
+        assert offer.min_amount <= trade.amount <= offer.max_amount + 1e-6
+        assert (trade.completed_at is not None) == (trade.status == models.TradeStatus.COMPLETED)
+    participants = {trade.id: {trade.buyer_id, trade.seller_id} for trade in trades}
+    for trade_id, sender_id in connection.execute(select(models.TradeMessage.trade_id, models.TradeMessage.sender_id)):
+        assert sender_id in participants[trade_id]
+    assert {offer.seller_id for offer in offers.values()} <= users
+    assert not any(offer.is_exhausted for offer in offers.values())
+
+
+def test_ledgers_agree_with_balances(dataset):
+    connection, _, _ = dataset
+    postings = defaultdict(list)
+    for wallet_id, sequence, amount, created_at in connection.execute(
+        select(models.LedgerPosting.wallet_id, models.LedgerPosting.sequence, models.LedgerPosting.amount_minor,
+               models.LedgerPosting.created_at).order_by(models.LedgerPosting.wallet_id, models.LedgerPosting.sequence)
+    ):
+        postings[wallet_id].append((sequence, amount, created_at))
+    snapshots = {
+        (wallet_id, sequence): balance
+        for wallet_id, sequence, balance in connection.execute(
+            select(models.BalanceSnapshot.wallet_id, models.BalanceSnapshot.sequence,
+                   models.BalanceSnapshot.balance_minor)
+        )
+    }
+    assert snapshots
+    for wallet in connection.execute(select(models.Wallet)):
+        history = postings.get(wallet.id, [])
+        assert [sequence for sequence, _, _ in history] == list(range(1, len(history) + 1))
+        assert [at for _, _, at in history] == sorted(at for _, _, at in history)
+        running = 0
+        for sequence, amount, _ in history:
+            running += amount
+            assert running >= 0
+            if sequence % 3 == 0:
+                assert snapshots.pop((wallet.id, sequence)) == running
+        assert (wallet.balance_minor, wallet.posting_sequence) == (running, len(history))
+    assert snapshots == {}
+
+
+def test_indexes_are_rebuilt_and_candles_match_the_trades(dataset):
+    connection, _, _ = dataset
+    for model in (models.Offer, models.Trade, models.Wallet):
+        names = {index["name"] for index in inspect(connection).get_indexes(model.__tablename__)}
+        assert {index.name for index in model.__table__.indexes} <= names
+    candles = connection.execute(select(models.MarketCandle).order_by(models.MarketCandle.id)).all()
+    assert sum(candle.trade_count for candle in candles if candle.interval == "1d") == count(
+        connection, select(models.Trade).where(models.Trade.status == models.TradeStatus.COMPLETED).subquery()
+    )
+    with connection.begin_nested() as savepoint:
+        market_data.rebuild(connection)
+        rebuilt = connection.execute(select(models.MarketCandle)).all()
+        savepoint.rollback()
+    key = lambda candle: (candle.currency, candle.interval, candle.bucket_start)
+    assert sorted((key(candle), candle.trade_count, candle.close) for candle in rebuilt) == sorted(
+        (key(candle), candle.trade_count, candle.close) for candle in candles
+    )
@@ -0,0 +1,141 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from fastapi.responses import UJSONResponse
+from sqlalchemy import func, select
+from app.core.backends import MemoryBackend, MemoryBroker
+from app.core.idempotency import REPLAYED_HEADER, IdempotencyStore, fingerprint
+from app.database import SessionLocal
+from app.models import models
+
+pytestmark = pytest.mark.anyio
+
+SCOPE = (1, "create")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def store_on(broker):
+    return IdempotencyStore(MemoryBackend(broker), ttl=60, claim_ttl=60)
+
+
+class Handler:
+    """Counts its runs; each run waits for release when gated."""
+
+    def __init__(self, status_code=200, error=None, gated=False):
+        self.runs = 0
+        self.status_code = status_code
+        self.error = error
+        self.release = asyncio.Event()
+        if not gated:
+            self.release.set()
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return UJSONResponse({"run": self.runs}, status_code=self.status_code, headers={"ETag": f'"{self.runs}"'})
+
+
+@pytest.fixture
+def store():
+    return store_on(MemoryBroker(100))
+
+
+async def test_a_retry_replays_the_first_response(store):
+    handler = Handler()
+    first = await store.run(SCOPE, "key", fingerprint("body"), handler)
+    second = await store.run(SCOPE, "key", fingerprint("body"), handler)
+    assert handler.runs == 1
+    assert (second.status_code, second.body, second.headers["etag"]) == (200, first.body, '"1"')
+    assert second.headers[REPLAYED_HEADER] == "true" and REPLAYED_HEADER not in first.headers
+    # Without a key, or with another key or scope, the handler runs
+    await store.run(SCOPE, None, fingerprint("body"), handler)
+    await store.run(SCOPE, "other", fingerprint("body"), handler)
+    await store.run((2, "create"), "key", fingerprint("body"), handler)
+    assert handler.runs == 4
+
+
+async def test_concurrent_duplicates_wait_for_the_first(store):
+    handler = Handler(gated=True)
+    tasks = [asyncio.ensure_future(store.run(SCOPE, "key", fingerprint("body"), handler)) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    handler.release.set()
+    responses = await asyncio.gather(*tasks)
+    assert handler.runs == 1
+    assert {response.body for response in responses} == {b'{"run":1}'}
+    assert sum(REPLAYED_HEADER in response.headers for response in responses) == 4
+
+
+async def test_a_key_reused_for_another_request_is_a_422(store):
+    handler = Handler(gated=True)
+    running = asyncio.ensure_future(store.run(SCOPE, "key", fingerprint("body"), handler))
+    await asyncio.sleep(0.01)
+    with pytest.raises(HTTPException) as in_flight:
+        await store.run(SCOPE, "key", fingerprint("other body"), handler)
+    handler.release.set()
+    await running
+    with pytest.raises(HTTPException) as stored:
+        await store.run(SCOPE, "key", fingerprint("other body"), handler)
+    assert in_flight.value.status_code == stored.value.status_code == 422
+    assert handler.runs == 1
+
+
+async def test_another_worker_is_refused_while_the_key_is_claimed():
+    broker = MemoryBroker(100)
+    first, second = store_on(broker), store_on(broker)
+    handler = Handler(gated=True)
+    running = asyncio.ensure_future(first.run(SCOPE, "key", fingerprint("body"), handler))
+    await asyncio.sleep(0.01)
+    with pytest.raises(HTTPException) as exc_info:
+        await second.run(SCOPE, "key", fingerprint("body"), handler)
+    assert exc_info.value.status_code == 409 and exc_info.value.headers["Retry-After"] == "1"
+    handler.release.set()
+    await running
+    replayed = await second.run(SCOPE, "key", fingerprint("body"), handler)
+    assert replayed.headers[REPLAYED_HEADER] == "true" and handler.runs == 1
+
+
+async def test_errors_are_shared_then_released(store):
+    handler = Handler(error=HTTPException(status_code=400, detail="Bad"), gated=True)
+    tasks = [asyncio.ensure_future(store.run(SCOPE, "key", fingerprint("body"), handler)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    handler.release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert [result.status_code for result in results] == [400] * 3
+    assert handler.runs == 1
+    # Neither an error nor a server error response is kept, so retries run again
+    handler.error = None
+    handler.status_code = 503
+    assert (await store.run(SCOPE, "key", fingerprint("body"), handler)).status_code == 503
+    handler.status_code = 200
+    response = await store.run(SCOPE, "key", fingerprint("body"), handler)
+    assert handler.runs == 3 and REPLAYED_HEADER not in response.headers
+
+
+async def test_key_length_is_bounded(store):
+    for key in ("", "k" * 256):
+        with pytest.raises(HTTPException) as exc_info:
+            await store.run(SCOPE, key, fingerprint("body"), Handler())
+        assert exc_info.value.status_code == 400
+
+
+def test_transactions_are_created_once_per_key(client, make_user):
+    _, headers = make_user("holder")
+    wallet = client.post("/api/wallets/", json={"currency": "BTC", "wallet_address": "addr"}, headers=headers).json()
+    body = {"amount": 1, "transaction_type": "deposit", "reference_id": "dep-1"}
+    keyed = {**headers, "Idempotency-Key": "abc"}
+    first = client.post(f"/api/wallets/{wallet['id']}/transactions", json=body, headers=keyed)
+    second = client.post(f"/api/wallets/{wallet['id']}/transactions", json=body, headers=keyed)
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json() and second.headers[REPLAYED_HEADER] == "true"
+    changed = client.post(f"/api/wallets/{wallet['id']}/transactions", json={**body, "amount": 2}, headers=keyed)
+    assert changed.status_code == 422
+    # Without the key the repeat is the reference_id conflict it always was
+    assert client.post(f"/api/wallets/{wallet['id']}/transactions", json=body, headers=headers).status_code == 409
+    with SessionLocal() as db:
+        assert db.execute(select(func.count(models.Transaction.id))).scalar_one() == 1
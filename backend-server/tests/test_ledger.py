@@ -0,0 +1,247 @@
+from datetime import datetime
+import pytest
+from alembic import command
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core import ledger
+from app.database import SessionLocal, SQLALCHEMY_DATABASE_URL, async_engine, build_async_engine
+from app.database.engine import build_engine
+from app.database.migrate import alembic_config
+from app.models import models
+
+
+@pytest.mark.parametrize("amount, currency, minor", [
+    (0.1, "BTC", 10_000_000),
+    (1.23456789, "ETH", 123_456_789),
+    (0.000000015, "BTC", 2),  # half to even rounds down to 2
+    (0.000000025, "BTC", 2),
+    (2.5, "usdt", 2_500_000),
+    (1, None, 100_000_000),
+])
+def test_to_minor_rounds_half_to_even(amount, currency, minor):
+    assert ledger.to_minor(amount, currency) == minor
+
+
+def test_minor_units_do_not_drift():
+    total = sum(ledger.to_minor(0.1, "BTC") for _ in range(10))
+    assert ledger.to_major(total, "BTC") == 1.0
+    assert ledger.to_major(ledger.to_minor(0.3, "USDC"), "USDC") == 0.3
+
+
+@pytest.fixture
+def wallet(client, make_user):
+    user, headers = make_user("holder")
+    created = client.post("/api/wallets/", json={"currency": "BTC", "wallet_address": "addr-1"}, headers=headers)
+    return created.json()["id"], headers
+
+
+def transact(client, wallet, reference, amount, transaction_type="deposit"):
+    wallet_id, headers = wallet
+    return client.post(f"/api/wallets/{wallet_id}/transactions", json={
+        "amount": amount, "transaction_type": transaction_type, "reference_id": reference,
+    }, headers=headers)
+
+
+def postings(wallet_id):
+    with SessionLocal() as db:
+        return db.execute(
+            select(models.LedgerPosting.sequence, models.LedgerPosting.amount_minor)
+            .where(models.LedgerPosting.wallet_id == wallet_id)
+            .order_by(models.LedgerPosting.sequence)
+        ).all()
+
+
+def test_postings_keep_an_exact_balance(client, wallet):
+    for i in range(10):
+        assert transact(client, wallet, f"dep-{i}", 0.1).status_code == 200
+    assert transact(client, wallet, "wd", 0.3, "withdrawal").status_code == 200
+    wallet_id, headers = wallet
+    assert client.get(f"/api/wallets/{wallet_id}/balance", headers=headers).json()["balance"] == 0.7
+    assert [sequence for sequence, _ in postings(wallet_id)] == list(range(1, 12))
+    with SessionLocal() as db:
+        assert db.get(models.Wallet, wallet_id).balance_minor == 70_000_000
+
+
+def test_overdraft_and_duplicate_reference_are_rejected(client, wallet):
+    assert transact(client, wallet, "dep", 1).status_code == 200
+    overdraft = transact(client, wallet, "wd", 1.5, "withdrawal")
+    assert overdraft.status_code == 400
+    assert transact(client, wallet, "dep", 2).status_code == 409
+    # Neither failure left a transaction or a posting behind
+    assert postings(wallet[0]) == [(1, 100_000_000)]
+    with SessionLocal() as db:
+        assert db.execute(select(models.Transaction.reference_id)).scalars().all() == ["dep"]
+
+
+def test_snapshots_bound_historical_balances(client, wallet, monkeypatch):
+    monkeypatch.setattr(ledger, "LEDGER_SNAPSHOT_INTERVAL", 3)
+    for i in range(7):
+        transact(client, wallet, f"dep-{i}", i + 1)
+    wallet_id, headers = wallet
+    with SessionLocal() as db:
+        snapshots = db.execute(
+            select(models.BalanceSnapshot.sequence, models.BalanceSnapshot.balance_minor)
+            .where(models.BalanceSnapshot.wallet_id == wallet_id)
+            .order_by(models.BalanceSnapshot.sequence)
+        ).all()
+        times = db.execute(
+            select(models.LedgerPosting.created_at).where(models.LedgerPosting.wallet_id == wallet_id)
+            .order_by(models.LedgerPosting.sequence)
+        ).scalars().all()
+    assert snapshots == [(3, 600_000_000), (6, 2_100_000_000)]
+    for sequence, at in enumerate(times, start=1):
+        balance = client.get(f"/api/wallets/{wallet_id}/balance", params={"at": at.isoformat()}, headers=headers)
+        assert balance.json()["balance"] == sum(range(1, sequence + 1))
+    before = client.get(f"/api/wallets/{wallet_id}/balance", params={"at": datetime(2000, 1, 1).isoformat()},
+                        headers=headers)
+    assert before.json()["balance"] == 0
+
+
+@pytest.mark.anyio
+async def test_post_checks_the_balance_in_the_database_not_the_loaded_row(client, wallet):
+    transact(client, wallet, "dep", 1)
+    engine = build_async_engine(SQLALCHEMY_DATABASE_URL)
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            stale = await db.get(models.Wallet, wallet[0])
+            assert await ledger.post(db, stale, -60_000_000) == (40_000_000, 2)
+            await db.commit()
+            # The loaded row still says 1 BTC; the conditional UPDATE sees 0.4
+            assert stale.balance_minor == 100_000_000
+            with pytest.raises(ledger.InsufficientFunds):
+                await ledger.post(db, stale, -60_000_000)
+            await db.rollback()
+    finally:
+        await engine.dispose()
+    assert postings(wallet[0]) == [(1, 100_000_000), (2, -60_000_000)]
+
+
+@pytest.fixture
+def admin(make_user):
+    return make_user("admin", role=models.UserRole.ADMIN)[1]
+
+
+def batch_item(wallet_id, reference, amount, transaction_type="deposit"):
+    return {"wallet_id": wallet_id, "amount": amount, "transaction_type": transaction_type, "reference_id": reference}
+
+
+def test_batch_replays_items_in_order(client, wallet, admin, monkeypatch):
+    monkeypatch.setattr(ledger, "LEDGER_SNAPSHOT_INTERVAL", 2)
+    wallet_id, headers = wallet
+    transact(client, wallet, "existing", 1)
+    response = client.post("/api/wallets/transactions/batch", json={"items": [
+        batch_item(wallet_id, "a", 0.5, "withdrawal"),
+        batch_item(wallet_id, "b", 0.8, "withdrawal"),  # only 0.5 left at this point
+        batch_item(wallet_id, "c", 2),
+        batch_item(wallet_id, "existing", 1),
+        batch_item(wallet_id, "c", 1),
+        batch_item(9999, "d", 1),
+        batch_item(wallet_id, "e", 0),
+        batch_item(wallet_id, "f", 1, "transfer"),
+        batch_item(wallet_id, "g", 2.4, "withdrawal"),
+    ]}, headers=admin)
+    assert response.status_code == 200
+    body = response.json()
+    assert [(result["status"], result["error"]) for result in body["results"]] == [
+        ("created", None),
+        ("rejected", "Insufficient balance"),
+        ("created", None),
+        ("rejected", "Duplicate reference_id"),
+        ("rejected", "Duplicate reference_id"),
+        ("rejected", "Wallet not found"),
+        ("rejected", "Amount must be positive"),
+        ("created", None),
+        ("created", None),
+    ]
+    assert (body["created"], body["rejected"]) == (4, 5)
+    # One aggregated UPDATE, but a posting per moving item with contiguous sequences
+    assert postings(wallet_id) == [(1, 100_000_000), (2, -50_000_000), (3, 200_000_000), (4, -240_000_000)]
+    with SessionLocal() as db:
+        wallet_row = db.get(models.Wallet, wallet_id)
+        assert (wallet_row.balance_minor, wallet_row.posting_sequence, wallet_row.balance) == (10_000_000, 4, 0.1)
+        assert db.execute(
+            select(models.BalanceSnapshot.sequence, models.BalanceSnapshot.balance_minor)
+            .order_by(models.BalanceSnapshot.sequence)
+        ).all() == [(2, 50_000_000), (4, 10_000_000)]
+    assert client.get(f"/api/wallets/{wallet_id}/balance", headers=headers).json()["balance"] == 0.1
+
+
+def test_batch_needs_an_admin_and_a_bounded_size(client, wallet, admin, monkeypatch):
+    wallet_id, headers = wallet
+    items = [batch_item(wallet_id, f"r{i}", 1) for i in range(3)]
+    assert client.post("/api/wallets/transactions/batch", json={"items": items}, headers=headers).status_code == 403
+    monkeypatch.setattr(ledger, "LEDGER_BATCH_MAX_ITEMS", 2)
+    assert client.post("/api/wallets/transactions/batch", json={"items": items}, headers=admin).status_code == 400
+
+
+def test_batch_reference_inserted_concurrently_is_a_409(client, wallet, admin, monkeypatch):
+    monkeypatch.setattr(ledger, "LEDGER_BATCH_CHUNK_SIZE", 2)
+    wallet_id, _ = wallet
+    injected = []
+
+    # Another writer commits reference "c" after the second chunk checked for duplicates
+    def race(connection, cursor, statement, parameters, context, executemany):
+        # The batch insert is one multi-row statement with flat parameters
+        if statement.startswith("INSERT INTO transactions") and "c" in parameters and not injected:
+            injected.append(True)
+            connection.exec_driver_sql(
+                "INSERT INTO transactions (wallet_id, amount, transaction_type, status, reference_id, created_at) "
+                f"VALUES ({wallet_id}, 1, 'deposit', 'pending', 'c', '2024-01-01')"
+            )
+
+    items = [batch_item(wallet_id, reference, 1) for reference in ("a", "b", "c", "d")]
+    event.listen(async_engine.sync_engine, "before_cursor_execute", race)
+    try:
+        response = client.post("/api/wallets/transactions/batch", json={"items": items}, headers=admin)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", race)
+    assert response.status_code == 409
+    assert "first 2 items were committed" in response.json()["detail"]
+    # The first chunk stayed committed, the injected row rolled back with the second
+    with SessionLocal() as db:
+        assert db.execute(select(models.Transaction.reference_id)).scalars().all() == ["a", "b"]
+
+
+@pytest.mark.anyio
+async def test_migration_opens_the_ledger_with_the_carried_over_balance(tmp_path):
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = build_engine(url)
+    try:
+        with engine.begin() as connection:
+            command.upgrade(alembic_config(connection), "0001")
+            connection.execute(text(
+                "INSERT INTO wallets (id, currency, balance, wallet_address, created_at) VALUES "
+                "(1, 'BTC', 1.5, 'funded', '2024-01-01 00:00:00'), (2, 'BTC', 0, 'empty', '2024-01-01 00:00:00')"
+            ))
+        with engine.begin() as connection:
+            command.upgrade(alembic_config(connection), "head")
+            assert connection.execute(text(
+                "SELECT id, balance_minor, posting_sequence FROM wallets ORDER BY id"
+            )).all() == [(1, 150_000_000, 1), (2, 0, 0)]
+    finally:
+        engine.dispose()
+    legacy = build_async_engine(url)
+    try:
+        async with AsyncSession(legacy) as db:
+            assert await ledger.balance_at(db, 1, datetime(2024, 6, 1)) == 150_000_000
+            assert await ledger.balance_at(db, 1, datetime(2023, 1, 1)) == 0
+            # The next posting follows the opening one
+            wallet = await db.get(models.Wallet, 1)
+            assert await ledger.post(db, wallet, 50_000_000) == (200_000_000, 2)
+    finally:
+        await legacy.dispose()
+
+
+def test_admin_panel_cannot_edit_balances(client, wallet):
+    transact(client, wallet, "dep", 1)
+    wallet_id, _ = wallet
+    with SessionLocal() as db:
+        user_id = db.get(models.Wallet, wallet_id).user_id
+    edited = client.post(f"/admin/wallet/edit/{wallet_id}", data={
+        "user": str(user_id), "currency": "BTC", "wallet_address": "addr-1", "is_escrow": "False",
+        "balance": "1000", "balance_minor": "1000", "save": "Save",
+    }, follow_redirects=False)
+    assert edited.status_code == 302
+    with SessionLocal() as db:
+        edited_wallet = db.get(models.Wallet, wallet_id)
+        assert (edited_wallet.balance, edited_wallet.balance_minor, edited_wallet.posting_sequence) == (1, 100_000_000, 1)
@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app.core import market_data
+from app.core.market_data import aggregate, merge_candles, rebuild
+from app.database import SessionLocal, engine
+from app.database.engine import build_engine
+from app.models import models
+
+T0 = datetime(2024, 1, 1, 12, 0)
+CANDLE_COLUMNS = [column for column in models.MarketCandle.__table__.c if column.name != "id"]
+
+
+def at(seconds):
+    return T0 + timedelta(seconds=seconds)
+
+
+# currency, seconds after T0, price, amount
+TRADES = [
+    ("BTC", 0, 100, 1),
+    ("ETH", 5, 10, 2),
+    ("BTC", 30, 105, 0.5),
+    ("BTC", 30, 95, 0.5),  # Same moment as the last: input order decides the close
+    ("BTC", 70, 101, 2),
+    ("BTC", 3700, 110, 1),
+]
+
+
+def fold(trades):
+    return aggregate(
+        [currency for currency, *_ in trades],
+        [at(seconds) for _, seconds, *_ in trades],
+        [price for *_, price, _ in trades],
+        [amount for *_, amount in trades],
+        [price * amount for *_, price, amount in trades],
+    )
+
+
+def candle(rows, currency, interval, bucket_start):
+    [row] = [row for row in rows if (row["currency"], row["interval"], row["bucket_start"]) == (
+        currency, interval, bucket_start)]
+    return row
+
+
+def test_aggregate_buckets_per_currency_and_interval():
+    rows = fold(TRADES)
+    first_minute = candle(rows, "BTC", "1m", T0)
+    assert [first_minute[key] for key in ("open", "high", "low", "close", "volume", "quote_volume", "trade_count")] == [
+        100, 105, 95, 95, 2, 200, 3,
+    ]
+    assert (first_minute["first_trade_at"], first_minute["last_trade_at"]) == (T0, at(30))
+    assert candle(rows, "BTC", "1m", at(60))["close"] == 101
+    hour = candle(rows, "BTC", "1h", T0)
+    assert (hour["open"], hour["close"], hour["trade_count"]) == (100, 101, 4)
+    day = candle(rows, "BTC", "1d", datetime(2024, 1, 1))
+    assert (day["open"], day["high"], day["close"], day["trade_count"]) == (100, 110, 110, 5)
+    assert candle(rows, "ETH", "1d", datetime(2024, 1, 1))["volume"] == 2
+    # BTC trades in three minutes, two hours and one day; ETH in one of each
+    assert len(rows) == 3 + 2 + 1 + 3
+    assert aggregate([], [], [], [], []) == []
+
+
+def stored(connection):
+    return sorted(tuple(row) for row in connection.execute(select(*CANDLE_COLUMNS)))
+
+
+def expected(rows):
+    return sorted(tuple(row[column.name] for column in CANDLE_COLUMNS) for row in rows)
+
+
+@pytest.fixture(params=["upsert", "read-merge-write"])
+def candle_connection(request, tmp_path):
+    scratch = build_engine(f"sqlite:///{tmp_path / 'candles.db'}")
+    models.MarketCandle.__table__.create(scratch)
+    with scratch.begin() as connection:
+        if request.param == "read-merge-write":
+            # A dialect without ON CONFLICT takes the portable path
+            connection.dialect.name = "other"
+        yield connection
+        connection.dialect.name = "sqlite"
+    scratch.dispose()
+
+
+def test_merging_in_batches_equals_folding_at_once(candle_connection):
+    # Later trades first, so open, low and first_trade_at come from the merge
+    merge_candles(candle_connection, fold(TRADES[4:]))
+    merge_candles(candle_connection, fold(TRADES[:4]))
+    assert stored(candle_connection) == expected(fold(TRADES))
+    merge_candles(candle_connection, [])
+
+
+@pytest.fixture
+def trades(client, make_user):
+    """Creates a pending trade per (currency, price, amount), returning their ids."""
+    _, seller = make_user("seller")
+    _, buyer = make_user("buyer")
+
+    def create(*specs):
+        ids = []
+        for currency, price, amount in specs:
+            offer = client.post("/api/offers/", json={
+                "currency": currency, "min_amount": 0.1, "max_amount": 100, "price_per_unit": price,
+            }, headers=seller).json()
+            trade = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": amount}, headers=buyer)
+            ids.append(trade.json()["id"])
+        return ids
+
+    return create
+
+
+def complete(trade_ids, completed_at=None):
+    with SessionLocal() as db:
+        for trade_id, when in zip(trade_ids, completed_at or [None] * len(trade_ids)):
+            trade = db.get(models.Trade, trade_id)
+            trade.status = models.TradeStatus.COMPLETED
+            if when is not None:
+                trade.completed_at = when
+        db.commit()
+
+
+def candles():
+    with engine.connect() as connection:
+        return stored(connection)
+
+
+def test_completing_trades_stamps_and_folds_them_in(client, trades):
+    ids = trades(("BTC", 100, 1), ("BTC", 105, 2), ("ETH", 10, 1))
+    before = datetime.utcnow()
+    complete(ids[:1])
+    with SessionLocal() as db:
+        assert db.get(models.Trade, ids[0]).completed_at >= before
+    complete(ids[1:], [at(30), at(90)])
+    assert market_data.last_prices.get("ETH") == 10
+    btc_days = [row for row in candles() if row[:2] == ("BTC", "1d")]
+    assert [row[-3] for row in btc_days] == [1, 1]  # trade_count per day
+
+    # Candles kept by the hook match a rebuild from the trades
+    kept = candles()
+    with engine.begin() as connection:
+        assert rebuild(connection) == 3
+    assert candles() == kept
+
+
+def test_a_rolled_back_completion_leaves_no_candle(client, trades):
+    [trade_id] = trades(("BTC", 100, 1))
+    with SessionLocal() as db:
+        trade = db.get(models.Trade, trade_id)
+        trade.status = models.TradeStatus.COMPLETED
+        db.flush()
+        # The merge ran in the flush, inside the transaction
+        assert db.execute(select(models.MarketCandle.id)).first() is not None
+        db.rollback()
+    assert candles() == []
+    # Completing an already completed trade again folds nothing twice
+    complete([trade_id])
+    complete([trade_id])
+    assert {row[-3] for row in candles()} == {1}
+
+
+def test_rebuild_from_a_day_replaces_only_later_candles(client, trades):
+    ids = trades(("BTC", 100, 1), ("BTC", 120, 1), ("BTC", 90, 1))
+    complete(ids, [at(0), at(86400), at(86400 + 30)])
+    kept = candles()
+    with engine.begin() as connection:
+        connection.execute(models.MarketCandle.__table__.delete())
+        # A batch of one exercises the keyset paging
+        assert rebuild(connection, ["BTC"], since=at(86400 + 60), batch_size=1) == 2
+    assert candles() == [row for row in kept if row[2] >= datetime(2024, 1, 2)]
+    with engine.begin() as connection:
+        assert rebuild(connection, batch_size=2) == 3
+    assert candles() == kept
@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import update
+from app.core import matching
+from app.core.matching import match_book
+from app.core.order_book import BookEntry, CurrencyBook, order_book
+from app.database import SessionLocal
+from app.models import models
+
+START = datetime(2024, 1, 1)
+
+
+def book_of(*offers):
+    book = CurrencyBook("BTC")
+    book.rebuild([
+        BookEntry(id=offer_id, seller_id=seller_id, currency="BTC", min_amount=min_amount, max_amount=max_amount,
+                  price_per_unit=price, is_active=True, created_at=START + timedelta(seconds=offer_id), version=1)
+        for offer_id, price, min_amount, max_amount, seller_id in offers
+    ])
+    return book
+
+
+def filled(fills):
+    return [(fill.offer_id, fill.amount, fill.left, fill.exhausted) for fill in fills]
+
+
+def test_cheapest_then_oldest_fills_first():
+    book = book_of((3, 100, 0.1, 1, 1), (1, 101, 0.1, 1, 1), (2, 100, 0.1, 1, 1))
+    fills, remaining = match_book(book, 2.5)
+    assert filled(fills) == [(2, 1.0, 0.0, True), (3, 1.0, 0.0, True), (1, 0.5, 0.5, False)]
+    assert remaining == 0
+
+
+def test_max_price_and_own_offers_are_respected():
+    book = book_of((1, 99, 0.1, 1, 7), (2, 100, 0.1, 1, 1), (3, 105, 0.1, 1, 1))
+    fills, remaining = match_book(book, 3, max_price=104, buyer_id=7)
+    assert filled(fills) == [(2, 1.0, 0.0, True)]
+    assert remaining == 2
+
+
+def test_offers_whose_minimum_is_not_met_are_skipped():
+    book = book_of((1, 100, 1, 5, 1), (2, 101, 0.1, 5, 1))
+    fills, remaining = match_book(book, 0.5)
+    assert filled(fills) == [(2, 0.5, 4.5, False)]
+    # A remainder under the minimum leaves the offer unable to trade
+    fills, _ = match_book(book_of((1, 100, 0.5, 1, 1)), 0.7)
+    assert filled(fills) == [(1, 0.7, 0.3, True)]
+    # Nothing fills once the remainder is below every minimum
+    assert match_book(book_of((1, 100, 1, 5, 1)), 0.5) == ([], 0.5)
+
+
+def test_partial_fills_accumulate_no_rounding_error():
+    book = book_of(*((offer_id, 100, 0.0, 0.1, 1) for offer_id in range(1, 11)))
+    fills, remaining = match_book(book, 0.7)
+    assert [fill.amount for fill in fills] == [0.1] * 7
+    assert remaining == 0
+
+
+def offer(client, headers, price, max_amount=1, min_amount=0.1):
+    return client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": min_amount, "max_amount": max_amount, "price_per_unit": price,
+    }, headers=headers).json()
+
+
+def offer_row(offer_id):
+    with SessionLocal() as db:
+        return db.get(models.Offer, offer_id)
+
+
+def change_behind_the_book(offer_id, max_amount):
+    # Another worker's write: the database moves on, this worker's book does not
+    with SessionLocal() as db:
+        db.execute(update(models.Offer).where(models.Offer.id == offer_id).values(
+            max_amount=max_amount, version=models.Offer.version + 1,
+        ))
+        db.commit()
+
+
+@pytest.fixture
+def parties(make_user):
+    return make_user("seller")[1], make_user("buyer")[1]
+
+
+def test_market_order_takes_offers_and_updates_the_book(client, parties):
+    seller, buyer = parties
+    cheap, dear = offer(client, seller, 100), offer(client, seller, 101)
+    response = client.post("/api/trades/market", json={"currency": "BTC", "amount": 1.5}, headers=buyer)
+    assert response.status_code == 200
+    body = response.json()
+    assert [(trade["offer_id"], trade["amount"]) for trade in body["trades"]] == [(cheap["id"], 1), (dear["id"], 0.5)]
+    assert (body["filled_amount"], body["remaining_amount"]) == (1.5, 0)
+    assert [(item.id, item.max_amount) for item in order_book.search("BTC")] == [(dear["id"], 0.5)]
+    assert not offer_row(cheap["id"]).is_active
+
+
+def test_market_order_retries_on_an_offer_changed_elsewhere(client, parties):
+    seller, buyer = parties
+    changed = offer(client, seller, 100)
+    change_behind_the_book(changed["id"], 0.4)
+    response = client.post("/api/trades/market", json={"currency": "BTC", "amount": 1}, headers=buyer)
+    assert response.status_code == 200
+    # The retry matched against the reloaded offer, not the stale 1 BTC
+    assert [trade["amount"] for trade in response.json()["trades"]] == [0.4]
+    row = offer_row(changed["id"])
+    assert (row.max_amount, row.is_active) == (0, False)
+    assert order_book.search("BTC") == []
+
+
+def test_market_order_gives_up_after_its_retries(client, parties, monkeypatch):
+    monkeypatch.setattr(matching, "MATCHING_MAX_RETRIES", 1)
+    seller, buyer = parties
+    changed = offer(client, seller, 100)
+    change_behind_the_book(changed["id"], 0.4)
+    response = client.post("/api/trades/market", json={"currency": "BTC", "amount": 1}, headers=buyer)
+    assert response.status_code == 409
+    # Nothing was taken, and the failed attempt refreshed the book
+    assert offer_row(changed["id"]).max_amount == 0.4
+    assert [item.max_amount for item in order_book.search("BTC")] == [0.4]
+
+
+def test_trades_reserve_and_cancelling_releases(client, parties):
+    seller, buyer = parties
+    created = offer(client, seller, 100, max_amount=1, min_amount=0.3)
+    first = client.post("/api/trades/", json={"offer_id": created["id"], "amount": 0.6}, headers=buyer).json()
+    assert offer_row(created["id"]).max_amount == 0.4
+    second = client.post("/api/trades/", json={"offer_id": created["id"], "amount": 0.3}, headers=buyer).json()
+    # 0.1 left is under the minimum, so the offer leaves the book
+    row = offer_row(created["id"])
+    assert (round(row.max_amount, 8), row.is_active) == (0.1, False)
+    assert order_book.search("BTC") == []
+    assert client.post("/api/trades/", json={"offer_id": created["id"], "amount": 0.3}, headers=buyer).status_code == 400
+
+    for trade in (first, second):
+        cancelled = client.put(f"/api/trades/{trade['trade_id']}", json={"status": "cancelled"}, headers=buyer)
+        assert cancelled.status_code == 200
+    row = offer_row(created["id"])
+    assert (row.max_amount, row.is_active) == (1, True)
+    assert [item.max_amount for item in order_book.search("BTC")] == [1]
+    # Cancelling twice gives nothing back twice, and a cancelled trade stays cancelled
+    client.put(f"/api/trades/{first['trade_id']}", json={"status": "cancelled"}, headers=buyer)
+    assert offer_row(created["id"]).max_amount == 1
+    reopened = client.put(f"/api/trades/{first['trade_id']}", json={"status": "pending"}, headers=buyer)
+    assert reopened.status_code == 400
+
+
+def test_trade_on_a_changed_offer_is_a_conflict(client, parties, monkeypatch):
+    seller, buyer = parties
+    created = offer(client, seller, 100)
+    original = matching.take
+
+    # Another request takes from the offer between this one reading it and reserving
+    def racing_take(offer_id, version, left, exhausted):
+        change_behind_the_book(offer_id, 0.5)
+        return original(offer_id, version, left, exhausted)
+
+    monkeypatch.setattr(matching, "take", racing_take)
+    response = client.post("/api/trades/", json={"offer_id": created["id"], "amount": 0.2}, headers=buyer)
+    assert response.status_code == 409
+    assert offer_row(created["id"]).max_amount == 0.5
+
+
+def test_cancelling_leaves_offers_deactivated_otherwise_inactive(client, parties):
+    seller, buyer = parties
+    paused, emptied = offer(client, seller, 100), offer(client, seller, 101)
+    paused_trade = client.post("/api/trades/", json={"offer_id": paused["id"], "amount": 0.5}, headers=buyer).json()
+    emptied_trade = client.post("/api/trades/", json={"offer_id": emptied["id"], "amount": 1}, headers=buyer).json()
+    assert offer_row(emptied["id"]).is_exhausted
+    # The seller pauses one offer, and withdraws the other after trades emptied it
+    client.put(f"/api/offers/{paused['id']}", json={"is_active": False}, headers=seller)
+    client.put(f"/api/offers/{emptied['id']}", json={"is_active": False}, headers=seller)
+    for trade in (paused_trade, emptied_trade):
+        client.put(f"/api/trades/{trade['trade_id']}", json={"status": "cancelled"}, headers=buyer)
+    for created in (paused, emptied):
+        row = offer_row(created["id"])
+        assert (row.max_amount, row.is_active, row.is_exhausted) == (1, False, False)
+    assert order_book.search("BTC") == []
+
@@ -0,0 +1,98 @@
+from sqlalchemy import text
+from app.core import metrics
+from app.core.metrics import Counter, Gauge, Histogram, Registry, pool_collector
+from app.database import SessionLocal
+
+
+def test_metrics_render_in_the_text_format():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests.", ("path",)))
+    in_flight = registry.register(Gauge("in_flight", "In flight."))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", ("path",), buckets=(0.1, 1)))
+    requests.inc('/a"b\\c\n')
+    requests.inc("/", amount=2)
+    in_flight.inc()
+    in_flight.dec()
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, "/")
+    registry.add_collector(pool_collector(lambda: {"sync": {"size": 5, "checked_out": 1}, "other": {"size": 2}}))
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{path="/"} 2',
+        'requests_total{path="/a\\"b\\\\c\\n"} 1',
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        "in_flight 0",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{path="/",le="0.1"} 2',
+        'latency_seconds_bucket{path="/",le="1"} 3',
+        'latency_seconds_bucket{path="/",le="+Inf"} 4',
+        'latency_seconds_sum{path="/"} 3.65',
+        'latency_seconds_count{path="/"} 4',
+        "# HELP db_pool_size Connections the pool keeps open.",
+        "# TYPE db_pool_size gauge",
+        'db_pool_size{engine="sync"} 5',
+        'db_pool_size{engine="other"} 2',
+        "# HELP db_pool_checked_out Connections currently in use.",
+        "# TYPE db_pool_checked_out gauge",
+        'db_pool_checked_out{engine="sync"} 1',
+    ]
+
+
+def scrape(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.headers["content-type"] == metrics.CONTENT_TYPE
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return samples
+
+
+def delta(before, after, name):
+    return after.get(name, 0) - before.get(name, 0)
+
+
+def test_requests_are_labelled_by_route_template(client, make_user):
+    _, headers = make_user("seller")
+    offer = client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": 100,
+    }, headers=headers).json()
+    before = scrape(client)
+    client.get(f"/api/offers/{offer['id']}")
+    client.get(f"/api/offers/{offer['id'] + 1000}")
+    client.get("/no/such/path")
+    after = scrape(client)
+
+    route = 'method="GET",route="/api/offers/{offer_id}"'
+    assert delta(before, after, f'http_requests_total{{{route},status="200"}}') == 1
+    assert delta(before, after, f'http_requests_total{{{route},status="404"}}') == 1
+    assert delta(before, after, 'http_requests_total{method="GET",route="unmatched",status="404"}') == 1
+    assert not any(f"/api/offers/{offer['id']}" in name for name in after)
+    assert delta(before, after, f"http_request_duration_seconds_count{{{route}}}") == 2
+    assert after[f'http_requests_in_progress{{{route}}}'] == 0
+    # Each lookup ran SQL, counted per request and in the request total
+    assert delta(before, after, f"http_request_db_statements_count{{{route}}}") == 2
+    statements = delta(before, after, f"http_request_db_statements_sum{{{route}}}")
+    assert statements >= 2
+    assert delta(before, after, 'db_statements_total{context="request"}') >= statements
+    assert after[f'http_request_db_statements_bucket{{{route},le="+Inf"}}'] >= 2
+
+
+def test_statements_outside_requests_count_as_background(client):
+    before = scrape(client)
+    with SessionLocal() as db:
+        for _ in range(3):
+            db.execute(text("SELECT 1"))
+    after = scrape(client)
+    assert delta(before, after, 'db_statements_total{context="background"}') == 3
+    assert after['db_pool_checked_out{engine="sync"}'] == 0
+    assert after['db_pool_checkouts_total{engine="sync"}'] > before['db_pool_checkouts_total{engine="sync"}']
+
+
+def test_metrics_can_be_disabled(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+    assert client.get("/metrics").status_code == 404
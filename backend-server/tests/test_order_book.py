@@ -0,0 +1,217 @@
+import random
+from datetime import datetime, timedelta
+from itertools import islice
+import pytest
+from app.core.order_book import BookEntry, CurrencyBook, OrderBook, SortedIndex, order_book
+from app.core.pagination import sort_key
+
+START = datetime(2024, 1, 1)
+
+
+def entry(offer_id, price, min_amount=0.1, max_amount=1.0, currency="BTC", created_at=None, active=True):
+    return BookEntry(
+        id=offer_id,
+        seller_id=1,
+        currency=currency,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        price_per_unit=price,
+        is_active=active,
+        created_at=created_at or START + timedelta(seconds=offer_id),
+        version=1,
+    )
+
+
+def brute_force(entries, min_price=None, max_price=None, min_amount=None, max_amount=None, after=None):
+    matches = [
+        item for item in entries
+        if (min_price is None or item.price_per_unit >= min_price)
+        and (max_price is None or item.price_per_unit <= max_price)
+        and (min_amount is None or item.min_amount >= min_amount)
+        and (max_amount is None or item.max_amount <= max_amount)
+        and (after is None or sort_key(item) > after)
+    ]
+    return sorted(matches, key=sort_key)
+
+
+@pytest.fixture
+def random_entries():
+    rng = random.Random(7)
+    # Few distinct creation times, so ties are broken by id
+    return [
+        entry(
+            offer_id, round(rng.uniform(90, 110), 1), round(rng.uniform(0.01, 0.5), 2),
+            round(rng.uniform(0.5, 5), 2), currency=rng.choice(["BTC", "ETH"]),
+            created_at=START + timedelta(seconds=rng.randrange(50)),
+        )
+        for offer_id in rng.sample(range(1, 10000), 600)
+    ]
+
+
+def load(book, entries):
+    for item in entries:
+        book.upsert(item)
+    return book
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"min_price": 100},
+    {"min_price": 99.5, "max_price": 100.5},
+    {"min_amount": 0.4},
+    {"max_amount": 1.0},
+    {"min_price": 95, "max_amount": 3},
+    {"max_price": 10},
+])
+@pytest.mark.parametrize("limit", [1, 20, None])
+def test_search_matches_a_filtered_sort(random_entries, filters, limit):
+    book = load(OrderBook(), random_entries)
+    expected = brute_force(random_entries, **filters)
+    assert book.search(limit=limit, **filters) == expected[:limit]
+
+
+@pytest.mark.parametrize("filters", [{}, {"min_price": 99.5, "max_price": 100.5}])
+def test_search_pages_from_the_after_position(random_entries, filters):
+    book = load(OrderBook(), random_entries)
+    pages, after = [], None
+    while True:
+        page = book.search(after=after, limit=25, **filters)
+        if not page:
+            break
+        pages.extend(page)
+        after = sort_key(page[-1])
+    assert pages == brute_force(random_entries, **filters)
+
+
+def test_search_walks_or_collects_with_the_same_result(random_entries):
+    # A wide price range walks the creation index, a narrow one sorts its range
+    btc = [item for item in random_entries if item.currency == "BTC"]
+    book = CurrencyBook("BTC")
+    book.rebuild(btc)
+    for low, high in [(90, 110), (100, 100.2)]:
+        expected = brute_force(btc, min_price=low, max_price=high)
+        # limit only picks the path; the caller stops reading at it
+        assert list(islice(book.search(min_price=low, max_price=high, limit=10), 10)) == expected[:10]
+        after = sort_key(expected[0])
+        assert list(book.search(min_price=low, max_price=high, after=after)) == expected[1:]
+
+
+def test_search_by_currency():
+    book = load(OrderBook(), [entry(1, 100), entry(2, 100, currency="ETH"), entry(3, 101)])
+    assert [item.id for item in book.search("BTC")] == [1, 3]
+    assert [item.id for item in book.search("ETH")] == [2]
+    assert book.search("DOGE") == []
+
+
+def test_upsert_reindexes_and_drops_inactive_offers():
+    book = load(OrderBook(), [entry(1, 100), entry(2, 105)])
+    book.upsert(entry(1, 110))
+    assert [item.id for item in book.search(max_price=106)] == [2]
+    book.upsert(entry(2, 105, active=False))
+    assert [item.id for item in book.search()] == [1]
+    book.upsert(entry(1, 110, currency="ETH"))
+    assert book.search("BTC") == [] and [item.id for item in book.search("ETH")] == [1]
+    book.remove(1)
+    assert book.search() == []
+
+
+def test_listeners_see_every_change():
+    book = OrderBook()
+    seen = []
+    book.add_listener(lambda currency, op, offer_id, item: seen.append((currency, op, offer_id)))
+    book.upsert(entry(1, 100))
+    book.upsert(entry(1, 101))
+    book.remove(1)
+    assert seen == [("BTC", "add", 1), ("BTC", "update", 1), ("BTC", "remove", 1)]
+
+
+def check(index, reference):
+    flat = [item for sublist in index._lists for item in sublist]
+    assert flat == sorted(reference) and len(index) == len(reference)
+    assert index._maxes == [sublist[-1] for sublist in index._lists]
+    assert all(0 < len(sublist) <= 2 * index._LOAD for sublist in index._lists)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    # A small load factor exercises splitting and dropping sublists with few items
+    monkeypatch.setattr(SortedIndex, "_LOAD", 4)
+    return SortedIndex()
+
+
+def test_adds_split_sublists_and_discards_drop_empty_ones(index):
+    rng = random.Random(3)
+    reference = []
+    for offer_id in range(200):
+        item = (rng.choice([1.0, 2.5, 3.0, 4.25, 7.0]), offer_id)
+        index.add(*item)
+        reference.append(item)
+    check(index, reference)
+    assert len(index._lists) > 200 // (2 * index._LOAD)
+    rng.shuffle(reference)
+    while reference:
+        index.discard(*reference.pop())
+        check(index, reference)
+    assert index._lists == [] and index.first_key() is None
+    # Discarding what is not there changes nothing
+    index.discard(1.0, 1)
+    index.add(1.0, 1)
+    index.discard(1.0, 2)
+    check(index, [(1.0, 1)])
+
+
+@pytest.mark.parametrize("rebuild", [True, False])
+def test_range_queries_span_sublists(index, rebuild):
+    rng = random.Random(11)
+    reference = sorted((float(rng.randrange(20)), offer_id) for offer_id in range(150))
+    if rebuild:
+        index.rebuild(reference)
+    else:
+        for item in rng.sample(reference, len(reference)):
+            index.add(*item)
+    for _ in range(40):
+        index.discard(*reference.pop(rng.randrange(len(reference))))
+    check(index, reference)
+    for low, high in [(None, None), (3, 3), (2.5, 11), (None, 4), (15, None), (25, 30), (9, 4)]:
+        expected = [
+            offer_id for key, offer_id in reference
+            if (low is None or key >= low) and (high is None or key <= high)
+        ]
+        assert list(index.ids(low, high)) == expected
+        assert index.count(low, high) == len(expected)
+    for position in (0, 37, len(reference) - 1):
+        assert list(index.ids_after(*reference[position])) == [offer_id for _, offer_id in reference[position + 1:]]
+    assert index.first_key() == reference[0][0]
+
+
+def test_offer_list_is_served_from_the_book(client, make_user):
+    _, headers = make_user("seller")
+    for price in (100, 101, 99):
+        client.post("/api/offers/", json={
+            "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": price,
+        }, headers=headers)
+    page = client.get("/api/offers/", params={"currency": "BTC", "max_price": 100}).json()
+    assert [offer["price_per_unit"] for offer in page["items"]] == [100, 99]
+
+
+def test_admin_offer_changes_reach_the_book(client, make_user):
+    seller, headers = make_user("seller")
+    offer = client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": 100,
+    }, headers=headers).json()
+    form = {"seller": str(seller.id), "currency": "BTC", "min_amount": "0.1", "max_amount": "1",
+            "price_per_unit": "120", "is_active": "True", "save": "Save"}
+    edited = client.post(f"/admin/offer/edit/{offer['id']}", data=form, follow_redirects=False)
+    assert edited.status_code == 302
+    assert [(item.id, item.price_per_unit) for item in order_book.search("BTC")] == [(offer["id"], 120)]
+    assert client.get("/api/offers/").json()["items"][0]["price_per_unit"] == 120
+
+    form["is_active"] = "False"
+    client.post(f"/admin/offer/edit/{offer['id']}", data=form, follow_redirects=False)
+    assert order_book.search("BTC") == []
+
+    created = client.post("/admin/offer/create", data={**form, "is_active": "True"}, follow_redirects=False)
+    assert created.status_code == 302
+    [entry] = order_book.search("BTC")
+    client.delete("/admin/offer/delete", params={"pks": entry.id})
+    assert order_book.search("BTC") == [] and client.get("/api/offers/").json()["items"] == []
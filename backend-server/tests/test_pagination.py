@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from app.core import pagination
+from app.core.pagination import decode_cursor, encode_cursor, keyset, keyset_union, make_page, page_size, sort_key
+from app.database import SessionLocal
+from app.models import models
+
+START = datetime(2024, 1, 1, 12, 30, 15, 123456)
+
+
+def test_cursor_round_trips():
+    cursor = encode_cursor(START, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (START, 42)
+
+
+def test_cursor_without_created_at_sorts_first():
+    assert decode_cursor(encode_cursor(None, 7)) == (datetime.min, 7)
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_cursor(START, 1)[:-3], "MjAyNHwx"])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as exc_info:
+        decode_cursor(cursor)
+    assert exc_info.value.status_code == 400
+
+
+def test_page_size_is_clamped(monkeypatch):
+    monkeypatch.setattr(pagination, "DEFAULT_PAGE_SIZE", 50)
+    monkeypatch.setattr(pagination, "MAX_PAGE_SIZE", 100)
+    assert page_size(None) == 50
+    assert page_size(10) == 10
+    assert page_size(1000) == 100
+
+
+def test_make_page_sets_a_cursor_only_when_more_rows_exist():
+    rows = [models.TradeMessage(id=i, created_at=START) for i in range(1, 5)]
+    page = make_page(rows, 3)
+    assert page["items"] == rows[:3]
+    assert decode_cursor(page["next_cursor"]) == sort_key(rows[2])
+    assert make_page(rows[:3], 3)["next_cursor"] is None
+
+
+@pytest.fixture
+def messages(client):
+    # Three messages per timestamp, inserted out of order, so pages must break ties on id
+    with SessionLocal() as db:
+        rows = [
+            models.TradeMessage(id=offset * 3 + tie + 1, trade_id=1, sender_id=1, content="m",
+                                created_at=START + timedelta(seconds=10 - offset))
+            for offset in range(10) for tie in range(3)
+        ]
+        rows.append(models.TradeMessage(id=100, trade_id=2, sender_id=1, content="other", created_at=START))
+        db.add_all(rows)
+        db.commit()
+        return sorted(
+            [(row.created_at, row.id) for row in rows if row.trade_id == 1]
+        )
+
+
+def read_pages(build, limit):
+    positions, cursor, pages = [], None, 0
+    with SessionLocal() as db:
+        while True:
+            page = make_page(db.execute(build(cursor)).all(), limit)
+            positions.extend(sort_key(row) for row in page["items"])
+            pages += 1
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return positions, pages
+
+
+@pytest.mark.parametrize("limit", [1, 4, 30, 50])
+def test_keyset_pages_cover_every_row_once_in_order(messages, limit):
+    query = select(models.TradeMessage.created_at, models.TradeMessage.id).where(models.TradeMessage.trade_id == 1)
+    positions, pages = read_pages(lambda cursor: keyset(query, models.TradeMessage, cursor, limit), limit)
+    assert positions == messages
+    assert pages == max(1, -(-len(messages) // limit))
+
+
+def test_keyset_resumes_strictly_after_the_cursor(messages):
+    created_at, row_id = messages[4]
+    query = select(models.TradeMessage.created_at, models.TradeMessage.id).where(models.TradeMessage.trade_id == 1)
+    with SessionLocal() as db:
+        rows = db.execute(keyset(query, models.TradeMessage, encode_cursor(created_at, row_id), 3)).all()
+    assert [sort_key(row) for row in rows] == messages[5:9]
+
+
+def test_keyset_union_merges_disjoint_branches(client):
+    with SessionLocal() as db:
+        db.add_all([
+            models.Trade(id=i, trade_id=f"t{i}", buyer_id=1 if i % 2 else 2, seller_id=2 if i % 2 else 1,
+                         amount=1, price_per_unit=1, total_price=1, created_at=START + timedelta(seconds=i // 2))
+            for i in range(1, 12)
+        ] + [
+            models.Trade(id=50, trade_id="t50", buyer_id=3, seller_id=4, amount=1, price_per_unit=1,
+                         total_price=1, created_at=START)
+        ])
+        db.commit()
+    columns = (models.Trade.created_at, models.Trade.id)
+    branches = [
+        select(*columns).where(models.Trade.buyer_id == 1),
+        select(*columns).where(models.Trade.seller_id == 1, models.Trade.buyer_id != 1),
+    ]
+    positions, _ = read_pages(lambda cursor: keyset_union(branches, models.Trade, cursor, 3), 3)
+    assert [row_id for _, row_id in positions] == list(range(1, 12))
+
+
+def test_offer_pages_follow_the_cursor(client, make_user):
+    _, headers = make_user("seller")
+    for price in range(100, 107):
+        client.post("/api/offers/", json={
+            "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": price,
+        }, headers=headers)
+    prices, cursor = [], None
+    while True:
+        page = client.get("/api/offers/", params={"limit": 3, **({"cursor": cursor} if cursor else {})}).json()
+        prices.extend(offer["price_per_unit"] for offer in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert prices == list(range(100, 107))
+    assert client.get("/api/offers/", params={"cursor": "garbage"}).status_code == 400
@@ -0,0 +1,66 @@
+import pytest
+from sqlalchemy import select, text
+from app.core import profiler
+from app.core.profiler import Profile, fingerprint
+from app.database import SessionLocal
+from app.models import models
+
+
+@pytest.mark.parametrize("statement, shape", [
+    ("SELECT * FROM offers WHERE id = 5", "SELECT * FROM offers WHERE id = ?"),
+    ("SELECT *\n  FROM users WHERE email = 'a''b@example.com'", "SELECT * FROM users WHERE email = ?"),
+    ("SELECT * FROM trades WHERE id IN (?, ?, ?)", "SELECT * FROM trades WHERE id IN (?)"),
+    ("SELECT * FROM trades WHERE id IN ($1, $2) AND amount > :amount", "SELECT * FROM trades WHERE id IN (?) AND amount > ?"),
+    ("UPDATE wallets SET balance = 1.5 WHERE id = %(id)s", "UPDATE wallets SET balance = ? WHERE id = ?"),
+])
+def test_fingerprint_keeps_only_the_statement_shape(statement, shape):
+    assert fingerprint(statement) == shape
+
+
+def test_repeated_shapes_are_n_plus_one_suspects():
+    profile = Profile("GET", "/", cpu=False)
+    for offer_id in range(6):
+        profile.record(f"SELECT * FROM offers WHERE id = {offer_id}", 0.001, 1, "routers/offers.py:10 in get")
+    for _ in range(3):
+        profile.record("SELECT count(*) FROM trades", 0.001, 1, None)
+    [suspect] = profile.n_plus_one(threshold=5)
+    assert (suspect["fingerprint"], suspect["count"]) == ("SELECT * FROM offers WHERE id = ?", 6)
+    assert suspect["callers"] == ["routers/offers.py:10 in get"]
+    assert [suspect["count"] for suspect in profile.n_plus_one(threshold=3)] == [6, 3]
+    assert profile.summary()["statements"] == 9
+
+
+def test_statements_of_the_current_profile_are_recorded(client):
+    profile = Profile("GET", "/", cpu=False)
+    token = profiler.current_profile.set(profile)
+    try:
+        with SessionLocal() as db:
+            for offer_id in range(5):
+                db.execute(select(models.Offer).where(models.Offer.id == offer_id)).all()
+    finally:
+        profiler.current_profile.reset(token)
+    with SessionLocal() as db:
+        db.execute(text("SELECT 1"))
+    assert len(profile.statements) == 5
+    assert profile.n_plus_one()[0]["count"] == 5
+
+
+def test_profile_header_reports_sql_without_flagging_the_trade_list(client, make_user):
+    seller, seller_headers = make_user("seller")
+    _, buyer_headers = make_user("buyer")
+    offer = client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 100, "price_per_unit": 100,
+    }, headers=seller_headers).json()
+    for _ in range(8):
+        trade = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 1}, headers=buyer_headers).json()
+        client.post(f"/api/trades/{trade['trade_id']}/messages", json={"content": "hi"}, headers=buyer_headers)
+
+    plain = client.get("/api/trades/", params={"include": "messages"}, headers=buyer_headers)
+    assert "x-profile-statements" not in plain.headers
+    profiled = client.get("/api/trades/", params={"include": "messages"},
+                          headers={**buyer_headers, "X-Profile": "sql"})
+    assert profiled.status_code == 200 and len(profiled.json()["items"]) == 8
+    # Messages and counts load in batches, so the statement count does not grow with the page
+    assert int(profiled.headers["x-profile-statements"]) < 8
+    assert float(profiled.headers["x-profile-sql-ms"]) >= 0
+    assert "x-profile-n-plus-one" not in profiled.headers
@@ -0,0 +1,33 @@
+import pytest
+from app.database.engine import build_engine
+from app.database.migrate import run_migrations
+from scripts.check_query_plans import KEYSET_PATHS, explain, hot_queries, scans, sorts
+
+HOT_QUERIES = hot_queries()
+
+
+@pytest.fixture(scope="module")
+def connection(tmp_path_factory):
+    engine = build_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    run_migrations(engine)
+    with engine.connect() as connection:
+        yield connection
+    engine.dispose()
+
+
+@pytest.mark.parametrize("name, statement", HOT_QUERIES, ids=[name for name, _ in HOT_QUERIES])
+def test_hot_query_searches_an_index(connection, name, statement):
+    assert scans(explain(connection, statement)) == []
+
+
+@pytest.mark.parametrize(
+    "name, statement",
+    [(name, statement) for name, statement in HOT_QUERIES if name in KEYSET_PATHS],
+    ids=sorted(KEYSET_PATHS, key=[name for name, _ in HOT_QUERIES].index),
+)
+def test_keyset_page_reads_in_index_order(connection, name, statement):
+    assert sorts(explain(connection, statement)) == []
+
+
+def test_every_keyset_path_is_checked():
+    assert KEYSET_PATHS <= {name for name, _ in HOT_QUERIES}
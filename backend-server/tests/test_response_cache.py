@@ -0,0 +1,138 @@
+import pytest
+from fastapi.responses import UJSONResponse
+from app.core import response_cache as cache_module
+from app.core.order_book import OrderBook
+from app.core.response_cache import ENTRY_OVERHEAD_BYTES, CachedResponse, ResponseCache, _matches
+from app.database import SessionLocal
+from app.models import models
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"other", "abc"', True),
+    ("*", True),
+    ('"other"', False),
+])
+def test_if_none_match_compares_weakly(if_none_match, matches):
+    assert _matches(if_none_match, '"abc"') is matches
+
+
+def cached(body, tags, ttl=60):
+    return CachedResponse.from_response(UJSONResponse(body), tags, ttl)
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(max_bytes=3 * (ENTRY_OVERHEAD_BYTES + 20), ttl=60, book=OrderBook())
+
+
+def store(cache, key, entry):
+    cache.set(key, entry, cache.generations(entry.tags))
+
+
+def test_invalidation_drops_only_tagged_entries(cache):
+    store(cache, "a", cached({"id": 1}, ["offer:1", "offers"]))
+    store(cache, "b", cached({"id": 2}, ["offer:2"]))
+    cache.invalidate("offers")
+    assert cache.get("a") is None and cache.get("b") is not None
+    # Book changes invalidate the offer, its currency's lists and the unfiltered list
+    store(cache, "c", cached([], ["offers:BTC"]))
+    cache.record("BTC", "update", 2, None)
+    assert len(cache) == 0 and cache.size == 0
+
+
+def test_a_response_computed_across_an_invalidation_is_not_stored(cache):
+    entry = cached({"id": 1}, ["offer:1"])
+    generations = cache.generations(entry.tags)
+    cache.invalidate("offer:1")
+    cache.set("a", entry, generations)
+    assert cache.get("a") is None
+    store(cache, "a", entry)
+    assert cache.get("a") is entry
+
+
+def test_least_recently_used_entries_leave_the_byte_budget(cache):
+    for key in "abc":
+        store(cache, key, cached({"key": key}, [key]))
+    cache.get("a")
+    store(cache, "d", cached({"key": "d"}, ["d"]))
+    assert [key for key in "abcd" if cache.get(key) is not None] == ["a", "c", "d"]
+    assert cache.size <= cache.max_bytes
+    store(cache, "huge", cached({"body": "x" * cache.max_bytes}, ["huge"]))
+    assert cache.get("huge") is None and len(cache) == 3
+
+
+def test_entries_expire_after_the_ttl(cache):
+    store(cache, "a", cached({}, ["a"], ttl=-1))
+    assert cache.get("a") is None and cache.size == 0
+
+
+@pytest.fixture
+def seller(make_user):
+    return make_user("seller")
+
+
+def create_offer(client, headers, price=100):
+    return client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": price,
+    }, headers=headers).json()
+
+
+def test_offer_etag_revalidates_until_the_offer_changes(client, seller):
+    _, headers = seller
+    offer = create_offer(client, headers)
+    first = client.get(f"/api/offers/{offer['id']}")
+    assert first.headers["etag"] == '"1"' and first.headers["cache-control"] == "no-cache"
+    revalidated = client.get(f"/api/offers/{offer['id']}", headers={"If-None-Match": first.headers["etag"]})
+    assert revalidated.status_code == 304 and revalidated.content == b""
+    assert revalidated.headers["etag"] == first.headers["etag"]
+
+    client.put(f"/api/offers/{offer['id']}", json={"price_per_unit": 105}, headers=headers)
+    changed = client.get(f"/api/offers/{offer['id']}", headers={"If-None-Match": first.headers["etag"]})
+    assert changed.status_code == 200
+    assert changed.json()["price_per_unit"] == 105 and changed.headers["etag"] == '"2"'
+
+
+def test_offer_lists_follow_the_book(client, seller, make_user):
+    _, headers = seller
+    create_offer(client, headers, 100)
+    first = client.get("/api/offers/", params={"currency": "BTC"})
+    assert client.get("/api/offers/", params={"currency": "BTC"}).content == first.content
+    create_offer(client, headers, 99)
+    assert len(client.get("/api/offers/", params={"currency": "BTC"}).json()["items"]) == 2
+    # A market fill is a Core UPDATE; it reaches the cache through the book
+    _, buyer = make_user("buyer")
+    client.post("/api/trades/market", json={"currency": "BTC", "amount": 0.5}, headers=buyer)
+    prices = [(item["price_per_unit"], item["max_amount"]) for item in client.get("/api/offers/").json()["items"]]
+    assert sorted(prices) == [(99, 0.5), (100, 1)]
+
+
+def test_user_profile_is_invalidated_by_orm_writes(client, seller):
+    user, headers = seller
+    assert client.get(f"/api/users/{user.id}").json()["username"] == "seller"
+    client.put(f"/api/users/{user.id}", json={"username": "renamed"}, headers=headers)
+    assert client.get(f"/api/users/{user.id}").json()["username"] == "renamed"
+    # Writes outside the routers, e.g. the admin panel's sync sessions, invalidate too
+    with SessionLocal() as db:
+        db.get(models.User, user.id).username = "from-admin"
+        db.commit()
+    assert client.get(f"/api/users/{user.id}").json()["username"] == "from-admin"
+    # A rolled back write leaves the cached response alone
+    cached_body = client.get(f"/api/users/{user.id}").content
+    with SessionLocal() as db:
+        db.get(models.User, user.id).username = "rolled-back"
+        db.flush()
+        db.rollback()
+    assert client.get(f"/api/users/{user.id}").content == cached_body
+
+
+def test_caching_can_be_disabled(client, seller, monkeypatch):
+    monkeypatch.setattr(cache_module, "RESPONSE_CACHE_ENABLED", False)
+    _, headers = seller
+    offer = create_offer(client, headers)
+    client.get(f"/api/offers/{offer['id']}")
+    assert len(cache_module.response_cache) == 0
+    revalidated = client.get(f"/api/offers/{offer['id']}", headers={"If-None-Match": '"1"'})
+    assert revalidated.status_code == 200
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import update
+from app.core import security
+from app.core.backends import MemoryBackend, backend
+from app.core.workers import BoundedExecutor
+from app.database import SessionLocal
+from app.models import models
+from app.routers import admin as admin_router
+
+
+def register(client, name="alice", password="correct horse"):
+    response = client.post("/api/users/", json={
+        "email": f"{name}@example.com", "username": name, "password": password,
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def login(client, email, password):
+    return client.post("/api/users/token", data={"username": email, "password": password})
+
+
+def test_login_returns_a_working_bearer_token(client):
+    user = register(client)
+    response = login(client, "alice@example.com", "correct horse")
+    assert response.status_code == 200 and response.json()["token_type"] == "bearer"
+    me = client.get("/api/users/me", headers={"Authorization": f"Bearer {response.json()['access_token']}"})
+    assert me.json()["id"] == user["id"]
+
+
+@pytest.mark.parametrize("email, password", [
+    ("alice@example.com", "wrong"),
+    ("nobody@example.com", "correct horse"),
+])
+def test_login_refuses_bad_credentials(client, email, password):
+    register(client)
+    response = login(client, email, password)
+    assert response.status_code == 401 and response.headers["www-authenticate"] == "Bearer"
+
+
+def test_login_is_refused_with_503_while_the_hashing_pool_is_full(client, monkeypatch):
+    register(client)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_verify(plain_password, hashed_password):
+        started.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(security, "password_pool", BoundedExecutor("test-hash", 1, 0))
+    monkeypatch.setattr(security, "verify_password", slow_verify)
+    first = []
+    worker = threading.Thread(target=lambda: first.append(login(client, "alice@example.com", "x")))
+    worker.start()
+    try:
+        assert started.wait(5)
+        busy = login(client, "alice@example.com", "x")
+        assert busy.status_code == 503 and busy.headers["retry-after"] == "1"
+    finally:
+        release.set()
+        worker.join(5)
+    assert first[0].status_code == 200
+    security.password_pool.shutdown()
+
+
+@pytest.mark.anyio
+async def test_pool_slots_are_held_until_the_call_finishes():
+    pool = BoundedExecutor("test-slots", 1, 1)
+    release = threading.Event()
+    try:
+        calls = [asyncio.ensure_future(pool.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(time.sleep, 0)
+        assert exc_info.value.status_code == 503
+        # Cancelling frees a queued call's slot, but not the running one's while its thread runs
+        for call in calls:
+            call.cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+        assert pool.pending == 1
+        release.set()
+        for _ in range(100):
+            if pool.pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert pool.pending == 0
+        await pool.run(time.sleep, 0)
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+@pytest.fixture
+def admin(make_user):
+    return make_user("admin", role=models.UserRole.ADMIN)[0]
+
+
+def set_blocked(admin, user, blocked):
+    # The admin router is not mounted in the app, so its handlers are called directly
+    with SessionLocal() as db:
+        (admin_router.block_user if blocked else admin_router.unblock_user)(user.id, db=db, current_user=admin)
+
+
+def wallets(client, headers):
+    return client.get("/api/wallets/", headers=headers)
+
+
+def test_blocking_takes_effect_on_the_next_request(client, make_user, admin):
+    user, headers = make_user("alice")
+    assert wallets(client, headers).status_code == 200  # now cached as a principal
+    set_blocked(admin, user, True)
+    blocked = wallets(client, headers)
+    assert blocked.status_code == 400 and blocked.json()["detail"] == "Blocked user"
+    set_blocked(admin, user, False)
+    assert wallets(client, headers).status_code == 200
+
+
+def test_user_updates_take_effect_on_the_next_request(client, make_user):
+    user, headers = make_user("alice")
+    assert wallets(client, headers).status_code == 200
+    client.put(f"/api/users/{user.id}", json={"email": "renamed@example.com"}, headers=headers)
+    # The token names the old email, which no longer resolves
+    assert wallets(client, headers).status_code == 401
+    renamed = {"Authorization": f"Bearer {security.create_access_token({'sub': 'renamed@example.com'})}"}
+    assert wallets(client, renamed).status_code == 200
+    client.put(f"/api/users/{user.id}", json={"is_active": False}, headers=renamed)
+    assert wallets(client, renamed).json()["detail"] == "Inactive user"
+
+
+def test_admin_panel_edits_drop_cached_principals(client, make_user):
+    user, headers = make_user("alice")
+    assert wallets(client, headers).status_code == 200
+    edited = client.post(f"/admin/user/edit/{user.id}", data={
+        "email": user.email, "username": user.username, "role": "USER",
+        "is_active": "True", "is_blocked": "True", "save": "Save",
+    }, follow_redirects=False)
+    assert edited.status_code == 302
+    assert wallets(client, headers).json()["detail"] == "Blocked user"
+
+
+def test_principal_changes_reach_the_other_workers(client, make_user, admin):
+    user, headers = make_user("alice")
+    # A second worker on the same broker
+    peer = MemoryBackend(backend.broker)
+    received = []
+    peer.subscribe(security.PRINCIPALS_CHANNEL, received.append)
+    try:
+        assert wallets(client, headers).status_code == 200
+        set_blocked(admin, user, True)
+        assert received == [user.email]
+        assert wallets(client, headers).status_code == 400  # cached again, now blocked
+
+        # The other worker unblocks the user and tells this one
+        with SessionLocal() as db:
+            db.execute(update(models.User).where(models.User.id == user.id).values(is_blocked=False))
+            db.commit()
+        assert wallets(client, headers).status_code == 400
+        peer.publish(security.PRINCIPALS_CHANNEL, user.email)
+        assert wallets(client, headers).status_code == 200
+    finally:
+        backend.broker.backends.remove(peer)
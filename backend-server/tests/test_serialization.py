@@ -0,0 +1,92 @@
+import enum
+from collections import namedtuple
+from datetime import date, datetime
+from typing import Optional
+import pytest
+import ujson
+from pydantic import BaseModel
+from app.core.serialization import RowSerializer, page_response
+from app.database import SessionLocal
+from app.models import models
+from app.schemas import offer_schemas, trade_schemas, user_schemas, wallet_schemas
+
+
+class Colour(str, enum.Enum):
+    RED = "red"
+
+
+class Sample(BaseModel):
+    id: int
+    name: Optional[str]
+    price: float
+    colour: Colour
+    maybe_colour: Optional[Colour]
+    created_at: datetime
+    updated_at: Optional[datetime]
+    day: date
+
+
+ROW = (1, "a", 1.5, Colour.RED, None, datetime(2024, 1, 2, 3, 4, 5, 678901), None, date(2024, 1, 2))
+
+sample_rows = RowSerializer(Sample)
+SampleRow = namedtuple("SampleRow", Sample.model_fields)
+
+
+def test_rows_serialize_like_the_schema():
+    expected = Sample(**dict(zip(Sample.model_fields, ROW))).model_dump(mode="json")
+    assert sample_rows(ROW) == expected
+    assert ujson.loads(ujson.dumps(sample_rows(ROW))) == expected
+    filled = (*ROW[:4], Colour.RED, ROW[5], datetime(2024, 1, 3), ROW[7])
+    assert sample_rows(filled) == Sample(**dict(zip(Sample.model_fields, filled))).model_dump(mode="json")
+
+
+def test_objects_serialize_through_their_attributes():
+    class Only(BaseModel):
+        id: int
+
+    sample = Sample(**dict(zip(Sample.model_fields, ROW)))
+    assert sample_rows.from_object(sample) == sample.model_dump(mode="json")
+    # A single field still yields a row of one
+    assert RowSerializer(Only).from_object(sample) == {"id": 1}
+    assert sample_rows.columns(sample) == list(ROW)
+
+
+@pytest.mark.parametrize("count, has_next", [(2, False), (3, True)])
+def test_page_response_trims_the_lookahead_row(count, has_next):
+    # Keyset cursors read rows by attribute, as database rows allow
+    rows = [SampleRow(i, *ROW[1:5], datetime(2024, 1, 1, minute=i), *ROW[6:]) for i in range(count)]
+    page = ujson.loads(page_response(rows, 2, sample_rows).body)
+    assert [item["id"] for item in page["items"]] == [0, 1]
+    assert (page["next_cursor"] is not None) is has_next
+
+
+def orm_dump(schema, model, row_id):
+    with SessionLocal() as db:
+        return schema.model_validate(db.get(model, row_id), from_attributes=True).model_dump(mode="json")
+
+
+def test_list_endpoints_match_the_response_schemas(client, make_user):
+    seller, seller_headers = make_user("seller")
+    _, buyer = make_user("buyer")
+    offer = client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": 100,
+    }, headers=seller_headers).json()
+    trade = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 0.5}, headers=buyer).json()
+    client.post(f"/api/trades/{trade['trade_id']}/messages", json={"content": "hi"}, headers=buyer)
+    wallet = client.post("/api/wallets/", json={"currency": "BTC", "wallet_address": "addr"},
+                         headers=seller_headers).json()
+    client.post(f"/api/wallets/{wallet['id']}/transactions", json={
+        "amount": 1, "transaction_type": "deposit", "reference_id": "dep",
+    }, headers=seller_headers)
+
+    lists = [
+        ("/api/offers/", {}, offer_schemas.Offer, models.Offer),
+        ("/api/wallets/", seller_headers, wallet_schemas.Wallet, models.Wallet),
+        (f"/api/wallets/{wallet['id']}/transactions", seller_headers, wallet_schemas.Transaction, models.Transaction),
+        (f"/api/trades/{trade['trade_id']}/messages", buyer, trade_schemas.TradeMessage, models.TradeMessage),
+    ]
+    for url, headers, schema, model in lists:
+        response = client.get(url, headers=headers)
+        [item] = response.json()["items"]
+        assert item == orm_dump(schema, model, item["id"]), url
+    assert client.get(f"/api/users/{seller.id}").json() == orm_dump(user_schemas.User, models.User, seller.id)
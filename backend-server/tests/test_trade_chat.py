@@ -0,0 +1,84 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+from app.core import pagination, security
+from app.database import SessionLocal
+from app.models import models
+
+
+@pytest.fixture
+def chat(client, make_user):
+    """A trade between a seller and a buyer, with headers for both and an outsider."""
+    _, seller = make_user("seller")
+    buyer_user, buyer = make_user("buyer")
+    _, outsider = make_user("outsider")
+    offer = client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1, "price_per_unit": 100,
+    }, headers=seller).json()
+    trade = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 0.5}, headers=buyer).json()
+    return trade["trade_id"], seller, buyer, outsider, buyer_user
+
+
+def post(client, trade_id, headers, content):
+    return client.post(f"/api/trades/{trade_id}/messages", json={"content": content}, headers=headers).json()
+
+
+def token(headers):
+    return headers["Authorization"].partition(" ")[2]
+
+
+def contents(websocket, count):
+    frames = [websocket.receive_json() for _ in range(count)]
+    assert {frame["type"] for frame in frames} == {"message"}
+    return [frame["data"]["content"] for frame in frames]
+
+
+def test_query_token_gets_history_then_live_messages(client, chat):
+    trade_id, seller, buyer, _, _ = chat
+    post(client, trade_id, seller, "hello")
+    with client.websocket_connect(f"/api/trades/{trade_id}/ws?token={token(buyer)}") as websocket:
+        assert contents(websocket, 1) == ["hello"]
+        post(client, trade_id, seller, "still there?")
+        assert contents(websocket, 1) == ["still there?"]
+
+
+def test_authorization_header_is_accepted(client, chat):
+    trade_id, seller, _, _, _ = chat
+    post(client, trade_id, seller, "hello")
+    with client.websocket_connect(f"/api/trades/{trade_id}/ws", headers=seller) as websocket:
+        assert contents(websocket, 1) == ["hello"]
+
+
+def refused(client, url, **kwargs):
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect(url, **kwargs) as websocket:
+            websocket.receive_json()
+    return exc_info.value.code
+
+
+def test_outsiders_and_bad_tokens_are_refused(client, chat):
+    trade_id, _, buyer, outsider, buyer_user = chat
+    url = f"/api/trades/{trade_id}/ws"
+    assert refused(client, url, headers=outsider) == 1008
+    assert refused(client, url) == 1008
+    assert refused(client, f"{url}?token=not-a-jwt") == 1008
+    assert refused(client, "/api/trades/no-such-trade/ws", headers=buyer) == 1008
+    # The header is only read when there is no ?token=
+    assert refused(client, f"{url}?token={token(outsider)}", headers=buyer) == 1008
+    # A participant who was blocked is refused too
+    with SessionLocal() as db:
+        db.get(models.User, buyer_user.id).is_blocked = True
+        db.commit()
+    security.invalidate_principal(buyer_user.email)
+    assert refused(client, url, headers=buyer) == 1008
+
+
+def test_replay_starts_after_last_id_across_pages(client, chat, monkeypatch):
+    monkeypatch.setattr(pagination, "DEFAULT_PAGE_SIZE", 2)
+    trade_id, seller, buyer, _, _ = chat
+    sent = [post(client, trade_id, seller if i % 2 else buyer, f"message {i}") for i in range(6)]
+    url = f"/api/trades/{trade_id}/ws?token={token(buyer)}&last_id={sent[0]['id']}"
+    with client.websocket_connect(url) as websocket:
+        assert contents(websocket, 5) == [f"message {i}" for i in range(1, 6)]
+        post(client, trade_id, seller, "live")
+        # Only the new message follows; nothing replayed comes twice
+        assert contents(websocket, 1) == ["live"]
@@ -0,0 +1,70 @@
+import pytest
+from app.routers import trades as trades_router
+
+
+@pytest.fixture
+def desk(client, make_user):
+    """Adds trades on one offer, each with a few chat messages, and returns the parties' headers."""
+    _, seller = make_user("seller")
+    _, buyer = make_user("buyer")
+    offer = client.post("/api/offers/", json={
+        "currency": "BTC", "min_amount": 0.1, "max_amount": 1000, "price_per_unit": 100,
+    }, headers=seller).json()
+
+    def add(count, messages=3):
+        created = []
+        for _ in range(count):
+            trade = client.post("/api/trades/", json={"offer_id": offer["id"], "amount": 1}, headers=buyer).json()
+            for i in range(messages):
+                client.post(f"/api/trades/{trade['trade_id']}/messages", json={"content": f"message {i}"},
+                            headers=seller if i % 2 else buyer)
+            created.append(trade)
+        return created
+
+    return add, seller, buyer
+
+
+def statements(client, headers, **params):
+    response = client.get("/api/trades/", params=params, headers={**headers, "X-Profile": "sql"})
+    assert response.status_code == 200
+    return int(response.headers["x-profile-statements"])
+
+
+@pytest.mark.parametrize("params", [{}, {"include": "messages"}])
+def test_statement_count_does_not_grow_with_the_page(client, desk, params):
+    add, _, buyer = desk
+    add(2)
+    few = statements(client, buyer, **params)
+    add(10)
+    assert statements(client, buyer, **params) == few
+
+
+def test_summaries_carry_counts_and_the_last_message(client, desk):
+    add, seller, buyer = desk
+    [quiet] = add(1, messages=0)
+    [chatty] = add(1)
+    for headers in (buyer, seller):
+        items = {item["trade_id"]: item for item in client.get("/api/trades/", headers=headers).json()["items"]}
+        assert items[chatty["trade_id"]]["message_count"] == 3
+        assert items[chatty["trade_id"]]["last_message"]["content"] == "message 2"
+        assert items[chatty["trade_id"]]["messages"] is None
+        assert (items[quiet["trade_id"]]["message_count"], items[quiet["trade_id"]]["last_message"]) == (0, None)
+
+
+def test_include_messages_returns_each_trades_latest_messages(client, desk, monkeypatch):
+    monkeypatch.setattr(trades_router, "SUMMARY_MESSAGES", 2)
+    add, _, buyer = desk
+    [quiet] = add(1, messages=0)
+    first, second = add(2, messages=4)
+    items = {
+        item["trade_id"]: item
+        for item in client.get("/api/trades/", params={"include": "messages"}, headers=buyer).json()["items"]
+    }
+    for trade in (first, second):
+        item = items[trade["trade_id"]]
+        # Oldest first, cut to the latest SUMMARY_MESSAGES; the count still covers them all
+        assert [message["content"] for message in item["messages"]] == ["message 2", "message 3"]
+        assert {message["trade_id"] for message in item["messages"]} == {trade["id"]}
+        assert item["last_message"] == item["messages"][-1] and item["message_count"] == 4
+    assert items[quiet["trade_id"]]["messages"] == []
+    assert client.get("/api/trades/", params={"include": "offers"}, headers=buyer).status_code == 422